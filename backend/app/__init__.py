@@ -1,63 +1,90 @@
+import time
+
+_import_started = time.perf_counter()
+
 from flask import Flask
-from dotenv import load_dotenv
-import os
 import logging
 
-# Optional import for Google Generative AI (Gemini). If unavailable, LLM features
-# will be disabled but the rest of the app should still run.
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None
-    logging.getLogger(__name__).warning("google.generativeai not installed; LLM features disabled.")
-
-# --- Load environment variables ---
-load_dotenv()
-
-# --- Configure Gemini API only if client is available and key present ---
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-# model can be overridden in env; default is kept
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-
-if genai is not None:
-    if GEMINI_API_KEY:
-        try:
-            genai.configure(api_key=GEMINI_API_KEY)
-            logging.getLogger(__name__).info("Configured google.generativeai client.")
-        except Exception:
-            # If configuration fails, disable genai to avoid crashing the app.
-            logging.getLogger(__name__).exception("Failed to configure google.generativeai; disabling LLM features.")
-            genai = None
-    else:
-        logging.getLogger(__name__).warning("GEMINI_API_KEY not set; LLM features disabled.")
+from .settings import gemini_client, get_settings, preload, warm_up
+
+logger = logging.getLogger(__name__)
+
+# --- Load environment variables (once per worker) ---
+# not named ``settings``: that would shadow the ``app.settings`` submodule
+_SETTINGS = get_settings()
+
+# google.generativeai is imported on first use (see settings.get_gemini_model):
+# it accounts for most of the app's import time, which cold starts pay for.
+GEMINI_API_KEY = _SETTINGS.gemini_api_key
+GEMINI_MODEL = _SETTINGS.gemini_model
+
+if not GEMINI_API_KEY:
+    logger.warning("GEMINI_API_KEY not set; LLM features disabled.")
 
 from flask_cors import CORS
 
+# Seconds spent importing the app package; logged by create_app()
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+
+def create_app(warm=True):
+    """Build the Flask app.
 
-def create_app():
+    Args:
+        warm (bool | str): True builds clients and loads caches now (single
+            process, e.g. ``run.py``). ``"preload"`` only does the fork-safe
+            part, for gunicorn's ``preload_app``: shared caches are loaded
+            once in the master and workers call ``warm_up()`` after forking
+            (see ``gunicorn.conf.py``). False skips both.
+    """
+    started = time.perf_counter()
     app = Flask(__name__)
 
     # Store Gemini configuration in app.config so routes can detect availability
+    app.config["SETTINGS"] = _SETTINGS
     app.config["GEMINI_API_KEY"] = GEMINI_API_KEY
     app.config["GEMINI_MODEL"] = GEMINI_MODEL
-    app.config["GEMINI_CLIENT"] = genai
+    # this process's GenerativeModel, or None without a key. Under
+    # preload_app the master has none; each worker sets it after forking.
+    app.config["GEMINI_CLIENT"] = None if warm == "preload" else gemini_client()
 
     # --- Register Blueprints ---
     from .routes import bp
     from .itinerary_routes import itinerary_bp
 
-    frontend_origin = os.environ.get("FRONTEND_URL")
+    frontend_origin = _SETTINGS.frontend_url
+    # the frontend reads ETag to revalidate, Server-Timing for profiling and
+    # Retry-After when the server is busy
+    exposed = ["ETag", "Server-Timing", "Retry-After"]
     if frontend_origin:
-        CORS(app, resources={r"/api/*": {"origins": frontend_origin}})
+        CORS(app, resources={r"/api/*": {"origins": frontend_origin}}, expose_headers=exposed)
     else:
         # dev fallback: allow all (only in development)
-        CORS(app)
+        CORS(app, expose_headers=exposed)
 
     app.register_blueprint(bp, url_prefix='/api')
     app.register_blueprint(itinerary_bp, url_prefix='/api')
 
+    # Request timings (Server-Timing header, /api/metrics)
+    from .metrics import init_app as init_metrics
+    init_metrics(app)
+    # Bounded slow endpoints and LLM calls; 429/503 with Retry-After when full
+    from .admission import init_app as init_admission
+    init_admission(app)
+    # ETags/304s, Cache-Control and compression for complete responses
+    from .http_cache import init_app as init_http_cache
+    init_http_cache(app)
+
     @app.route('/')
     def home():
         return {'message': 'Flask backend is running'}
 
+    # Load shared caches and build clients now rather than on the first request
+    if warm:
+        preload()
+        if warm != "preload":
+            warm_up(app)
+
+    logger.info("Startup: import %.0f ms, create_app %.0f ms", IMPORT_SECONDS * 1000,
+                (time.perf_counter() - started) * 1000)
     return app
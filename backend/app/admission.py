@@ -0,0 +1,269 @@
+"""Admission control for slow endpoints and Gemini calls
+
+Two kinds of bounded pools, per worker process:
+
+- endpoint pools: ``/api/generate_itinerary`` (and its batch variant) may
+  hold at most ``ITINERARY_MAX_CONCURRENCY`` of the worker's threads, by
+  default all but ``FAST_RESERVED_THREADS`` of ``GUNICORN_THREADS``. Over
+  that they are turned away at once with 503, so geocode, routing and stats
+  requests always find a free thread;
+- the LLM pool: at most ``LLM_MAX_CONCURRENCY`` Gemini calls at a time, with
+  up to ``LLM_MAX_QUEUE`` callers waiting at most ``LLM_QUEUE_TIMEOUT_S`` for
+  a slot. A full queue or an expired wait is answered with 503.
+
+Gemini quota errors are answered with 429 instead of the sample itinerary,
+and further LLM calls are refused for ``LLM_QUOTA_COOLDOWN_S`` rather than
+spending more quota. Every rejection carries ``Retry-After``.
+"""
+import asyncio
+import contextlib
+import logging
+import math
+import os
+import threading
+import time
+
+from .metrics import inc
+
+logger = logging.getLogger(__name__)
+
+# Threads per worker kept free of slow endpoints
+FAST_RESERVED_THREADS = int(os.getenv("FAST_RESERVED_THREADS", "2"))
+ITINERARY_MAX_CONCURRENCY = int(os.getenv(
+    "ITINERARY_MAX_CONCURRENCY",
+    str(max(1, int(os.getenv("GUNICORN_THREADS", "8")) - FAST_RESERVED_THREADS))))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "8"))
+LLM_QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", "10"))
+LLM_QUOTA_COOLDOWN_S = float(os.getenv("LLM_QUOTA_COOLDOWN_S", "30"))
+# async waiters re-check for a free slot this often
+POLL_INTERVAL_S = 0.05
+
+
+class Overloaded(Exception):
+    """Request refused to protect the service; answered with ``status``."""
+
+    status = 503
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class Saturated(Overloaded):
+    """No slot free in a pool, and none became free in time."""
+
+
+class QuotaExceeded(Overloaded):
+    """The upstream model refused the call for quota reasons."""
+
+    status = 429
+
+
+def is_quota_error(error):
+    """Whether ``error`` is a Gemini quota / rate-limit refusal (HTTP 429)."""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    return type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+class ConcurrencyPool:
+    """At most ``limit`` holders, at most ``max_queue`` waiting for ``timeout`` s.
+
+    Slots are per process. New callers don't overtake queued ones.
+    """
+
+    def __init__(self, name, limit, max_queue=0, timeout=0.0):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._blocked_until = 0.0
+        # smoothed slot hold time, for Retry-After estimates
+        self._hold_s = 1.0
+
+    def _retry_after(self):
+        return self._hold_s * (self.waiting + 1) / self.limit
+
+    def _reject(self, reason):
+        self.rejected += 1
+        inc("admission_rejected_total", pool=self.name, reason=reason)
+        return Saturated(f"{self.name} is busy, retry later", self._retry_after())
+
+    def _check_blocked(self):
+        remaining = self._blocked_until - time.time()
+        if remaining > 0:
+            self.rejected += 1
+            inc("admission_rejected_total", pool=self.name, reason="quota")
+            raise QuotaExceeded(f"{self.name} quota exhausted, retry later", remaining)
+
+    def _enter(self, queued):
+        # caller holds the lock
+        if self.active < self.limit and (queued or self.waiting == 0):
+            self.active += 1
+            return True
+        return False
+
+    def _join_queue(self):
+        self._check_blocked()
+        if self._enter(False):
+            return False
+        if self.waiting >= self.max_queue:
+            raise self._reject("queue_full")
+        self.waiting += 1
+        return True
+
+    def acquire(self):
+        """Take a slot, waiting up to ``timeout``; raises ``Overloaded``."""
+        with self._cond:
+            if not self._join_queue():
+                return
+            deadline = time.monotonic() + self.timeout
+            try:
+                while not self._enter(True):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise self._reject("timeout")
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+    async def aacquire(self):
+        """``acquire`` for coroutines; waits without holding a thread."""
+        with self._cond:
+            if not self._join_queue():
+                return
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                with self._cond:
+                    if self._enter(True):
+                        return
+                    if time.monotonic() >= deadline:
+                        self.timeouts += 1
+                        raise self._reject("timeout")
+                await asyncio.sleep(POLL_INTERVAL_S)
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def release(self, held_s=None):
+        with self._cond:
+            self.active -= 1
+            if held_s is not None:
+                self._hold_s = 0.8 * self._hold_s + 0.2 * held_s
+            self._cond.notify()
+
+    def block(self, seconds):
+        """Refuse every acquire for ``seconds`` (e.g. after a quota error)."""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.time() + seconds)
+
+    def stats(self):
+        with self._cond:
+            return {"limit": self.limit, "active": self.active, "waiting": self.waiting,
+                    "max_queue": self.max_queue, "rejected": self.rejected,
+                    "timeouts": self.timeouts,
+                    "blocked_s": max(0.0, round(self._blocked_until - time.time(), 1))}
+
+
+llm_pool = ConcurrencyPool("llm", LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT_S)
+itinerary_pool = ConcurrencyPool("itinerary", ITINERARY_MAX_CONCURRENCY)
+pools = {p.name: p for p in (llm_pool, itinerary_pool)}
+# Endpoints admitted through a pool; the rest are never limited
+ENDPOINT_POOLS = {
+    "itinerary.generate_itinerary_route": itinerary_pool,
+    "itinerary.generate_itinerary_batch_route": itinerary_pool,
+}
+
+
+def _quota_refusal(error):
+    logger.warning("Gemini quota exceeded, pausing LLM calls for %.0fs: %s", LLM_QUOTA_COOLDOWN_S, error)
+    llm_pool.block(LLM_QUOTA_COOLDOWN_S)
+    return QuotaExceeded("Model quota exceeded, retry later", LLM_QUOTA_COOLDOWN_S)
+
+
+@contextlib.contextmanager
+def llm_slot():
+    """Hold an LLM pool slot around a Gemini call; quota errors become ``QuotaExceeded``."""
+    llm_pool.acquire()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if is_quota_error(e):
+            raise _quota_refusal(e) from e
+        raise
+    finally:
+        llm_pool.release(time.perf_counter() - started)
+
+
+@contextlib.asynccontextmanager
+async def allm_slot():
+    """Async variant of ``llm_slot``."""
+    await llm_pool.aacquire()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if is_quota_error(e):
+            raise _quota_refusal(e) from e
+        raise
+    finally:
+        llm_pool.release(time.perf_counter() - started)
+
+
+def admission_stats():
+    return {name: p.stats() for name, p in pools.items()}
+
+
+def overloaded_payload(error):
+    return {'error': str(error), 'retry_after': int(error.retry_after_header)}
+
+
+def init_app(app):
+    """Admit pooled endpoints and turn ``Overloaded`` into 429/503 responses."""
+    from flask import g, jsonify, request
+
+    @app.errorhandler(Overloaded)
+    def _overloaded(error):
+        response = jsonify(overloaded_payload(error))
+        response.status_code = error.status
+        response.headers["Retry-After"] = error.retry_after_header
+        return response
+
+    @app.before_request
+    def _admit():
+        pool = ENDPOINT_POOLS.get(request.endpoint)
+        if pool is not None:
+            pool.acquire()
+            g.admission = (pool, time.perf_counter())
+
+    @app.after_request
+    def _hand_over(response):
+        # streamed bodies keep the slot until they have been sent
+        admitted = g.pop("admission", None)
+        if admitted is not None:
+            pool, started = admitted
+            if response.is_streamed:
+                response.call_on_close(lambda: pool.release(time.perf_counter() - started))
+            else:
+                pool.release(time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def _release(_exc):
+        # the view failed before a response was made
+        admitted = g.pop("admission", None)
+        if admitted is not None:
+            admitted[0].release(time.perf_counter() - admitted[1])
@@ -0,0 +1,479 @@
+"""Cache layer shared by the map services.
+
+Two tiers:
+    - ``TTLCache``: per-process, thread-safe in-memory LRU with expiry.
+    - ``SqliteStore``: a single SQLite file in WAL mode, shared safely by every
+      gunicorn worker. Reads and writes touch only the requested keys.
+
+``TieredCache`` puts the first in front of the second under a namespace, so
+each kind of cached data (geocodes, routes, ...) gets its own keyspace, TTL
+and counters.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH") or str(BASE_DIR / "cache.sqlite3")
+
+# Sentinel for "not cached" so that falsy values can be cached too.
+MISSING = object()
+# Keys per query in SqliteStore.get_many
+GET_MANY_CHUNK = 500
+
+
+def normalize_key(text):
+    """Case/whitespace/unicode-insensitive form of a cache key component."""
+    text = unicodedata.normalize("NFKC", str(text or ""))
+    return " ".join(text.casefold().split())
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    Args:
+        maxsize (int): Maximum number of entries before the least recently
+            used one is evicted.
+        ttl (float | None): Default time-to-live in seconds, None for no expiry.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at | None, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=MISSING):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SqliteStore:
+    """Namespaced key/value store backed by one SQLite database in WAL mode.
+
+    Connections are opened per thread and per process, so the store is safe to
+    create before gunicorn forks its workers. Values are stored as JSON.
+    """
+
+    def __init__(self, path=CACHE_DB_PATH, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+
+    def connection(self):
+        """Return this thread's connection to the database (autocommit mode)."""
+        return self._conn()
+
+    def _conn(self):
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == pid:
+            return conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        self._local.conn = conn
+        self._local.pid = pid
+        return conn
+
+    def get(self, namespace, key):
+        """Return ``(value, expires_at)`` for a live entry, or MISSING."""
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time()),
+        ).fetchone()
+        if row is None:
+            return MISSING
+        return json.loads(row[0]), row[1]
+
+    def get_many(self, namespace, keys):
+        """Return ``{key: (value, expires_at)}`` for the live entries among ``keys``."""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        conn = self._conn()
+        now = time.time()
+        # stay well below SQLite's bound-parameter limit
+        for start in range(0, len(keys), GET_MANY_CHUNK):
+            chunk = keys[start:start + GET_MANY_CHUNK]
+            rows = conn.execute(
+                "SELECT key, value, expires_at FROM cache WHERE namespace = ?"
+                f" AND key IN ({','.join('?' * len(chunk))})"
+                " AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, *chunk, now),
+            ).fetchall()
+            for key, value, expires_at in rows:
+                found[key] = (json.loads(value), expires_at)
+        return found
+
+    def set(self, namespace, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), expires_at, now),
+        )
+        self._writes += 1
+        # purge expired rows every so often instead of on every write
+        if random.random() < 1 / 256:
+            self.purge_expired()
+
+    def set_many(self, namespace, items, ttl=None, replace=True):
+        """Write several ``(key, value)`` pairs in a single transaction."""
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                f"{verb} INTO cache (namespace, key, value, expires_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(namespace, k, json.dumps(v), expires_at, now) for k, v in items],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, namespace, key):
+        self._conn().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def trim(self, namespace, max_rows):
+        """Delete the least recently written rows beyond ``max_rows``."""
+        self._conn().execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            " SELECT key FROM cache WHERE namespace = ?"
+            " ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (namespace, namespace, int(max_rows)),
+        )
+
+    def scan(self, namespace, prefix="", limit=None, expiry=False):
+        """Return ``[(key, value), ...]`` for live entries, most recent first.
+
+        With ``expiry`` each row is ``(key, value, expires_at)``.
+        """
+        rows = self._conn().execute(
+            "SELECT key, value, expires_at FROM cache WHERE namespace = ? AND key >= ? AND key < ?"
+            " AND (expires_at IS NULL OR expires_at > ?) ORDER BY updated_at DESC LIMIT ?",
+            (namespace, prefix, prefix + "\uffff", time.time(), -1 if limit is None else int(limit)),
+        ).fetchall()
+        if expiry:
+            return [(key, json.loads(value), expires_at) for key, value, expires_at in rows]
+        return [(key, json.loads(value)) for key, value, _ in rows]
+
+    def count(self, namespace):
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def purge_expired(self):
+        try:
+            self._conn().execute(
+                "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            )
+        except sqlite3.Error:
+            logger.exception("Failed to purge expired cache rows")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide shared ``SqliteStore``."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SqliteStore()
+    return _store
+
+
+# Every TieredCache registers itself here so stats can be reported in one place.
+registry = {}
+
+
+class TieredCache:
+    """In-memory LRU/TTL tier in front of the shared SQLite store.
+
+    Args:
+        namespace (str): Keyspace inside the shared store.
+        maxsize (int): Entries kept in the per-process memory tier.
+        ttl (float | None): Time-to-live in seconds for both tiers.
+        store (SqliteStore | None): Persistent tier, defaults to the shared store.
+        max_entries (int | None): Rows kept in the persistent tier; the least
+            recently written are trimmed beyond that.
+    """
+
+    def __init__(self, namespace, maxsize=1024, ttl=None, store=None, max_entries=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._store = store
+        self.store_hits = 0
+        self.store_misses = 0
+        self.store_errors = 0
+        registry[namespace] = self
+
+    @property
+    def store(self):
+        return self._store or get_store()
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+        try:
+            found = self.store.get(self.namespace, key)
+        except sqlite3.Error:
+            self.store_errors += 1
+            logger.exception("Cache store read failed for %s", self.namespace)
+            return default
+        if found is MISSING:
+            self.store_misses += 1
+            return default
+        self.store_hits += 1
+        value, expires_at = found
+        ttl = max(0.0, expires_at - time.time()) if expires_at is not None else None
+        self.memory.set(key, value, ttl=ttl)
+        return value
+
+    def get_many(self, keys):
+        """Return ``{key: value}`` for the cached entries among ``keys``.
+
+        Keys missing from memory are read from the store in one query.
+        """
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value = self.memory.get(key)
+            if value is MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if not missing:
+            return found
+        try:
+            rows = self.store.get_many(self.namespace, missing)
+        except sqlite3.Error:
+            self.store_errors += 1
+            logger.exception("Cache store read failed for %s", self.namespace)
+            return found
+        self.store_hits += len(rows)
+        self.store_misses += len(missing) - len(rows)
+        now = time.time()
+        for key, (value, expires_at) in rows.items():
+            ttl = max(0.0, expires_at - now) if expires_at is not None else None
+            self.memory.set(key, value, ttl=ttl)
+            found[key] = value
+        return found
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.memory.set(key, value, ttl=ttl)
+        try:
+            self.store.set(self.namespace, key, value, ttl=ttl)
+            # trimming scans the namespace, so only do it every so often
+            if self.max_entries and random.random() < 1 / 64:
+                self.store.trim(self.namespace, self.max_entries)
+        except sqlite3.Error:
+            # the memory tier still serves this process; other workers will miss
+            self.store_errors += 1
+            logger.exception("Cache store write failed for %s", self.namespace)
+
+    def preload(self, limit=None):
+        """Fill the memory tier with the most recently written store entries.
+
+        Run in the gunicorn master before forking, the entries are shared by
+        all workers copy-on-write instead of each reading them again.
+
+        Returns:
+            int: Number of entries loaded
+        """
+        limit = self.memory.maxsize if limit is None else min(limit, self.memory.maxsize)
+        try:
+            rows = self.store.scan(self.namespace, limit=limit, expiry=True)
+        except sqlite3.Error:
+            self.store_errors += 1
+            logger.exception("Cache preload failed for %s", self.namespace)
+            return 0
+        now = time.time()
+        # oldest first, so the most recent entries end up most recently used
+        for key, value, expires_at in reversed(rows):
+            ttl = max(0.0, expires_at - now) if expires_at is not None else None
+            self.memory.set(key, value, ttl=ttl)
+        return len(rows)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        try:
+            self.store.delete(self.namespace, key)
+        except sqlite3.Error:
+            self.store_errors += 1
+            logger.exception("Cache store delete failed for %s", self.namespace)
+
+    def stats(self):
+        mem = self.memory.stats()
+        return {
+            "namespace": self.namespace,
+            "ttl": self.ttl,
+            "memory": mem,
+            "store_hits": self.store_hits,
+            "store_misses": self.store_misses,
+            "store_errors": self.store_errors,
+            # a lookup is a hit if either tier answered it
+            "hits": mem["hits"] + self.store_hits,
+            "misses": self.store_misses,
+            "evictions": mem["evictions"],
+        }
+
+
+def cache_stats():
+    """Return counters for every registered cache, keyed by namespace."""
+    return {name: c.stats() for name, c in registry.items()}
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution.
+
+    Threads asking for a key that is already being computed wait for that
+    call and get its result (or exception) instead of repeating the work.
+    Coalescing is per process; the shared cache covers the other workers.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+def import_legacy_json(cache, path, key_func=None):
+    """One-off import of a legacy ``{key: value}`` JSON cache file.
+
+    Existing entries are kept; null values are skipped. A marker row makes
+    sure the file is only parsed once across all workers.
+
+    Args:
+        cache (TieredCache): Destination cache.
+        path (str | Path): JSON file to import.
+        key_func (callable | None): Maps a legacy key to the cache key.
+    """
+    path = Path(path)
+    marker = f"legacy_import:{cache.namespace}:{path.name}"
+    store = cache.store
+    try:
+        if store.get("__meta__", marker) is not MISSING or not path.exists():
+            return 0
+        with open(path, "r", encoding="utf-8") as fh:
+            data = json.load(fh) or {}
+        key_func = key_func or (lambda k: k)
+        items = [(key_func(k), v) for k, v in data.items() if v is not None]
+        store.set_many(cache.namespace, items, ttl=cache.ttl, replace=False)
+        store.set("__meta__", marker, {"imported": len(items), "at": time.time()})
+        return len(items)
+    except (OSError, ValueError, sqlite3.Error):
+        logger.exception("Failed to import legacy cache file %s", path)
+        return 0
@@ -0,0 +1,133 @@
+"""Offline travel-time estimator
+
+Estimates travel between coordinates from great-circle distance, without any
+network call: ``duration = haversine * detour / speed``. It is the fast path
+for the optimizer's travel-time matrix and the degraded-mode answer when ORS
+is unavailable or no API key is configured.
+
+The per-profile speed and detour factors start from conservative defaults
+and are recalibrated from real routes in the route cache (each cached leg
+keeps its endpoints): the detour is the median ratio of routed to straight
+distance, the speed the median routed distance over duration.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from .cache import get_store
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000.0
+# (speed m/s, detour factor over straight-line distance) per routing profile
+DEFAULT_PROFILE_SPEEDS = {
+    "foot-walking": (1.3, 1.3),
+    "driving-car": (8.3, 1.4),
+}
+# Plausible bounds; calibrated values outside them are clipped
+SPEED_BOUNDS = {"foot-walking": (0.8, 2.0), "driving-car": (3.0, 25.0)}
+DETOUR_BOUNDS = (1.0, 2.5)
+CALIBRATION_MIN_SAMPLES = int(os.getenv("ESTIMATOR_MIN_SAMPLES", "20"))
+CALIBRATION_MAX_SAMPLES = int(os.getenv("ESTIMATOR_MAX_SAMPLES", "5000"))
+CALIBRATION_TTL = float(os.getenv("ESTIMATOR_CALIBRATION_TTL", "3600"))
+# Legs shorter than this are dominated by snapping to the road network
+MIN_CALIBRATION_DISTANCE_M = 100.0
+
+_calibration = {}
+_calibrated_at = 0.0
+_calibration_lock = threading.Lock()
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters; arguments broadcast like NumPy arrays."""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(lats, lngs):
+    """Pairwise great-circle distances in meters, vectorized."""
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    return haversine_m(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :])
+
+
+def calibrate(store=None):
+    """Fit (speed, detour) per profile from cached routes.
+
+    Profiles with fewer than ``CALIBRATION_MIN_SAMPLES`` usable legs keep
+    their defaults.
+
+    Returns:
+        dict: profile -> {'speed', 'detour', 'samples'}
+    """
+    store = store or get_store()
+    fitted = {}
+    for profile, (speed, detour) in DEFAULT_PROFILE_SPEEDS.items():
+        try:
+            rows = store.scan("route", prefix=f"{profile}|", limit=CALIBRATION_MAX_SAMPLES)
+        except sqlite3.Error:
+            logger.exception("Could not read cached routes for calibration")
+            rows = []
+        legs = [v for _, v in rows if isinstance(v, dict) and v.get('start') and v.get('end')
+                and v.get('distance') and v.get('duration')]
+        samples = 0
+        if legs:
+            start = np.array([leg['start'] for leg in legs], dtype=float)
+            end = np.array([leg['end'] for leg in legs], dtype=float)
+            distance = np.array([leg['distance'] for leg in legs], dtype=float)
+            duration = np.array([leg['duration'] for leg in legs], dtype=float)
+            straight = haversine_m(start[:, 0], start[:, 1], end[:, 0], end[:, 1])
+            usable = (straight >= MIN_CALIBRATION_DISTANCE_M) & (duration > 0)
+            samples = int(usable.sum())
+            if samples >= CALIBRATION_MIN_SAMPLES:
+                speed = float(np.clip(np.median(distance[usable] / duration[usable]),
+                                      *SPEED_BOUNDS.get(profile, (0.5, 40.0))))
+                detour = float(np.clip(np.median(distance[usable] / straight[usable]), *DETOUR_BOUNDS))
+        fitted[profile] = {"speed": round(speed, 3), "detour": round(detour, 3), "samples": samples}
+    return fitted
+
+
+def profile_factors(profile):
+    """Return (speed m/s, detour factor) for ``profile``, recalibrating hourly."""
+    global _calibration, _calibrated_at
+    if time.time() - _calibrated_at > CALIBRATION_TTL:
+        with _calibration_lock:
+            if time.time() - _calibrated_at > CALIBRATION_TTL:
+                _calibration = calibrate()
+                _calibrated_at = time.time()
+    fitted = _calibration.get(profile)
+    if fitted is None:
+        return DEFAULT_PROFILE_SPEEDS.get(profile, DEFAULT_PROFILE_SPEEDS["foot-walking"])
+    return fitted["speed"], fitted["detour"]
+
+
+def travel_time_matrix(points, profile="foot-walking"):
+    """Estimated pairwise travel times in seconds between ``points`` ({'lat', 'lng'})."""
+    speed, detour = profile_factors(profile)
+    lats = [float(p['lat']) for p in points]
+    lngs = [float(p['lng']) for p in points]
+    return haversine_matrix(lats, lngs) * detour / speed
+
+
+def estimate_leg(profile, start_coords, end_coords):
+    """Estimated leg in the same shape as a routed one.
+
+    The polyline is the straight line between the endpoints and the leg is
+    flagged ``estimated`` so clients can draw it differently.
+    """
+    speed, detour = profile_factors(profile)
+    slat, slng = float(start_coords['lat']), float(start_coords['lng'])
+    elat, elng = float(end_coords['lat']), float(end_coords['lng'])
+    distance = float(haversine_m(slat, slng, elat, elng)) * detour
+    return {"duration": round(distance / speed, 1), "distance": round(distance, 1),
+            "polyline": [[slat, slng], [elat, elng]], "estimated": True}
+
+
+def estimator_stats():
+    """Current calibration, for diagnostics."""
+    return {profile: dict(fitted) for profile, fitted in _calibration.items()}
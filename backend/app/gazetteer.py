@@ -0,0 +1,292 @@
+"""Offline gazetteer
+
+An optional local place database, consulted before any upstream geocoder.
+It is a SQLite file (``GAZETTEER_PATH``) with a ``places`` table and an FTS5
+index over normalized names (case-folded, diacritics and punctuation
+stripped), built from an OSM POI extract with the import command:
+
+    python -m app.gazetteer import pois.geojson --db gazetteer.sqlite3
+    python -m app.gazetteer import pois.csv --db gazetteer.sqlite3 --city Paris --country FR
+    python -m app.gazetteer lookup "Musée du Louvre" --city Paris
+
+GeoJSON input is a FeatureCollection of points with ``name`` (and
+optionally ``addr:city``, ``addr:country``, ``tourism``/``amenity``)
+properties, as exported by osmium or Overpass. CSV input needs ``name``,
+``lat`` and ``lon`` columns, and may have ``city``, ``country`` and
+``kind``.
+
+Candidates from the FTS index are scored with a fuzzy name similarity; only
+matches scoring at least ``GAZETTEER_MIN_SCORE`` are returned.
+"""
+import argparse
+import csv
+import difflib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH")
+GAZETTEER_MIN_SCORE = float(os.getenv("GAZETTEER_MIN_SCORE", "0.85"))
+# FTS candidates scored per lookup
+CANDIDATE_LIMIT = 25
+# Words that don't help tell places apart
+STOPWORDS = frozenset({"the", "le", "la", "les", "l", "el", "il", "der", "die", "das", "du", "de", "des",
+                       "d", "of", "and", "et", "y", "di", "del", "della"})
+# Place-type words, which the model and OSM often word differently
+# ("Louvre Museum" / "Musée du Louvre"); matched names need not share them
+GENERIC_WORDS = frozenset({
+    "museum", "musee", "museo", "gallery", "galerie", "park", "parc", "parque", "garden", "gardens",
+    "jardin", "church", "eglise", "cathedral", "cathedrale", "basilica", "basilique", "tower", "tour",
+    "bridge", "pont", "square", "place", "plaza", "market", "marche", "mercado", "palace", "palais",
+    "restaurant", "cafe", "bar", "bistro", "castle", "chateau", "station", "street", "rue",
+})
+# OSM tags used as the place kind, in order of preference
+KIND_TAGS = ("tourism", "amenity", "historic", "leisure", "shop")
+
+_local = threading.local()
+
+
+def normalize_name(text):
+    """Case-fold, strip diacritics and punctuation, collapse whitespace."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def normalize_city(text):
+    """``normalize_name`` of the city alone: "Paris, France" -> "paris"."""
+    return normalize_name(str(text or "").split(",")[0])
+
+
+def _tokens(norm):
+    words = norm.split()
+    # drop articles unless that would leave nothing
+    return [w for w in words if w not in STOPWORDS] or words
+
+
+def _same_word(a, b):
+    if a == b:
+        return True
+    # tolerate a typo in longer words ("Eifel")
+    return min(len(a), len(b)) >= 4 and difflib.SequenceMatcher(None, a, b).ratio() >= 0.8
+
+
+def score(query_norm, name_norm):
+    """Fuzzy similarity in [0, 1] between two normalized names.
+
+    The better of the whole-string similarity and a match on distinctive
+    words only (place-type words like "museum" ignored), so "the Louvre",
+    "Louvre Museum" and "Musée du Louvre" all match each other.
+    """
+    if query_norm == name_norm:
+        return 1.0
+    q_words, n_words = _tokens(query_norm), _tokens(name_norm)
+    ratio = difflib.SequenceMatcher(None, " ".join(q_words), " ".join(n_words)).ratio()
+    q = [w for w in q_words if w not in GENERIC_WORDS]
+    n = [w for w in n_words if w not in GENERIC_WORDS]
+    if not q or not n:
+        return ratio
+    matched_q = sum(1 for a in q if any(_same_word(a, b) for b in n))
+    matched_n = sum(1 for b in n if any(_same_word(a, b) for a in q))
+    # both sides' distinctive words must be covered; slightly below an exact match
+    distinctive = 0.95 * min(matched_q / len(q), matched_n / len(n))
+    return max(ratio, distinctive)
+
+
+def _create_schema(conn):
+    conn.executescript(
+        "CREATE TABLE IF NOT EXISTS places ("
+        " id INTEGER PRIMARY KEY,"
+        " name TEXT NOT NULL,"
+        " norm_name TEXT NOT NULL,"
+        " city TEXT NOT NULL DEFAULT '',"
+        " country TEXT NOT NULL DEFAULT '',"
+        " kind TEXT NOT NULL DEFAULT '',"
+        " lat REAL NOT NULL,"
+        " lng REAL NOT NULL);"
+        "CREATE INDEX IF NOT EXISTS places_city ON places (city);"
+        "CREATE VIRTUAL TABLE IF NOT EXISTS places_fts USING fts5("
+        " norm_name, content='places', content_rowid='id', tokenize='unicode61');"
+    )
+
+
+def _conn(path=None):
+    """This thread's read-only connection, or None without a gazetteer."""
+    path = path or GAZETTEER_PATH
+    if not path:
+        return None
+    conns = getattr(_local, "conns", None)
+    if conns is None or getattr(_local, "pid", None) != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+    conn = conns.get(path)
+    if conn is None:
+        if not os.path.exists(path):
+            logger.warning("Gazetteer %s not found; lookups disabled", path)
+            conns[path] = conn = False
+        else:
+            conn = conns[path] = sqlite3.connect(f"file:{path}?mode=ro", uri=True,
+                                                 check_same_thread=False)
+    return conn or None
+
+
+def enabled():
+    return _conn() is not None
+
+
+def lookup(place, city=None, country=None, path=None, min_score=None):
+    """Resolve a place name from the local gazetteer.
+
+    Args:
+        place (str): Place name as written by the model
+        city (str): City the place should be in, e.g. "Paris" or "Paris,
+            France" (only the part before the first comma is used); rows
+            from other cities are skipped, rows without a city are allowed
+        country (str): Optional country, matched the same way
+        path (str): Gazetteer file (defaults to ``GAZETTEER_PATH``)
+
+    Returns:
+        dict | None: {'lat': float, 'lng': float}
+    """
+    conn = _conn(path)
+    if conn is None:
+        return None
+    query = normalize_name(place)
+    # the model often appends the city ("Louvre, Paris"); it's not part of the name
+    city_norm = normalize_city(city)
+    if city_norm and query.endswith(" " + city_norm):
+        query = query[:-len(city_norm) - 1]
+    words = _tokens(query)
+    if not words:
+        return None
+    country_norm = normalize_name(country)
+    best, best_score = None, min_score if min_score is not None else GAZETTEER_MIN_SCORE
+    # all words first (precise), then any word or word prefix (catches
+    # differently worded or misspelled names)
+    precise = " ".join(f'"{w}"' for w in words)
+    loose = " OR ".join(f'"{w[:4]}"*' if len(w) > 4 else f'"{w}"' for w in words)
+    for match in (precise, loose):
+        try:
+            rows = conn.execute(
+                "SELECT p.norm_name, p.city, p.country, p.lat, p.lng FROM places_fts"
+                " JOIN places p ON p.id = places_fts.rowid"
+                " WHERE places_fts MATCH ? AND (p.city = '' OR ? = '' OR p.city = ?)"
+                " AND (p.country = '' OR ? = '' OR p.country = ?)"
+                " ORDER BY rank LIMIT ?",
+                (match, city_norm, city_norm, country_norm, country_norm, CANDIDATE_LIMIT),
+            ).fetchall()
+        except sqlite3.Error:
+            logger.exception("Gazetteer lookup failed for %r", place)
+            return None
+        for norm_name, row_city, _, lat, lng in rows:
+            # prefer a row that names the city over one that doesn't
+            s = score(query, norm_name) + (0.01 if row_city and row_city == city_norm else 0.0)
+            if s >= best_score:
+                best, best_score = {"lat": lat, "lng": lng}, s
+        if best is not None:
+            break
+    return best
+
+
+def _geojson_rows(path, default_city, default_country):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    for feature in data.get("features") or []:
+        props = feature.get("properties") or {}
+        geometry = feature.get("geometry") or {}
+        coords = geometry.get("coordinates") or []
+        if geometry.get("type") != "Point" or len(coords) < 2 or not props.get("name"):
+            continue
+        kind = next((props[t] for t in KIND_TAGS if props.get(t)), "")
+        yield (props["name"], props.get("addr:city") or default_city,
+               props.get("addr:country") or default_country, kind, coords[1], coords[0])
+
+
+def _csv_rows(path, default_city, default_country):
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                lat, lng = float(row["lat"]), float(row.get("lon") or row.get("lng"))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if row.get("name"):
+                yield (row["name"], row.get("city") or default_city,
+                       row.get("country") or default_country, row.get("kind") or "", lat, lng)
+
+
+def import_file(source, db_path, city=None, country=None, replace=False, batch_size=5000):
+    """Import a GeoJSON or CSV POI extract into the gazetteer at ``db_path``.
+
+    With ``replace`` the existing places are dropped first; otherwise the
+    extract is added to them.
+
+    Returns:
+        int: Number of places imported
+    """
+    reader = _csv_rows if source.lower().endswith(".csv") else _geojson_rows
+    conn = sqlite3.connect(db_path)
+    try:
+        _create_schema(conn)
+        if replace:
+            conn.execute("DELETE FROM places")
+        count = 0
+        batch = []
+
+        def _flush():
+            conn.executemany(
+                "INSERT INTO places (name, norm_name, city, country, kind, lat, lng)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+
+        for name, row_city, row_country, kind, lat, lng in reader(source, city, country):
+            norm = normalize_name(name)
+            if not norm:
+                continue
+            batch.append((name, norm, normalize_city(row_city), normalize_name(row_country),
+                          kind, float(lat), float(lng)))
+            count += 1
+            if len(batch) >= batch_size:
+                _flush()
+        if batch:
+            _flush()
+        conn.execute("INSERT INTO places_fts(places_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO places_fts(places_fts) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.gazetteer")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="import a GeoJSON or CSV POI extract")
+    imp.add_argument("source")
+    imp.add_argument("--db", default=GAZETTEER_PATH, required=GAZETTEER_PATH is None)
+    imp.add_argument("--city", help="city for rows that don't name one")
+    imp.add_argument("--country", help="country for rows that don't name one")
+    imp.add_argument("--replace", action="store_true", help="drop existing places first")
+    look = sub.add_parser("lookup", help="resolve a place name")
+    look.add_argument("place")
+    look.add_argument("--db", default=GAZETTEER_PATH, required=GAZETTEER_PATH is None)
+    look.add_argument("--city")
+    look.add_argument("--country")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        count = import_file(args.source, args.db, args.city, args.country, replace=args.replace)
+        print(f"Imported {count} places into {args.db}")
+    else:
+        print(json.dumps(lookup(args.place, args.city, args.country, path=args.db)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
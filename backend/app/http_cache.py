@@ -0,0 +1,135 @@
+"""HTTP-level response caching and compression
+
+Registered in ``create_app``. For complete (non-streamed) 200 responses it:
+
+- adds a weak ``ETag`` computed from the body and answers a matching
+  ``If-None-Match`` with an empty ``304 Not Modified``;
+- sets ``Cache-Control`` from a per-endpoint policy (other statuses get
+  ``no-store``; a view can set its own, e.g. ``no-cache`` for degraded
+  answers);
+- compresses bodies above ``HTTP_COMPRESS_MIN_BYTES`` with brotli (when the
+  ``brotli`` package is installed) or gzip, per ``Accept-Encoding``.
+
+Streamed responses (NDJSON/SSE) are passed through untouched. Since the
+API is mostly POST, browsers won't revalidate on their own; the frontend
+keeps the ETag and sends ``If-None-Match`` itself (``frontend/src/api.js``).
+"""
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+HTTP_COMPRESS_MIN_BYTES = int(os.getenv("HTTP_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html", "application/x-ndjson")
+
+# Cache-Control per endpoint; endpoints not listed get DEFAULT_CACHE_CONTROL
+CACHE_CONTROL = {
+    # geocodes and routes between fixed points hardly change
+    "api.geocode": "private, max-age=86400",
+    "api.route_polylines": "private, max-age=86400",
+    # itineraries are cached server-side with a shorter TTL; revalidate
+    "itinerary.generate_itinerary_route": "private, no-cache",
+    "itinerary.generate_itinerary_batch_route": "private, no-cache",
+    "api.cache_stats": "no-store",
+    "api.metrics_route": "no-store",
+}
+DEFAULT_CACHE_CONTROL = "no-cache"
+# Errors and other non-200 responses must never be reused
+ERROR_CACHE_CONTROL = "no-store"
+
+
+def etag_for(body):
+    """Weak validator for a response body (bytes)."""
+    return 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _etag_matches(header, etag, allow_any=True):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return allow_any
+    # weak comparison: W/ prefixes are ignored on both sides
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def _choose_encoding(accept_encoding):
+    """Best supported coding in an Accept-Encoding header, or None."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def process_response(request, response):
+    """Apply validators, Cache-Control and compression to ``response``."""
+    if response.is_streamed or response.direct_passthrough:
+        return response
+    if response.status_code != 200:
+        response.headers.setdefault("Cache-Control", ERROR_CACHE_CONTROL)
+        return response
+    response.headers.setdefault(
+        "Cache-Control", CACHE_CONTROL.get(request.endpoint, DEFAULT_CACHE_CONTROL))
+    if "Content-Encoding" in response.headers:
+        return response
+
+    body = response.get_data()
+    etag = etag_for(body)
+    response.headers["ETag"] = etag
+    response.vary.add("Accept-Encoding")
+    # a POST is only answered with 304 when the client named the ETag it has
+    safe = request.method in ("GET", "HEAD")
+    if _etag_matches(request.headers.get("If-None-Match"), etag, allow_any=safe):
+        response.status_code = 304
+        response.set_data(b"")
+        # no body: drop the headers describing it
+        response.headers.pop("Content-Type", None)
+        response.headers.pop("Content-Length", None)
+        return response
+
+    if len(body) >= HTTP_COMPRESS_MIN_BYTES and response.mimetype in COMPRESSIBLE_TYPES:
+        encoding = _choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding:
+            response.set_data(_compress(body, encoding))
+            response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    """Register the response hook on ``app``."""
+    if not HTTP_CACHE_ENABLED:
+        return
+    from flask import request
+
+    @app.after_request
+    def _http_cache(response):
+        return process_response(request, response)
@@ -1,17 +1,64 @@
-import os
-import requests
 import json
+import logging
+import os
 import re
-import google.generativeai as genai
-from dotenv import load_dotenv
 
-load_dotenv(override=True)
-# Get API key from env
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+from .admission import Overloaded, allm_slot, llm_slot
+from .json_stream import PlaceStreamParser
+from .metrics import timed
+from .settings import get_gemini_model, get_settings
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = get_settings().gemini_model
+# Ask Gemini for schema-constrained JSON (response_mime_type/response_schema)
+STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "1").lower() not in ("0", "false", "no")
+
+# Gemini's schema subset has no free-form object keys, so structured mode
+# returns places as a list with a "name" field instead of a name-keyed map.
+ITINERARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "places": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "time": {"type": "array", "items": {"type": "string"}},
+                    "category": {"type": "string"},
+                    "price": {"type": "string", "enum": ["$", "$$", "$$$"]},
+                    "description": {"type": "string"},
+                },
+                "required": ["name", "time", "category", "price", "description"],
+            },
+        },
+    },
+    "required": ["places"],
+}
+# Used to fix an unparseable response instead of regenerating the itinerary
+REPAIR_PROMPT = (
+    "The text below was meant to be a JSON itinerary but is not valid JSON. "
+    "Return only the corrected JSON. Keep exactly the same places and details; "
+    "do not add, remove or rename places.\n\n{text}"
+)
+REPAIR_MAX_INPUT_CHARS = 12000
+
+
+def generation_config(max_output_tokens=None):
+    """Per-call generation config; None when structured output is disabled."""
+    if not STRUCTURED_OUTPUT:
+        return None
+    config = {"response_mime_type": "application/json", "response_schema": ITINERARY_SCHEMA}
+    if max_output_tokens:
+        config["max_output_tokens"] = max_output_tokens
+        config["temperature"] = 0
+    return config
+
 # Use the v1beta2 generate endpoint (use :generate suffix)
 GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta2/models/gemini-1.5-flash:generate"
 
-def generate_itinerary(destination: str, month: str, budget: str, category: str) -> list[dict]:
+def build_prompt(destination: str, month: str, budget: str, category: str) -> str:
     # Use single quotes for the internal keys to simplify the outer string escaping
     format_template = (
         '{"Places": {'
@@ -20,6 +67,14 @@ def generate_itinerary(destination: str, month: str, budget: str, category: str)
         '"name_of_place3": { "time": [12:15, 13:00], "category": "museum", "price": "$", "description": "short, clear description" }, '
         '"name_of_place4": { "time": [13:15, 14:00], "category": "outdoor", "price": "$", "description": "short, clear description" } } }'
     )
+    if STRUCTURED_OUTPUT:
+        format_template = (
+            '{"places": ['
+            '{ "name": "name_of_place1", "time": ["10:30", "11:30"], "category": "food", "price": "$", "description": "short, clear description" }, '
+            '{ "name": "name_of_place2", "time": ["11:30", "12:00"], "category": "store", "price": "$", "description": "short, clear description" }, '
+            '{ "name": "name_of_place3", "time": ["12:15", "13:00"], "category": "museum", "price": "$", "description": "short, clear description" }, '
+            '{ "name": "name_of_place4", "time": ["13:15", "14:00"], "category": "outdoor", "price": "$", "description": "short, clear description" } ] }'
+        )
 
     prompt = (
         f"""
@@ -51,68 +106,169 @@ def generate_itinerary(destination: str, month: str, budget: str, category: str)
         """
     )
 
-    # Use only Content-Type header; pass API key as query parameter if available
-    headers = {
-        "Content-Type": "application/json",
-    }
+    return prompt
+
+
+def _places_from_doc(doc) -> list[dict] | None:
+    """Normalize either output shape into a list of place dicts."""
+    if isinstance(doc, dict):
+        doc = doc.get("places", doc.get("Places"))
+    if isinstance(doc, dict):
+        items = []
+        for name, details in doc.items():
+            if isinstance(details, dict):
+                place_data = {"name": name}
+                place_data.update(details)
+                items.append(place_data)
+        return items or None
+    if isinstance(doc, list):
+        return [p for p in doc if isinstance(p, dict) and p.get("name")] or None
+    return None
+
+
+def _close_json(text: str) -> str:
+    """Cheap local repair: drop fences/prose, trailing commas, close what's open."""
+    text = re.sub(r"```(?:json)?", "", text, flags=re.IGNORECASE)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+    text = text[min(starts):]
+    stack = []
+    in_string = escape = False
+    end = len(text)
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+            if not stack:
+                end = i + 1
+                break
+    text = text[:end]
+    if in_string:
+        text += '"'
+    text = re.sub(r",\s*$", "", text)
+    text += "".join(reversed(stack))
+    return re.sub(r",\s*([}\]])", r"\1", text)
+
+
+def parse_itinerary_text(itinerary_text: str) -> list[dict] | None:
+    """Parse the model's text output into a list of place dicts.
+
+    Single pass over the text with the streaming place parser, so fenced,
+    prose-wrapped or truncated output still yields every complete place.
+    Falls back to a local bracket/comma repair for anything else.
+
+    Returns None if no place could be recovered.
+    """
+    try:
+        return _places_from_doc(json.loads(itinerary_text))
+    except json.JSONDecodeError:
+        pass
+    parser = PlaceStreamParser()
+    items = parser.feed(itinerary_text)
+    if items:
+        return items
+    try:
+        return _places_from_doc(json.loads(_close_json(itinerary_text)))
+    except json.JSONDecodeError:
+        return None
+
+
+def fallback_itinerary(destination: str) -> list[dict]:
+    """Sample itinerary served when the model can't be reached."""
+    return [
+        {'place': f'{destination} Old Town', 'start_time': '09:00', 'end_time': '11:00', 'notes': 'Walk historic center'},
+        {'place': f'{destination} Art Museum', 'start_time': '11:30', 'end_time': '13:00', 'notes': 'Local art exhibits'},
+        {'place': f'{destination} Central Park', 'start_time': '14:00', 'end_time': '16:00', 'notes': 'Relax and picnic'},
+    ]
+
+
+def _get_model():
+    # Use the official google.generativeai client library to call Gemini.
+    # The model is configured and built once per worker.
+    return get_gemini_model()
+
 
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        # Ideally, add the response_mime_type and response_schema here for robustness
-    }
+def _repair_prompt(itinerary_text: str) -> str:
+    return REPAIR_PROMPT.format(text=itinerary_text[:REPAIR_MAX_INPUT_CHARS])
 
+
+def repair_itinerary_text(itinerary_text: str) -> list[dict] | None:
+    """Ask the model to fix unparseable output (small, deterministic call)."""
     try:
-        # Use the official google.generativeai client library to call Gemini.
-        # Configure the client if an API key is available.
-        if GEMINI_API_KEY:
-            genai.configure(api_key=GEMINI_API_KEY)
+        with llm_slot():
+            response = _get_model().generate_content(
+                _repair_prompt(itinerary_text), generation_config=generation_config(max_output_tokens=2048))
+        return parse_itinerary_text((getattr(response, "text", "") or "").strip())
+    except Exception as e:
+        logger.warning("Itinerary JSON repair failed: %s", e)
+        return None
+
 
-        model = genai.GenerativeModel(model_name="gemini-2.5-flash")
+async def arepair_itinerary_text(itinerary_text: str) -> list[dict] | None:
+    """Async variant of ``repair_itinerary_text``."""
+    try:
+        async with allm_slot():
+            response = await _get_model().generate_content_async(
+                _repair_prompt(itinerary_text), generation_config=generation_config(max_output_tokens=2048))
+        return parse_itinerary_text((getattr(response, "text", "") or "").strip())
+    except Exception as e:
+        logger.warning("Itinerary JSON repair failed: %s", e)
+        return None
+
+
+@timed("generate_itinerary")
+def generate_itinerary(destination: str, month: str, budget: str, category: str) -> list[dict]:
+    prompt = build_prompt(destination, month, budget, category)
+    try:
+        model = _get_model()
 
         # Generate content with the prompt. The client returns an object with a .text property.
-        response = model.generate_content(prompt)
+        with llm_slot():
+            response = model.generate_content(prompt, generation_config=generation_config())
         itinerary_text = (getattr(response, "text", "") or str(response)).strip()
 
-        # Try direct JSON parse first, then attempt to clean common wrappers
-        full_itinerary_dict = None
-        try:
-            full_itinerary_dict = json.loads(itinerary_text)
-        except json.JSONDecodeError:
-            # Common model outputs include markdown fences or extra text. Try to
-            # extract the first JSON object found in the string.
-            cleaned = itinerary_text
-            # remove Markdown code fences (```json ... ```)
-            cleaned = re.sub(r"```(?:json)?\s*", "", cleaned, flags=re.IGNORECASE)
-            cleaned = re.sub(r"\s*```\s*$", "", cleaned)
-            # Try to find the first {...} JSON object in the text
-            m = re.search(r"(\{.*\})", cleaned, flags=re.DOTALL)
-            if m:
-                candidate = m.group(1)
-                try:
-                    full_itinerary_dict = json.loads(candidate)
-                except json.JSONDecodeError:
-                    full_itinerary_dict = None
-
-        if not full_itinerary_dict:
-            print("Could not parse model output as JSON:")
-            print(itinerary_text)
+        itinerary_list = parse_itinerary_text(itinerary_text)
+        if itinerary_list is None:
+            # a targeted repair is much cheaper than generating again
+            itinerary_list = repair_itinerary_text(itinerary_text)
+        if itinerary_list is None:
+            logger.error("Could not parse model output as JSON:\n%s", itinerary_text)
             return []
-
-        # Convert the dictionary to a list to match the return type hint
-        places_dict = full_itinerary_dict.get("Places", {})
-        itinerary_list = []
-        for name, details in places_dict.items():
-            place_data = {"name": name}
-            place_data.update(details)
-            itinerary_list.append(place_data)
-
         return itinerary_list
 
+    except Overloaded:
+        # saturated or out of quota: the caller answers 429/503, not the sample
+        raise
     except Exception as e:
-        print("Error calling Gemini API:", e)
+        logger.error("Error calling Gemini API: %s", e)
         # Fallback to sample itinerary
-        return [
-            {'place': f'{destination} Old Town', 'start_time': '09:00', 'end_time': '11:00', 'notes': 'Walk historic center'},
-            {'place': f'{destination} Art Museum', 'start_time': '11:30', 'end_time': '13:00', 'notes': 'Local art exhibits'},
-            {'place': f'{destination} Central Park', 'start_time': '14:00', 'end_time': '16:00', 'notes': 'Relax and picnic'},
-        ]
\ No newline at end of file
+        return fallback_itinerary(destination)
+
+
+async def astream_itinerary_text(destination: str, month: str, budget: str, category: str):
+    """Yield the model's raw text output chunk by chunk as it streams in.
+
+    Errors are raised to the caller, which decides on the fallback. The
+    call holds an LLM pool slot until the stream ends; ``Overloaded`` is
+    raised when none is free or the model's quota is exhausted.
+    """
+    prompt = build_prompt(destination, month, budget, category)
+    model = _get_model()
+    async with allm_slot():
+        response = await model.generate_content_async(prompt, generation_config=generation_config(),
+                                                      stream=True)
+        async for chunk in response:
+            text = getattr(chunk, "text", "")
+            if text:
+                yield text
@@ -1,60 +1,110 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 
-from .itinerary_generator import generate_itinerary
-from .map_service import get_location_coordinates
-from .time_optimizer import optimize_itinerary
+from .metrics import span
+from .pipeline import (BATCH_MAX_ITEMS, format_ndjson, format_sse, iter_events,
+                       run_itinerary_batch, run_itinerary_pipeline, stream_itinerary_events)
 
 itinerary_bp = Blueprint('itinerary', __name__)
 
 
-@itinerary_bp.route('/generate_itinerary', methods=['POST'])
-def generate_itinerary_route():
-    """
-    POST /api/generate_itinerary
-    Expects JSON: { destination: str, month: str, preferences: [str] }
+def _stream_format():
+    """Return 'ndjson', 'sse' or None depending on what the client asked for."""
+    requested = (request.args.get('stream') or '').lower()
+    if requested in ('ndjson', 'sse'):
+        return requested
+    if requested in ('1', 'true'):
+        return 'ndjson'
+    accept = request.headers.get('Accept', '')
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    if 'text/event-stream' in accept:
+        return 'sse'
+    return None
 
-    TODOs:
-    - validate input
-    - call a real AI itinerary generator or service
-    - call map service to get coordinates
-    - optimize route/order with time optimizer
-    - add caching, rate-limiting, auth as needed
-    """
-    data = request.get_json(silent=True) or {}
+
+def _itinerary_params(data):
+    """Pipeline kwargs from a request body; raises ValueError if invalid."""
+    if not isinstance(data, dict):
+        raise ValueError('request must be a JSON object')
     destination = data.get('destination') or data.get('location')
-    month = data.get('month')
     preferences = data.get('preferences', [])
-    budget = data.get('budget') or data.get('price')
     # category may be provided explicitly or inferred from preferences
     category = data.get('category') or (preferences[0] if isinstance(preferences, list) and preferences else '')
-
     # Basic input validation (expand as needed)
     if not destination:
-        return jsonify({'error': 'destination is required'}), 400
+        raise ValueError('destination is required')
+    return {'destination': destination, 'month': data.get('month'),
+            'budget': data.get('budget') or data.get('price'), 'category': category,
+            'country': data.get('country')}
+
+
+@itinerary_bp.route('/generate_itinerary', methods=['POST'])
+async def generate_itinerary_route():
+    """
+    POST /api/generate_itinerary
+    Expects JSON: { destination: str, month: str, preferences: [str] }
+
+    Streaming: with ``?stream=ndjson`` / ``Accept: application/x-ndjson`` (or
+    ``?stream=sse`` / ``Accept: text/event-stream``) the response is a stream
+    of events: one ``place`` event per parsed place, one ``coordinates``
+    event per resolved place, then a final ``done`` event carrying the same
+    payload as the non-streaming response.
 
-    # Generate a basic itinerary (placeholder)
-    # The generator expects (destination, month, budget, category)
+    Invalid input is answered with 400 (see ``_itinerary_params``).
+    """
+    data = request.get_json(silent=True) or {}
     try:
-        itinerary = generate_itinerary(destination, month, budget, category)
-    except TypeError:
-        # Backwards compatibility: if the generator has a different signature,
-        # try calling it with the older (destination, month, preferences) shape.
-        itinerary = generate_itinerary(destination, month, preferences)
-
-    # Get mock coordinates for places
-    # Build a list of place names from possible keys returned by generator
-    places = [item.get('place') or item.get('name') or item.get('title') for item in itinerary]
-    coords = get_location_coordinates(places, destination, data.get('country'))
-
-    # Attach coordinates to itinerary items when available
-    for item in itinerary:
-        key = item.get('place') or item.get('name') or item.get('title')
-        item['coordinates'] = coords.get(key)
-
-    # Optionally run an optimizer (placeholder)
-    optimized = optimize_itinerary(itinerary)
-
-    return jsonify({'destination': destination, 'month': month, 'itinerary': optimized})
+        params = _itinerary_params(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    stream = _stream_format()
+    if stream:
+        events = iter_events(lambda: stream_itinerary_events(**params))
+        fmt = format_sse if stream == 'sse' else format_ndjson
+        mimetype = 'text/event-stream' if stream == 'sse' else 'application/x-ndjson'
+        return Response((fmt(e) for e in events), mimetype=mimetype,
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    # Generation, geocoding and optimization run as one async pipeline;
+    # each place is geocoded as soon as it is generated.
+    result = await run_itinerary_pipeline(**params)
+    with span("serialize"):
+        return jsonify(result)
+
+
+@itinerary_bp.route('/generate_itinerary/batch', methods=['POST'])
+async def generate_itinerary_batch_route():
+    """
+    POST /api/generate_itinerary/batch
+    Expects JSON: { requests: [ {destination, month, ...}, ... ], routes: bool }
+    (or just the list of requests). Each request takes the same fields as
+    /api/generate_itinerary.
+
+    Response: { results: [ { index, ok: true, destination, month, itinerary,
+    optimization, [routes] } | { index, ok: false, error }, ... ] }
+
+    Requests run concurrently and fail independently. With ``routes: true``
+    each result also carries ``routes``, the /api/route_polylines segments
+    between its adjacent stops, routed in one deduplicated pass.
+    """
+    data = request.get_json(silent=True)
+    items = data if isinstance(data, list) else (data or {}).get('requests')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': '"requests" must be a non-empty list'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'at most {BATCH_MAX_ITEMS} requests per batch'}), 400
+
+    batch = []
+    for item in items:
+        try:
+            batch.append(_itinerary_params(item))
+        except ValueError as e:
+            batch.append(e)
+    include_routes = isinstance(data, dict) and bool(data.get('routes'))
+    results = await run_itinerary_batch(batch, include_routes=include_routes)
+    with span("serialize"):
+        return jsonify({'results': results})
 
 if __name__ == '__main__':
     print(generate_itinerary_route)
\ No newline at end of file
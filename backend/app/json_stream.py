@@ -0,0 +1,107 @@
+"""Incremental parser for itinerary JSON streamed by the model.
+
+The model returns ``{"Places": {"<name>": {...}, ...}}``, possibly wrapped in
+Markdown fences or prose. ``PlaceStreamParser`` is fed text chunks as they
+arrive and returns every place object as soon as its closing brace has been
+seen, without waiting for (or re-scanning) the rest of the document.
+
+Places are the objects nested directly inside the top-level object's
+container value: keyed by name in an object, or listed with a ``name`` field
+in an array.
+"""
+import json
+
+
+class PlaceStreamParser:
+    """Single-pass, resumable scanner that emits completed place objects."""
+
+    def __init__(self):
+        self._text = ""         # everything from the first '{' onwards
+        self._pos = 0           # index in _text scanned so far
+        self._started = False
+        self._done = False
+        self._in_string = False
+        self._escape = False
+        self._stack = []        # container chars: '{' or '['
+        self._string_start = None
+        self._last_string = None    # last complete string at container depth
+        self._item_start = None
+        self._item_key = None
+        self.emitted = 0
+
+    @property
+    def done(self):
+        """True once the top-level object has been closed."""
+        return self._done
+
+    def feed(self, chunk):
+        """Consume a text chunk; return the list of places completed by it."""
+        if self._done or not chunk:
+            return []
+        if not self._started:
+            start = chunk.find("{")
+            if start < 0:
+                return []
+            chunk = chunk[start:]
+            self._started = True
+        self._text += chunk
+        out = []
+        text = self._text
+        i = self._pos
+        n = len(text)
+        while i < n:
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 2 and self._item_start is None:
+                        self._last_string = text[self._string_start:i + 1]
+                i += 1
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                self._stack.append(ch)
+                if len(self._stack) == 3 and ch == "{":
+                    self._item_start = i
+                    self._item_key = self._last_string if self._stack[1] == "{" else None
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if len(self._stack) == 2 and self._item_start is not None and ch == "}":
+                    item = self._decode(text[self._item_start:i + 1], self._item_key)
+                    if item is not None:
+                        out.append(item)
+                    self._item_start = None
+                    self._item_key = None
+                elif not self._stack:
+                    self._done = True
+                    i += 1
+                    break
+            i += 1
+        self._pos = i
+        self.emitted += len(out)
+        return out
+
+    @staticmethod
+    def _decode(raw, key):
+        try:
+            details = json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(details, dict):
+            return None
+        if key is not None:
+            try:
+                name = json.loads(key)
+            except json.JSONDecodeError:
+                return None
+            item = {"name": name}
+            item.update(details)
+            return item
+        return details if details.get("name") else None
@@ -2,38 +2,173 @@
 
 Provides function to convert place names into latitude/longitude pairs.
 """
+import logging
+import math
 import os
-from dotenv import load_dotenv
-import requests
-try:
-    import openrouteservice
-except Exception:
-    openrouteservice = None
-    print('Warning: optional dependency "openrouteservice" not installed; route decoding will be limited.')
 import time
-import json
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-def nominatim_lookup(place, city=None):
-    """Lookup a place with Nominatim (OpenStreetMap) as a lightweight fallback.
+import numpy as np
+
+from . import gazetteer, polyline
+from .cache import SingleFlight, TieredCache, import_legacy_json, normalize_key
+from .estimator import estimate_leg
+from .metrics import bind_context, span, timed
+from .providers import get_client
+from .resilience import health, hedged
+from .settings import get_settings
+from .spatial import closest_within, ensure_places_loaded, place_index, place_name_of
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Resolved place coordinates, shared across workers through the SQLite store.
+geocode_cache = TieredCache(
+    "geocode",
+    maxsize=int(os.getenv("GEOCODE_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600))),
+)
+# Places that failed to resolve. Kept short so a transient upstream failure
+# is retried soon, but repeat requests don't hammer ORS/Nominatim meanwhile.
+geocode_negative_cache = TieredCache(
+    "geocode_negative",
+    maxsize=int(os.getenv("GEOCODE_NEGATIVE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("GEOCODE_NEGATIVE_TTL", "600")),
+)
+# City centroids used as the ORS focus point. Cities don't move, so these
+# live much longer than place geocodes.
+city_focus_cache = TieredCache(
+    "city_focus",
+    maxsize=int(os.getenv("CITY_FOCUS_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("CITY_FOCUS_CACHE_TTL", str(180 * 24 * 3600))),
+)
+_legacy_imported = False
+# ORS candidates farther than this from the city focus are rejected
+MAX_FOCUS_DISTANCE_M = 200000.0
+# A place already resolved under the same name this close to the city focus
+# is reused without an upstream call
+KNOWN_PLACE_RADIUS_M = float(os.getenv("KNOWN_PLACE_RADIUS_M", "30000"))
+# New geocodes this close to an indexed place are snapped onto it, so both
+# share route cache entries
+SNAP_RADIUS_M = float(os.getenv("GEOCODE_SNAP_RADIUS_M", "25"))
+
+# In-flight upstream lookups, so concurrent requests for the same
+# place/city/segment share one call.
+geocode_flight = SingleFlight()
+route_flight = SingleFlight()
+
+ORS_GEOCODE_URL = "https://api.openrouteservice.org/geocode/search"
+
+
+def ors_api_key():
+    """Return ORS_API_KEY from the settings loaded once per worker."""
+    return get_settings().ors_api_key
+
+
+def geocode_key(place, location=None, country=None):
+    """Cache key for a place in the context of a city and country.
+
+    The same name can resolve to different points in different cities
+    ("Central Park"), so the context is part of the key.
+    """
+    return "|".join(normalize_key(part) for part in (place, location, country))
+
+
+def _ensure_legacy_import():
+    """Seed the geocode cache from the old geocode_cache.json (once).
+
+    The legacy file was keyed by bare place name, so its entries are only
+    served to lookups made without a city/country context.
+    """
+    global _legacy_imported
+    if not _legacy_imported:
+        _legacy_imported = True
+        import_legacy_json(geocode_cache, BASE_DIR / 'geocode_cache.json', key_func=geocode_key)
+
 
-    Returns: {'lat': float, 'lng': float} or None
+def resolve_city_focus(location, api_key=None):
+    """Return the (lat, lon) centroid of a city via ORS, cached.
+
+    Args:
+        location (str): City / center point text, e.g. "Paris"
+        api_key (str): ORS API key
+
+    Returns:
+        tuple[float, float] | None
     """
+    if not location:
+        return None
+    key = normalize_key(location)
+    cached = city_focus_cache.get(key)
+    if cached is not None:
+        return cached[0], cached[1]
+    return geocode_flight.do(("city", key), _lookup_city_focus, location, key, api_key)
+
+
+def _lookup_city_focus(location, key, api_key):
     try:
-        q = f"{place} {city or ''}".strip()
-        url = "https://nominatim.openstreetmap.org/search"
-        headers = {"User-Agent": "NewHacksDev/1.0 (dev@example.com)"}
-        params = {"q": q, "format": "json", "limit": 1}
-        resp = requests.get(url, params=params, headers=headers, timeout=10)
+        params_loc = {"api_key": api_key, "text": location} if api_key else {"text": location}
+        resp = get_client('ors').get(ORS_GEOCODE_URL, params=params_loc, operation="geocode")
         resp.raise_for_status()
-        data = resp.json() or []
-        if not data:
-            return None
-        first = data[0]
-        return {"lat": float(first.get('lat')), "lng": float(first.get('lon'))}
+        data = resp.json() or {}
+        features = data.get('features') or []
+        if features:
+            coords_list = features[0].get('geometry', {}).get('coordinates') or []
+            if len(coords_list) >= 2:
+                city_lon, city_lat = coords_list[0], coords_list[1]
+                city_focus_cache.set(key, [city_lat, city_lon])
+                return city_lat, city_lon
+    except Exception:
+        pass
+    return None
+
+
+def remember_place(key, coords):
+    """Cache a resolved place, snapped onto an indexed point within SNAP_RADIUS_M."""
+    lat, lng = float(coords['lat']), float(coords['lng'])
+    near = ensure_places_loaded().query_radius(lat, lng, SNAP_RADIUS_M) if SNAP_RADIUS_M > 0 else []
+    if near:
+        lat, lng = place_index.point(near[0][0]) or (lat, lng)
+    res = {'lat': lat, 'lng': lng}
+    geocode_cache.set(key, res)
+    place_index.add(key, lat, lng, place_name_of(key))
+    return res
+
+
+@timed("nominatim_lookup")
+def nominatim_search(place, city=None):
+    """Lookup a place with Nominatim (OpenStreetMap).
+
+    Returns:
+        dict | None: {'lat': float, 'lng': float}, or None if Nominatim
+        found no match
+
+    Raises:
+        Exception: if Nominatim could not be asked or failed to answer
+    """
+    q = f"{place} {city or ''}".strip()
+    url = "https://nominatim.openstreetmap.org/search"
+    params = {"q": q, "format": "json", "limit": 1}
+    resp = get_client('nominatim').get(url, params=params, operation="search")
+    resp.raise_for_status()
+    data = resp.json() or []
+    if not data:
+        return None
+    first = data[0]
+    return {"lat": float(first.get('lat')), "lng": float(first.get('lon'))}
+
+
+def nominatim_lookup(place, city=None):
+    """Lookup a place with Nominatim as a lightweight fallback.
+
+    Returns: {'lat': float, 'lng': float} or None (no match or failure)
+    """
+    try:
+        return nominatim_search(place, city)
     except Exception as e:
-        print(f"Nominatim lookup failed for '{place}': {e}")
+        logger.warning("Nominatim lookup failed for %r: %s", place, e)
         return None
 
 def get_location_coordinates(places, location, country):
@@ -47,79 +182,51 @@ def get_location_coordinates(places, location, country):
         dict: mapping place -> a dictionaryof dictionaries {location: "The Louvre", coordinates: {'lat': float, 'lng': float}}
     Todo:
         - Integrate with a real geocoding API (Open Route Service API)
-        - Cache results
     """
-    # Load environment variables from .env file
-
-    # Dynamically determine the path to the .env file
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    dotenv_path = os.path.join(base_dir, ".env")
-
-    load_dotenv(dotenv_path=dotenv_path)
-    api_key = os.getenv("ORS_API_KEY")
+    api_key = ors_api_key()
 
     coords = {}
-
-    def haversine_km(lat1, lon1, lat2, lon2):
-        from math import radians, sin, cos, sqrt, atan2
-        R = 6371.0
-        dlat = radians(lat2 - lat1)
-        dlon = radians(lon2 - lon1)
-        a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1-a))
-        return R * c
-
-    # load or initialize on-disk cache
-    try:
-        cache_file = Path(base_dir) / 'geocode_cache.json'
-        if cache_file.exists():
-            with open(cache_file, 'r', encoding='utf-8') as fh:
-                cache = json.load(fh)
-        else:
-            cache = {}
-    except Exception:
-        cache = {}
-
-    # helper to persist cache (best-effort)
-    def _save_cache():
-        try:
-            with open(Path(base_dir) / 'geocode_cache.json', 'w', encoding='utf-8') as fh:
-                json.dump(cache, fh)
-        except Exception:
-            pass
+    _ensure_legacy_import()
 
     # If there's no API key available, we'll still try Nominatim in parallel
-    url = "https://api.openrouteservice.org/geocode/search"
+    url = ORS_GEOCODE_URL
 
     # gather list of places to resolve
     places_list = list(places or [])
-    # preload cache hits
+    # preload cache hits; known failures are skipped until their entry expires
+    to_resolve = []
     for place in places_list:
-        if place in cache:
-            coords[place] = cache.get(place)
-        else:
-            coords[place] = None
+        key = geocode_key(place, location, country)
+        coords[place] = geocode_cache.get(key)
+        if coords[place] is None and not geocode_negative_cache.get(key):
+            to_resolve.append(place)
+
+    # resolve the city focus point once; every place lookup below shares it
+    city_lon = city_lat = None
+    if to_resolve and api_key:
+        focus = resolve_city_focus(location, api_key)
+        if focus is not None:
+            city_lat, city_lon = focus
 
-    # quick helper for a single place resolution (uses ORS -> retry -> nominatim)
     def _resolve_place(place):
-        # if cache hit, return immediately
-        if place in cache and cache.get(place) is not None:
-            return place, cache.get(place)
-
-        city_lon = city_lat = None
-        if location:
-            try:
-                params_loc = {"api_key": api_key, "text": location} if api_key else {"text": location}
-                resp = requests.get(url, params=params_loc, timeout=8)
-                resp.raise_for_status()
-                data = resp.json() or {}
-                features = data.get('features') or []
-                if features:
-                    coords_list = features[0].get('geometry', {}).get('coordinates') or []
-                    if len(coords_list) >= 2:
-                        city_lon, city_lat = coords_list[0], coords_list[1]
-            except Exception:
-                city_lon = city_lat = None
+        key = geocode_key(place, location, country)
+        # concurrent requests for the same place wait on one upstream lookup
+        with span("resolve_place"):
+            return place, geocode_flight.do(key, _lookup_place, place, key)
+
+    # quick helper for a single place resolution (gazetteer -> ORS -> nominatim)
+    def _lookup_place(place, key):
+        # the local gazetteer answers well-known places without any network call
+        if gazetteer.GAZETTEER_PATH:
+            with span("gazetteer"):
+                local = gazetteer.lookup(place, location, country)
+            if local is not None:
+                return remember_place(key, local)
+
+        # providers that answered "no such place". Only when every provider
+        # asked did is the failure negative-cached; errors and our own
+        # refusals (open circuit, rate limit) are retried on the next request
+        no_match = set()
 
         # define a small inner lookup to call ORS and pick closest feature
         def _call_ors(query_text):
@@ -130,68 +237,86 @@ def get_location_coordinates(places, location, country):
                 if city_lat is not None and city_lon is not None:
                     params["focus.point.lat"] = city_lat
                     params["focus.point.lon"] = city_lon
-                resp = requests.get(url, params=params, timeout=8)
+                resp = get_client('ors').get(url, params=params, operation="geocode")
                 resp.raise_for_status()
                 data = resp.json() or {}
                 features = data.get('features') or []
                 if not features:
+                    no_match.add('ors')
                     return None
                 # pick closest to city focus if available
                 if city_lat is not None and city_lon is not None:
-                    best = None
-                    best_dist = None
-                    for f in features:
-                        coords_list = f.get('geometry', {}).get('coordinates') or []
-                        if len(coords_list) < 2:
-                            continue
-                        lon, lat = coords_list[0], coords_list[1]
-                        try:
-                            dist_km = haversine_km(city_lat, city_lon, float(lat), float(lon))
-                        except Exception:
-                            dist_km = None
-                        if best is None or (dist_km is not None and (best_dist is None or dist_km < best_dist)):
-                            best = (lon, lat)
-                            best_dist = dist_km
-                    if best is not None:
-                        place_lon, place_lat = best[0], best[1]
-                        # if best is too far, treat as no result
-                        if best_dist is not None and best_dist > 200:
+                    points = [f.get('geometry', {}).get('coordinates') or [] for f in features]
+                    points = [p for p in points if len(p) >= 2]
+                    if points:
+                        arr = np.asarray(points, dtype=float)
+                        # if the best is too far, treat as no result
+                        best = closest_within(arr[:, 1], arr[:, 0], city_lat, city_lon, MAX_FOCUS_DISTANCE_M)
+                        if best is None:
+                            no_match.add('ors')
                             return None
+                        place_lon, place_lat = points[best[0]][0], points[best[0]][1]
                         return {'lat': place_lat, 'lng': place_lon}
                 # fallback to first feature
                 coords_list = features[0].get('geometry', {}).get('coordinates') or []
                 if len(coords_list) >= 2:
                     place_lon, place_lat = coords_list[0], coords_list[1]
                     return {'lat': place_lat, 'lng': place_lon}
-            except Exception:
+            except Exception as e:
+                logger.warning("ORS geocode failed for %r: %s", query_text, e)
                 return None
 
-        # try ORS with appended location (if available)
+        def _call_nominatim():
+            try:
+                found = nominatim_search(place, location)
+            except Exception as e:
+                logger.warning("Nominatim lookup failed for %r: %s", place, e)
+                return None
+            if found is None:
+                no_match.add('nominatim')
+            return found
+
+        # a place of the same name already resolved near this city
+        if city_lat is not None and city_lon is not None:
+            known = ensure_places_loaded().nearest_named(
+                normalize_key(place), city_lat, city_lon, KNOWN_PLACE_RADIUS_M)
+            if known is not None:
+                res = {'lat': known[1], 'lng': known[2]}
+                geocode_cache.set(key, res)
+                return res
+
+        # try ORS with appended location (if available); if it fails, or is
+        # slower than its recent p95, nominatim is tried too and the first
+        # answer wins
         q = f"{place}, {location}" if location else place
-        res = None
         if api_key:
-            res = _call_ors(q)
-        # if ORS not available or returned None, try nominatim
-        if res is None:
-            try:
-                nomi = nominatim_lookup(place, location)
-                if nomi:
-                    res = nomi
-            except Exception:
-                res = None
+            ors = get_client('ors')
+            delay = health('ors').hedge_delay("geocode", ceiling=ors.timeout[1])
+            res = hedged(lambda: _call_ors(q), _call_nominatim, delay, name="geocode")
+            asked = {'ors', 'nominatim'}
+        else:
+            res = _call_nominatim()
+            asked = {'nominatim'}
 
-        # save to cache for future
-        try:
-            cache[place] = res
-        except Exception:
-            pass
-        return place, res
+        # save to cache for future; places no provider knows go to the
+        # short-lived negative cache
+        if res is not None:
+            res = remember_place(key, res)
+        elif no_match >= asked:
+            geocode_negative_cache.set(key, True)
+        return res
 
     # run resolves in parallel for missing places
-    to_resolve = [p for p in places_list if coords.get(p) is None]
-    if to_resolve:
+    if len(to_resolve) == 1:
+        # single lookups (e.g. one place at a time from the async pipeline) skip the pool
+        try:
+            p, r = _resolve_place(to_resolve[0])
+            coords[p] = r
+        except Exception:
+            coords[to_resolve[0]] = None
+    elif to_resolve:
         with ThreadPoolExecutor(max_workers=min(8, max(2, len(to_resolve)))) as ex:
-            futures = {ex.submit(_resolve_place, p): p for p in to_resolve}
+            futures = {ex.submit(bind_context(_resolve_place), p): p for p in to_resolve}
             for fut in as_completed(futures):
                 try:
                     p, r = fut.result()
@@ -199,11 +324,277 @@ def get_location_coordinates(places, location, country):
                 except Exception:
                     coords[futures[fut]] = None
 
-        # persist cache (best-effort)
-        _save_cache()
-
     return coords
 
+ORS_DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/{profile}/json"
+ROUTE_PROFILES = ("foot-walking", "driving-car")
+# (connect, read) timeout for directions; multi-waypoint routes take longer
+ORS_DIRECTIONS_TIMEOUT = (3.05, float(os.getenv("ORS_DIRECTIONS_TIMEOUT", "20")))
+# ORS rejects directions requests with more waypoints than this
+ORS_MAX_WAYPOINTS = 50
+# Serve estimated legs (straight line, calibrated speed) when ORS can't route
+ROUTE_ESTIMATE_FALLBACK = os.getenv("ROUTE_ESTIMATE_FALLBACK", "1").lower() not in ("0", "false", "no")
+# Decimal places kept in route cache keys; 4 is roughly 10 m.
+ROUTE_CACHE_PRECISION = int(os.getenv("ROUTE_CACHE_PRECISION", "4"))
+
+# Routed segments keyed on (profile, start, end), polylines stored encoded.
+route_cache = TieredCache(
+    "route",
+    maxsize=int(os.getenv("ROUTE_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("ROUTE_CACHE_TTL", str(14 * 24 * 3600))),
+    max_entries=int(os.getenv("ROUTE_CACHE_MAX_ROWS", "200000")),
+)
+
+
+@timed("ors_directions")
+def _ors_directions(profile, waypoints, api_key):
+    """POST one (possibly multi-waypoint) directions request to ORS.
+
+    Args:
+        profile (str): ORS profile, e.g. "foot-walking"
+        waypoints (list[dict]): [{'lat': float, 'lng': float}, ...]
+        api_key (str): ORS API key
+
+    Returns:
+        list[dict | None]: one leg per consecutive waypoint pair,
+        {'duration': s, 'distance': m, 'polyline': [[lat, lng], ...]}
+    """
+    body = {"coordinates": [[c['lng'], c['lat']] for c in waypoints]}
+    headers = {
+        'Accept': 'application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8',
+        'Authorization': api_key,
+        'Content-Type': 'application/json; charset=utf-8'
+    }
+    response = get_client('ors').post(ORS_DIRECTIONS_URL.format(profile=profile), json=body, headers=headers,
+                                      timeout=ORS_DIRECTIONS_TIMEOUT, operation="directions")
+    response.raise_for_status()  # Raise if status code != 200
+    data = response.json()
+
+    n_legs = len(waypoints) - 1
+    if not data.get('routes'):
+        return [None] * n_legs
+    route = data['routes'][0]
+    geometry = route.get('geometry')
+    points = polyline.decode(geometry) if isinstance(geometry, str) and geometry else []
+
+    if n_legs == 1:
+        summary = route.get('summary') or {}
+        return [{"duration": summary.get('duration'), "distance": summary.get('distance'), "polyline": points or None}]
+
+    # split the multi-waypoint route back into per-leg pieces
+    segments = route.get('segments') or []
+    way_points = route.get('way_points') or []
+    legs = []
+    for i in range(n_legs):
+        seg = segments[i] if i < len(segments) else {}
+        leg_points = None
+        if points and i + 1 < len(way_points):
+            leg_points = points[way_points[i]:way_points[i + 1] + 1] or None
+        legs.append({"duration": seg.get('duration'), "distance": seg.get('distance'), "polyline": leg_points})
+    return legs
+
+
+def _chains(pairs, indexes):
+    """Group pair indexes into runs where each pair starts where the last ended.
+
+    An itinerary's adjacent pairs form one chain, which can be routed with a
+    single multi-waypoint request per profile.
+    """
+    chains = []
+    for idx in indexes:
+        if (chains and len(chains[-1]) < ORS_MAX_WAYPOINTS - 1
+                and pairs[chains[-1][-1]][1] == pairs[idx][0]):
+            chains[-1].append(idx)
+        else:
+            chains.append([idx])
+    return chains
+
+
+def _pair_error(start_coords, end_coords):
+    """Why a (start, end) pair can't be routed, or None if it can."""
+    for coords in (start_coords, end_coords):
+        try:
+            lat, lng = float(coords['lat']), float(coords['lng'])
+        except (KeyError, TypeError, ValueError):
+            return "segment endpoints need numeric 'lat' and 'lng'"
+        if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+            return "segment endpoint is out of range"
+    return None
+
+
+def quantize(coords):
+    """(lat, lng) rounded to ``ROUTE_CACHE_PRECISION`` decimals."""
+    return (round(float(coords['lat']), ROUTE_CACHE_PRECISION),
+            round(float(coords['lng']), ROUTE_CACHE_PRECISION))
+
+
+def route_key(profile, start_coords, end_coords):
+    """Route cache key; coordinates are rounded so nearby points share it."""
+    (slat, slng), (elat, elng) = quantize(start_coords), quantize(end_coords)
+    p = ROUTE_CACHE_PRECISION
+    return f"{profile}|{slat:.{p}f},{slng:.{p}f}|{elat:.{p}f},{elng:.{p}f}"
+
+
+def pack_leg(leg):
+    """Storage form of a routed leg: the polyline encoded."""
+    return {
+        "duration": leg.get('duration'),
+        "distance": leg.get('distance'),
+        "polyline": polyline.encode(leg['polyline']) if leg.get('polyline') else None,
+    }
+
+
+def unpack_leg(entry):
+    """Inverse of ``pack_leg``."""
+    return {"duration": entry.get('duration'), "distance": entry.get('distance'),
+            "polyline": polyline.decode(entry['polyline']) if entry.get('polyline') else None}
+
+
+def cached_route(profile, start_coords, end_coords):
+    """Return a cached leg {'duration', 'distance', 'polyline'} or None."""
+    entry = route_cache.get(route_key(profile, start_coords, end_coords))
+    return unpack_leg(entry) if entry is not None else None
+
+
+def _cache_route(profile, start_coords, end_coords, leg):
+    route_cache.set(route_key(profile, start_coords, end_coords), {
+        **pack_leg(leg),
+        # endpoints are kept so cached routes can be compared to straight-line distance
+        "start": list(quantize(start_coords)),
+        "end": list(quantize(end_coords)),
+    })
+
+
+@timed("route_segments")
+def route_segments(pairs, api_key=None, profiles=ROUTE_PROFILES, estimate=False):
+    """Route many (start, end) pairs for every profile, concurrently.
+
+    Segments already in the route cache are served from it. The rest are
+    deduplicated, and adjacent ones are batched into one multi-waypoint
+    request per profile; cached segments between two uncached ones are
+    routed again in that request rather than splitting it in two. If a
+    batched request fails, its pairs are retried one by one so a single
+    unroutable stop only fails its own segments.
+
+    Args:
+        pairs (list[tuple[dict, dict]]): [(start_coords, end_coords), ...]
+        api_key (str): ORS API key
+        profiles (tuple[str]): ORS profiles to route
+        estimate (bool): Answer segments that can't be routed (no API key,
+            ORS errors) with an offline estimate instead of the exception
+
+    Returns:
+        list[dict]: per pair, profile -> leg dict, None (no route) or the
+        Exception raised while routing it; a pair with missing or invalid
+        coordinates gets a ValueError and is never sent upstream
+    """
+    results = [{} for _ in pairs]
+    if not pairs:
+        return results
+    malformed = {}
+    for i, (s, e) in enumerate(pairs):
+        error = _pair_error(s, e)
+        if error is not None:
+            malformed[i] = ValueError(error)
+
+    def _run(profile, chain):
+        waypoints = [pairs[chain[0]][0]] + [pairs[i][1] for i in chain]
+        flight_key = tuple(route_key(profile, pairs[i][0], pairs[i][1]) for i in chain)
+        try:
+            legs = route_flight.do(flight_key, _ors_directions, profile, waypoints, api_key)
+        except Exception as e:
+            if len(chain) == 1:
+                return [(profile, chain[0], e)]
+            legs = None
+        if legs is not None:
+            for i, leg in zip(chain, legs):
+                if leg:
+                    _cache_route(profile, pairs[i][0], pairs[i][1], leg)
+            return [(profile, i, leg) for i, leg in zip(chain, legs)]
+        # batched request failed: fall back to one request per pair
+        out = []
+        for i in chain:
+            out.extend(_run(profile, [i]))
+        return out
+
+    jobs = []
+    duplicates = {}  # pair index -> index of the identical pair that is routed
+    for profile in profiles:
+        first_by_key = {}
+        for i, (s, e) in enumerate(pairs):
+            if i in malformed:
+                results[i][profile] = malformed[i]
+                continue
+            key = route_key(profile, s, e)
+            if key in first_by_key:
+                duplicates.setdefault(profile, {})[i] = first_by_key[key]
+                continue
+            first_by_key[key] = i
+            leg = cached_route(profile, s, e)
+            if leg is not None:
+                results[i][profile] = leg
+        missing = {i for i in first_by_key.values() if profile not in results[i]}
+        if estimate and not api_key:
+            for i in missing:
+                results[i][profile] = estimate_leg(profile, *pairs[i])
+            continue
+        for chain in _chains(pairs, list(first_by_key.values())):
+            hits = [k for k, i in enumerate(chain) if i in missing]
+            if hits:
+                jobs.append((profile, chain[hits[0]:hits[-1] + 1]))
+
+    if jobs:
+        with ThreadPoolExecutor(max_workers=min(8, len(jobs))) as ex:
+            for fut in as_completed([ex.submit(bind_context(_run), profile, chain) for profile, chain in jobs]):
+                for profile, i, leg in fut.result():
+                    if estimate and isinstance(leg, Exception):
+                        logger.warning("Routing %s segment failed, using estimate: %s", profile, leg)
+                        leg = estimate_leg(profile, *pairs[i])
+                    results[i][profile] = leg
+    for profile, dups in duplicates.items():
+        for i, first in dups.items():
+            results[i][profile] = results[first].get(profile)
+    return results
+
+
+def leg_payload(leg, encoded=False, zoom=None):
+    """Wire format of one leg, optionally simplified for ``zoom``.
+
+    With ``encoded`` the polyline is sent as an encoded polyline string
+    (precision 5) instead of a list of [lat, lng], which is several times
+    smaller and much cheaper to serialize.
+    """
+    points = leg.get("polyline")
+    if not points:
+        return None
+    if zoom is not None:
+        points = polyline.simplify(points, polyline.tolerance_for_zoom(zoom, points[0][0]))
+    out = dict(leg)
+    out["polyline"] = polyline.encode(points) if encoded else points
+    return out
+
+
+def segment_payload(start_index, end_index, legs, encoded=False, zoom=None):
+    """Response shape for one routed pair, as returned by /api/route_polylines.
+
+    ``legs`` is one entry of ``route_segments``' result. A profile without a
+    route is None; see ``leg_payload`` for ``encoded`` and ``zoom``.
+    """
+    seg = {"start_index": start_index, "end_index": end_index}
+    errors = [leg for leg in legs.values() if isinstance(leg, Exception)]
+    if errors:
+        seg["error"] = str(errors[0])
+        return seg
+    walk = legs.get("foot-walking")
+    car = legs.get("driving-car")
+    seg["walk"] = leg_payload(walk, encoded, zoom) if walk else None
+    seg["car"] = leg_payload(car, encoded, zoom) if car else None
+    if any(leg and leg.get("estimated") for leg in (walk, car)):
+        seg["estimated"] = True
+    return seg
+
+
+@timed("find_path_and_time")
 def find_path_and_time(start_coords, end_coords, start_time):
     """Return a path and the time it takes given the start and end coordinates
 
@@ -213,70 +604,20 @@ def find_path_and_time(start_coords, end_coords, start_time):
         start_time: time after 1970 in seconds
 
     Returns:
+        tuple: (time_walk, time_car, distance_walk, distance_car,
+        polyline_walk, polyline_car); polylines are [[lat, lng], ...]
     """
 
-    # Load environment variables from .env file
-
-    # Dynamically determine the path to the .env file
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    dotenv_path = os.path.join(base_dir, ".env")
+    api_key = ors_api_key()
 
-    load_dotenv(dotenv_path=dotenv_path)
-    api_key = os.getenv("ORS_API_KEY")
-    
-    url_walk = "https://api.openrouteservice.org/v2/directions/foot-walking/json"
-    url_car = "https://api.openrouteservice.org/v2/directions/driving-car/json"
-
-    body = {
-        "coordinates": [[start_coords['lng'], start_coords['lat']], [end_coords['lng'], end_coords['lat']]],
-    }
-    headers = {
-        'Accept': 'application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8',
-    'Authorization': api_key,
-    'Content-Type': 'application/json; charset=utf-8'
-    }
-
-    response_walk = requests.post(url_walk, json=body, headers=headers)
-    response_walk.raise_for_status()  # Raise if status code != 200
-    data_walk = response_walk.json()
-
-    response_car = requests.post(url_car, json=body, headers=headers)
-    response_car.raise_for_status()  # Raise if status code != 200
-    data_car = response_car.json()
-
-    # Defaults in case routes are missing
-    time_walk = time_car = None
-    distance_walk = distance_car = None
-    polyline_decodedl_walk = polyline_decodedl_car = None
-
-    if data_walk.get('routes'):
-        time_walk = data_walk['routes'][0]['summary'].get('duration')
-        distance_walk = data_walk['routes'][0]['summary'].get('distance')
-        polyline_walk = data_walk['routes'][0].get('geometry')
-        # decode polyline only if openrouteservice is available
-        if openrouteservice and polyline_walk:
-            try:
-                decoded_walk = openrouteservice.convert.decode_polyline(polyline_walk)
-                polyline_decoded_walk = decoded_walk.get('coordinates')
-                if polyline_decoded_walk:
-                    polyline_decodedl_walk = [[lat, lon] for lon, lat in polyline_decoded_walk]
-            except Exception:
-                polyline_decodedl_walk = None
-
-    if data_car.get('routes'):
-        time_car = data_car['routes'][0]['summary'].get('duration')
-        distance_car = data_car['routes'][0]['summary'].get('distance')
-        polyline_car = data_car['routes'][0].get('geometry')
-        if openrouteservice and polyline_car:
-            try:
-                decoded_car = openrouteservice.convert.decode_polyline(polyline_car)
-                polyline_decoded_car = decoded_car.get('coordinates')
-                if polyline_decoded_car:
-                    polyline_decodedl_car = [[lat, lon] for lon, lat in polyline_decoded_car]
-            except Exception:
-                polyline_decodedl_car = None
-
-    return time_walk, time_car, distance_walk, distance_car, polyline_decodedl_walk, polyline_decodedl_car
+    legs = route_segments([(start_coords, end_coords)], api_key, estimate=ROUTE_ESTIMATE_FALLBACK)[0]
+    for leg in legs.values():
+        if isinstance(leg, Exception):
+            raise leg
+    walk = legs.get("foot-walking") or {}
+    car = legs.get("driving-car") or {}
+    return (walk.get('duration'), car.get('duration'), walk.get('distance'), car.get('distance'),
+            walk.get('polyline'), car.get('polyline'))
 
 if __name__ == "__main__":  
     print(os.getenv("ORS_API_KEY"))
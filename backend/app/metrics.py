@@ -0,0 +1,242 @@
+"""Request profiling and hot-path metrics
+
+Timing spans, counters and cache/provider stats, exposed two ways:
+
+- ``GET /api/metrics`` in the Prometheus text format (per worker);
+- a ``Server-Timing`` header on every response, with the time spent in each
+  span during that request, so the browser's network panel shows where the
+  latency went.
+
+Instrument code with ``with span("name"):``, ``@timed("name")`` or
+``record("name", seconds)``. With ``METRICS_ENABLED=0`` these are no-ops:
+``timed`` returns the function unchanged and ``span`` a shared null context.
+"""
+import contextlib
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_counters = {}     # (name, labels) -> value
+_histograms = {}   # (name, labels) -> [bucket counts..., count, sum]
+# Per-request span totals for Server-Timing: name -> [count, seconds]
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+_null = contextlib.nullcontext()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to the counter ``name`` with ``labels``."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Add one observation to the latency histogram ``name``."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+                break
+        hist[-2] += 1
+        hist[-1] += seconds
+
+
+def record(name, seconds):
+    """Record a finished span: histogram plus the current request's timing."""
+    if not METRICS_ENABLED:
+        return
+    observe("span_seconds", seconds, span=name)
+    spans = _request_spans.get()
+    if spans is not None:
+        with _lock:
+            entry = spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+
+@contextlib.contextmanager
+def _span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def span(name):
+    """Context manager timing the enclosed block as span ``name``."""
+    return _span(name) if METRICS_ENABLED else _null
+
+
+def timed(name):
+    """Decorator timing every call of a function (sync or async) as ``name``."""
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with _span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind_context(fn):
+    """Wrap ``fn`` to run in the caller's context (for thread pool submits).
+
+    Spans recorded in the pool then count towards the caller's request.
+    """
+    if not METRICS_ENABLED:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def start_request():
+    """Begin collecting spans for the current request."""
+    if METRICS_ENABLED:
+        _request_spans.set({})
+
+
+def request_spans():
+    """Spans recorded so far in the current request: name -> (count, seconds)."""
+    spans = _request_spans.get() or {}
+    with _lock:
+        return {name: tuple(v) for name, v in spans.items()}
+
+
+def server_timing(total=None):
+    """``Server-Timing`` header value for the current request."""
+    parts = [f'{name};dur={seconds * 1000:.1f};desc="{name} x{count}"'
+             for name, (count, seconds) in request_spans().items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                    for k, v in labels)
+    return "{" + body + "}"
+
+
+def _collected_counters():
+    """Counters kept elsewhere (caches, providers), read at scrape time."""
+    from .cache import cache_stats
+    from .providers import provider_stats
+
+    out = []
+    for name, stats in cache_stats().items():
+        for tier, hits in (("memory", stats["memory"]["hits"]), ("store", stats["store_hits"])):
+            out.append(("cache_hits_total", (("cache", name), ("tier", tier)), hits))
+        out.append(("cache_misses_total", (("cache", name),), stats["misses"]))
+        out.append(("cache_evictions_total", (("cache", name),), stats["evictions"]))
+    for name, stats in provider_stats().items():
+        for field in ("requests", "retries", "failures", "rejected"):
+            out.append((f"upstream_{field}_total", (("provider", name),), stats[field]))
+    return out
+
+
+def _collected_gauges():
+    """Provider health (recent latency, circuit state) and admission pools, read at scrape time."""
+    from .admission import admission_stats
+    from .resilience import OPEN, health_stats
+
+    out = []
+    for name, stats in admission_stats().items():
+        for field in ("active", "waiting", "limit"):
+            out.append((f"admission_{field}", (("pool", name),), stats[field]))
+    for name, stats in health_stats().items():
+        out.append(("upstream_circuit_open", (("provider", name),), int(stats["state"] == OPEN)))
+        for operation, op in stats["operations"].items():
+            for q in ("p50", "p95"):
+                if op[q] is not None:
+                    labels = (("operation", operation), ("provider", name), ("quantile", q))
+                    out.append(("upstream_recent_latency_seconds", labels, op[q]))
+    return out
+
+
+def render_prometheus():
+    """All metrics of this worker in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+    # the exposition format wants every sample of a family under its one
+    # TYPE line; collected stats come per cache/provider/pool, not per family
+    families = {}
+
+    def family(name, kind):
+        return families.setdefault(name, (kind, []))[1]
+
+    for (name, labels), value in counters + [((n, l), v) for n, l, v in _collected_counters()]:
+        family(name, "counter").append(f"{name}{_format_labels(labels)} {value}")
+    for name, labels, value in _collected_gauges():
+        family(name, "gauge").append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), hist in histograms:
+        samples = family(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(BUCKETS, hist):
+            cumulative += count
+            samples.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+        samples.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {hist[-2]}")
+        samples.append(f"{name}_count{_format_labels(labels)} {hist[-2]}")
+        samples.append(f"{name}_sum{_format_labels(labels)} {hist[-1]:.6f}")
+    lines = []
+    for name, (kind, samples) in families.items():
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    """Time every request and add the ``Server-Timing`` header."""
+    if not METRICS_ENABLED:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        start_request()
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _finish_timer(response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or "unmatched"
+        observe("http_request_seconds", elapsed, endpoint=endpoint, method=request.method)
+        inc("http_requests_total", endpoint=endpoint, method=request.method,
+            status=response.status_code)
+        # streamed bodies are still being produced; their total is only the setup time
+        response.headers["Server-Timing"] = server_timing(elapsed)
+        return response
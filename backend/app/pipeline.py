@@ -0,0 +1,343 @@
+"""Async itinerary pipeline
+
+Runs generation, geocoding and optimization for ``/api/generate_itinerary``
+on an asyncio event loop. The model output is streamed and parsed
+incrementally, and each place is geocoded as soon as it has been parsed, so
+geocoding overlaps with the rest of the model output instead of waiting for
+it.
+
+Gemini is called through its async API. Geocoding runs on worker threads via
+``asyncio.to_thread`` because it shares its caches, rate limiters and
+single-flight state with the synchronous endpoints.
+
+``stream_itinerary_events`` exposes the pipeline as a sequence of events
+(used for NDJSON/SSE responses); ``run_itinerary_pipeline`` just waits for
+the final one.
+
+Finished, geocoded results are cached by their normalized inputs and the
+model name. A hit skips the whole pipeline. Within the stale window, a stale
+entry is served immediately and refreshed in the background.
+
+``run_itinerary_batch`` runs many requests concurrently on one loop. Identical
+requests are generated once, places shared between days are geocoded once
+(shared cache plus single-flight), and route segments for all results go out
+as one deduplicated ``route_segments`` call.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from .admission import Overloaded, overloaded_payload
+from .cache import TieredCache, normalize_key
+from .itinerary_generator import (GEMINI_MODEL, arepair_itinerary_text, astream_itinerary_text,
+                                  fallback_itinerary, parse_itinerary_text)
+from .json_stream import PlaceStreamParser
+from .metrics import record, span
+from .map_service import (ROUTE_ESTIMATE_FALLBACK, get_location_coordinates, ors_api_key,
+                          route_segments, segment_payload)
+from .time_optimizer import solve_itinerary
+
+logger = logging.getLogger(__name__)
+
+# Seconds a generated itinerary is served as fresh, then as stale while it
+# is regenerated in the background (0 disables stale-while-revalidate).
+ITINERARY_CACHE_TTL = float(os.getenv("ITINERARY_CACHE_TTL", str(24 * 3600)))
+ITINERARY_CACHE_STALE = float(os.getenv("ITINERARY_CACHE_STALE", str(6 * 3600)))
+itinerary_cache = TieredCache(
+    "itinerary",
+    maxsize=int(os.getenv("ITINERARY_CACHE_SIZE", "256")),
+    ttl=ITINERARY_CACHE_TTL + ITINERARY_CACHE_STALE,
+    max_entries=int(os.getenv("ITINERARY_CACHE_MAX_ROWS", "5000")),
+)
+# Largest accepted batch, and how many of its itineraries are generated at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "14"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def itinerary_key(destination, month, budget, category, country=None):
+    """Cache key for a generated itinerary: normalized inputs plus model name."""
+    parts = (GEMINI_MODEL, destination, month, budget, category, country)
+    return "|".join(normalize_key(p) for p in parts)
+
+
+def place_name(item):
+    """Name of an itinerary item, whichever key the generator used."""
+    return item.get('place') or item.get('name') or item.get('title')
+
+
+async def generate_places(destination, month, budget, category, state=None):
+    """Yield itinerary items as soon as each one is parsed from the model stream.
+
+    If the model can't be reached, the sample itinerary is yielded instead
+    and ``state['fallback']`` is set; if the stream breaks off after some
+    places, those are kept and ``state['partial']`` is set. ``Overloaded``
+    (no LLM slot, quota exhausted) is raised instead, so the client is told
+    to retry.
+    """
+    state = state if state is not None else {}
+    parser = PlaceStreamParser()
+    text = []
+    try:
+        async for chunk in astream_itinerary_text(destination, month, budget, category):
+            text.append(chunk)
+            for item in parser.feed(chunk):
+                yield item
+    except Exception as e:
+        if isinstance(e, Overloaded) and not parser.emitted:
+            raise
+        logger.error("Error calling Gemini API: %s", e)
+        if parser.emitted:
+            # a truncated itinerary is served, but must not be cached
+            state['partial'] = True
+        else:
+            # Fallback to sample itinerary
+            state['fallback'] = True
+            for item in fallback_itinerary(destination):
+                yield item
+        return
+    if not parser.emitted:
+        # the stream never contained a well-formed place: tolerant parse of the
+        # whole text, then a targeted repair call rather than a regeneration
+        full_text = "".join(text).strip()
+        items = parse_itinerary_text(full_text)
+        if items is None:
+            items = await arepair_itinerary_text(full_text)
+        if items is None:
+            logger.error("Could not parse model output as JSON:\n%s", full_text)
+        for item in items or []:
+            yield item
+
+
+async def geocode_place(name, location, country):
+    """Resolve one place name off the event loop; returns {'lat','lng'} or None."""
+    if not name:
+        return None
+    with span("geocode_place"):
+        coords = await asyncio.to_thread(get_location_coordinates, [name], location, country)
+    return coords.get(name)
+
+
+async def stream_itinerary_events(destination, month, budget, category, country=None,
+                                  use_cache=True):
+    """Run the pipeline, yielding progress events as dicts.
+
+    Events, in order of first appearance:
+        {'event': 'place', 'index': i, 'item': {...}}
+        {'event': 'coordinates', 'index': i, 'name': str, 'coordinates': {...} | None}
+        {'event': 'done', 'destination', 'month', 'itinerary', 'optimization'}
+
+    On a cache hit only the 'done' event is sent, with ``cached: true``.
+    """
+    key = itinerary_key(destination, month, budget, category, country)
+    if use_cache:
+        entry = itinerary_cache.get(key)
+        if entry is not None:
+            age = time.time() - entry['created_at']
+            if age > ITINERARY_CACHE_TTL:
+                _refresh_in_background(key, destination, month, budget, category, country)
+            yield {'event': 'done', **entry['result'], 'destination': destination, 'month': month,
+                   'cached': True}
+            return
+
+    state = {}
+    items = []
+    lookups = set()
+    resolved = asyncio.Queue()
+
+    async def _geocode(index, item):
+        # every task must report exactly once, or the wait below never ends
+        coords = None
+        try:
+            coords = await geocode_place(place_name(item), destination, country)
+        except Exception:
+            logger.exception("Geocoding %r failed", place_name(item))
+        finally:
+            resolved.put_nowait((index, coords))
+
+    def _coordinates_event(index, coords):
+        items[index]['coordinates'] = coords
+        return {'event': 'coordinates', 'index': index, 'name': place_name(items[index]),
+                'coordinates': coords}
+
+    generation_started = time.perf_counter()
+    async for item in generate_places(destination, month, budget, category, state):
+        index = len(items)
+        items.append(item)
+        task = asyncio.create_task(_geocode(index, item))
+        lookups.add(task)
+        task.add_done_callback(lookups.discard)
+        yield {'event': 'place', 'index': index, 'item': dict(item)}
+        # flush lookups that finished while the model was still writing
+        while not resolved.empty():
+            yield _coordinates_event(*resolved.get_nowait())
+
+    record("generate_itinerary", time.perf_counter() - generation_started)
+
+    # geocoding that is still running once the model has finished
+    geocode_wait = time.perf_counter()
+    pending = len(items) - sum(1 for item in items if 'coordinates' in item)
+    for _ in range(pending):
+        yield _coordinates_event(*await resolved.get())
+    record("geocode_wait", time.perf_counter() - geocode_wait)
+
+    # Reorder stops to cut travel time while keeping their time windows
+    plan = await asyncio.to_thread(solve_itinerary, items)
+    optimization = {k: plan[k] for k in ('profile', 'travel_time_before', 'travel_time_after', 'overruns_day',
+                                         'elapsed_ms')}
+    result = {'destination': destination, 'month': month,
+              'itinerary': plan['itinerary'], 'optimization': optimization}
+    # never cache the sample itinerary, a truncated or an unparseable response
+    if plan['itinerary'] and not (state.get('fallback') or state.get('partial')):
+        itinerary_cache.set(key, {'created_at': time.time(), 'result': result})
+    yield {'event': 'done', **result}
+
+
+def _refresh_in_background(key, destination, month, budget, category, country):
+    """Regenerate a stale cache entry once, outside the current request."""
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    async def _refresh():
+        async for _ in stream_itinerary_events(destination, month, budget, category, country,
+                                               use_cache=False):
+            pass
+
+    def _run():
+        try:
+            asyncio.run(_refresh())
+        except Exception as e:
+            logger.exception("Background itinerary refresh failed: %s", e)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=_run, daemon=True).start()
+
+
+async def run_itinerary_pipeline(destination, month, budget, category, country=None):
+    """Generate, geocode and optimize an itinerary.
+
+    Returns:
+        dict: {'destination', 'month', 'itinerary', 'optimization'}
+    """
+    async for event in stream_itinerary_events(destination, month, budget, category, country):
+        if event['event'] == 'done':
+            return {k: v for k, v in event.items() if k != 'event'}
+
+
+def _adjacent_pairs(itinerary):
+    """(start_index, end_index, start, end) for neighbouring geocoded items."""
+    coords = [(item.get('coordinates') or {}) for item in itinerary]
+    return [(i, i + 1, coords[i], coords[i + 1]) for i in range(len(coords) - 1)
+            if coords[i].get('lat') is not None and coords[i + 1].get('lat') is not None]
+
+
+async def run_itinerary_batch(batch, include_routes=False):
+    """Run several itinerary requests at once, isolating their failures.
+
+    Args:
+        batch (list[dict | Exception]): Pipeline kwargs per request
+            (destination, month, budget, category, country), or the
+            validation error for a request that couldn't be parsed
+        include_routes (bool): Also route adjacent stops of every result
+
+    Returns:
+        list[dict]: per request, in order, ``{'index', 'ok': True, ...result}``
+        or ``{'index', 'ok': False, 'error'}``
+    """
+    semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def _run(params):
+        async with semaphore:
+            return await run_itinerary_pipeline(**params)
+
+    jobs = {}
+    keys = []
+    for params in batch:
+        if isinstance(params, Exception):
+            keys.append(None)
+            continue
+        key = itinerary_key(params['destination'], params.get('month'), params.get('budget'),
+                            params.get('category'), params.get('country'))
+        if key not in jobs:
+            jobs[key] = asyncio.ensure_future(_run(params))
+        keys.append(key)
+    outcomes = dict(zip(jobs, await asyncio.gather(*jobs.values(), return_exceptions=True)))
+
+    if include_routes:
+        # one call for the whole batch: shared segments are routed once
+        owners, pairs = [], []
+        for key, result in outcomes.items():
+            if isinstance(result, dict):
+                result['routes'] = []
+                for start_index, end_index, start, end in _adjacent_pairs(result['itinerary']):
+                    owners.append((key, start_index, end_index))
+                    pairs.append((start, end))
+        try:
+            legs_per_pair = await asyncio.to_thread(route_segments, pairs, ors_api_key(),
+                                                   estimate=ROUTE_ESTIMATE_FALLBACK)
+        except Exception as e:
+            legs_per_pair = [{'error': e}] * len(pairs)
+        for (key, start_index, end_index), legs in zip(owners, legs_per_pair):
+            outcomes[key]['routes'].append(segment_payload(start_index, end_index, legs))
+
+    results = []
+    for index, (params, key) in enumerate(zip(batch, keys)):
+        outcome = params if key is None else outcomes[key]
+        if isinstance(outcome, Exception):
+            if key is not None:
+                logger.error("Batch itinerary failed: %s", outcome)
+            error = {'index': index, 'ok': False, 'error': str(outcome)}
+            if isinstance(outcome, Overloaded):
+                error.update(overloaded_payload(outcome), status=outcome.status)
+            results.append(error)
+        else:
+            results.append({**outcome, 'index': index, 'ok': True,
+                            'destination': params['destination'], 'month': params.get('month')})
+    return results
+
+
+_END = object()
+
+
+def iter_events(agen_factory):
+    """Drive an async event generator from sync code (e.g. a WSGI response).
+
+    The generator runs on its own event loop in a background thread; events
+    are handed over through a queue as soon as they are produced.
+    """
+    events = queue.Queue()
+
+    async def _pump():
+        try:
+            async for event in agen_factory():
+                events.put(event)
+        except Overloaded as e:
+            events.put({'event': 'error', 'status': e.status, **overloaded_payload(e)})
+        except Exception as e:
+            events.put({'event': 'error', 'error': str(e)})
+        finally:
+            events.put(_END)
+
+    threading.Thread(target=lambda: asyncio.run(_pump()), daemon=True).start()
+    while True:
+        event = events.get()
+        if event is _END:
+            return
+        yield event
+
+
+def format_ndjson(event):
+    return json.dumps(event) + "\n"
+
+
+def format_sse(event):
+    return f"event: {event.get('event', 'message')}\ndata: {json.dumps(event)}\n\n"
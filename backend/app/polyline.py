@@ -0,0 +1,132 @@
+"""Encoded polyline helpers
+
+Implements the Google encoded polyline algorithm used by ORS for route
+geometries, so routes can be split, cached and sent without depending on the
+openrouteservice client library.
+
+``simplify`` drops points that are invisible at a given map zoom
+(Douglas-Peucker), which keeps route payloads small.
+"""
+import math
+import os
+
+import numpy as np
+
+# Web-Mercator ground resolution at zoom 0 on the equator, meters per pixel
+METERS_PER_PIXEL_Z0 = 156543.03392
+# How far (in screen pixels) a simplified line may stray from the original
+SIMPLIFY_PIXELS = float(os.getenv("POLYLINE_SIMPLIFY_PIXELS", "1"))
+# Web map zoom levels
+MIN_ZOOM, MAX_ZOOM = 0, 22
+
+
+def decode(encoded, precision=5):
+    """Decode an encoded polyline.
+
+    Args:
+        encoded (str): Encoded polyline string
+        precision (int): Number of decimal places used when encoding
+
+    Returns:
+        list[list[float]]: [[lat, lng], ...]
+    """
+    factor = 10 ** precision
+    points = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append([lat / factor, lng / factor])
+    return points
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def encode(points, precision=5):
+    """Encode [[lat, lng], ...] as a polyline string."""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lng = 0
+    for lat, lng in points:
+        ilat = int(round(lat * factor))
+        ilng = int(round(lng * factor))
+        out.append(_encode_value(ilat - prev_lat))
+        out.append(_encode_value(ilng - prev_lng))
+        prev_lat, prev_lng = ilat, ilng
+    return "".join(out)
+
+
+def tolerance_for_zoom(zoom, lat=0.0, pixels=SIMPLIFY_PIXELS):
+    """Simplification tolerance in meters for a map zoom level at ``lat``.
+
+    ``zoom`` is clamped to ``MIN_ZOOM``..``MAX_ZOOM``.
+
+    Raises:
+        ValueError: if ``zoom`` is not a finite number
+    """
+    zoom = float(zoom)
+    if not math.isfinite(zoom):
+        raise ValueError("zoom must be a finite number")
+    zoom = min(MAX_ZOOM, max(MIN_ZOOM, zoom))
+    return METERS_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / (2 ** zoom) * pixels
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker simplification.
+
+    Args:
+        points (list[list[float]]): [[lat, lng], ...]
+        tolerance (float): Max distance in meters between the simplified
+            line and any dropped point
+
+    Returns:
+        list[list[float]]: The kept points, endpoints always included
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return [list(p) for p in points]
+    arr = np.asarray(points, dtype=float)
+    # local equirectangular projection in meters is plenty at route scale
+    lat0 = math.radians(float(arr[:, 0].mean()))
+    xy = np.column_stack([arr[:, 1] * 111320.0 * math.cos(lat0), arr[:, 0] * 110540.0])
+    keep = np.zeros(len(arr), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(arr) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = xy[first], xy[last]
+        inner = xy[first + 1:last]
+        dx, dy = end - start
+        length = math.hypot(dx, dy)
+        if length == 0:
+            dists = np.hypot(inner[:, 0] - start[0], inner[:, 1] - start[1])
+        else:
+            dists = np.abs(dx * (inner[:, 1] - start[1]) - dy * (inner[:, 0] - start[0])) / length
+        idx = int(np.argmax(dists))
+        if dists[idx] > tolerance:
+            split = first + 1 + idx
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return arr[keep].tolist()
@@ -0,0 +1,212 @@
+"""Outbound HTTP clients for the upstream map providers.
+
+Each upstream (ORS, Nominatim) gets one pooled, keep-alive ``requests.Session``
+per worker process, with its own timeout and retry policy. Retries use
+jittered exponential backoff on connection errors, 429 and 5xx responses, and
+honour ``Retry-After`` when the provider sends it. Every attempt is recorded
+in the provider's health (``app/resilience.py``), whose circuit breaker can
+refuse calls while the provider is failing.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import inc
+from .ratelimit import TokenBucket
+from .resilience import CircuitOpenError, health
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class ProviderClient:
+    """Pooled HTTP client for a single upstream provider.
+
+    Args:
+        name (str): Provider name, used in logs and stats.
+        timeout (float | tuple): Per-request timeout (connect, read) in seconds.
+        max_retries (int): Retries after the first attempt.
+        backoff (float): Base backoff in seconds; doubled on every retry.
+        max_backoff (float): Upper bound for a single backoff sleep.
+        pool_size (int): Max keep-alive connections kept to the provider.
+        headers (dict | None): Default headers sent with every request.
+        limiter (TokenBucket | dict | None): Rate limiter consulted before every
+            attempt, or a dict of them keyed by ``operation``; operations
+            without a bucket of their own use the ``"default"`` entry.
+    """
+
+    def __init__(self, name, timeout=10.0, max_retries=2, backoff=0.3, max_backoff=4.0,
+                 pool_size=8, headers=None, limiter=None):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.headers = dict(headers or {})
+        self.limiter = limiter
+        self._pid = None
+        self._session = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    @property
+    def session(self):
+        # sessions hold sockets, so a forked worker must not reuse its parent's
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                          pool_block=True)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+                    self._pid = pid
+        return self._session
+
+    def _limiter_for(self, operation):
+        if isinstance(self.limiter, dict):
+            return self.limiter.get(operation, self.limiter.get("default"))
+        return self.limiter
+
+    def _sleep_for(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        # full jitter spreads retries from concurrent workers apart
+        return random.uniform(0, delay)
+
+    def request(self, method, url, operation="default", **kwargs):
+        """Send a request, retrying transient failures.
+
+        Returns the final ``requests.Response``; raises the last connection
+        error if every attempt failed to get a response at all, or
+        ``CircuitOpenError`` if the provider's circuit is open, or
+        ``RateLimited`` if no rate limit token is due within its ``max_wait``.
+        ``operation`` names the kind of call in the provider's latency stats
+        and picks its rate limiter.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        provider_health = health(self.name)
+        limiter = self._limiter_for(operation)
+        attempt = 0
+        while True:
+            if not provider_health.allow():
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            self.requests += 1
+            response = None
+            if limiter is not None:
+                limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+                provider_health.record(operation, time.perf_counter() - started,
+                                       response.status_code < 500 and response.status_code != 429)
+                inc("upstream_responses_total", provider=self.name, status=response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    if response.status_code >= 500:
+                        self.failures += 1
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                provider_health.record(operation, time.perf_counter() - started, False)
+                if attempt >= self.max_retries:
+                    self.failures += 1
+                    raise
+            delay = self._sleep_for(attempt, response)
+            logger.info("%s: retrying %s %s in %.2fs (attempt %d)", self.name, method, url,
+                        delay, attempt + 1)
+            self.retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        stats = {"requests": self.requests, "retries": self.retries, "failures": self.failures,
+                 "rejected": self.rejected, "health": health(self.name).stats()}
+        if isinstance(self.limiter, dict):
+            stats["rate_limit"] = {op: bucket.stats() for op, bucket in self.limiter.items()}
+        elif self.limiter is not None:
+            stats["rate_limit"] = self.limiter.stats()
+        return stats
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _ors_bucket(operation, rate, burst):
+    # ORS_RATE_LIMIT / ORS_RATE_BURST set both buckets, the per-operation
+    # variables override them
+    env = operation.upper()
+    return TokenBucket(
+        f"ors_{operation}",
+        rate=float(os.getenv(f"ORS_{env}_RATE_LIMIT", os.getenv("ORS_RATE_LIMIT", rate))),
+        capacity=float(os.getenv(f"ORS_{env}_RATE_BURST", os.getenv("ORS_RATE_BURST", burst))),
+        # callers hedge or estimate instead; a long queue would only hold a thread
+        max_wait=float(os.getenv("ORS_MAX_WAIT", "2")),
+    )
+
+
+def _build(name):
+    if name == "ors":
+        # free tier: ~100 geocodes and 40 directions per minute, counted apart
+        geocode = _ors_bucket("geocode", "1.5", "5")
+        return ProviderClient(
+            "ors",
+            timeout=(3.05, float(os.getenv("ORS_TIMEOUT", "8"))),
+            max_retries=int(os.getenv("ORS_MAX_RETRIES", "2")),
+            pool_size=int(os.getenv("ORS_POOL_SIZE", "16")),
+            limiter={"default": geocode, "geocode": geocode,
+                     "directions": _ors_bucket("directions", "0.6", "3")},
+        )
+    if name == "nominatim":
+        return ProviderClient(
+            "nominatim",
+            timeout=(3.05, float(os.getenv("NOMINATIM_TIMEOUT", "10"))),
+            max_retries=int(os.getenv("NOMINATIM_MAX_RETRIES", "1")),
+            # Nominatim's usage policy allows a single connection per client
+            pool_size=int(os.getenv("NOMINATIM_POOL_SIZE", "2")),
+            headers={"User-Agent": "NewHacksDev/1.0 (dev@example.com)"},
+            # usage policy: at most one request per second for the whole app
+            limiter=TokenBucket("nominatim", rate=float(os.getenv("NOMINATIM_RATE_LIMIT", "1")),
+                                capacity=1, max_wait=float(os.getenv("NOMINATIM_MAX_WAIT", "3"))),
+        )
+    raise KeyError(f"unknown provider {name!r}")
+
+
+def get_client(name):
+    """Return the shared ``ProviderClient`` for ``"ors"`` or ``"nominatim"``."""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = _build(name)
+    return client
+
+
+def provider_stats():
+    """Return request/retry/failure counters for every client created so far."""
+    return {name: c.stats() for name, c in _clients.items()}
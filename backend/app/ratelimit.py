@@ -0,0 +1,117 @@
+"""Client-side rate limiting for upstream providers.
+
+``TokenBucket`` keeps its state in the shared SQLite cache database, so the
+limit holds across threads *and* gunicorn workers: Nominatim allows one
+request per second per application, not per process. Each ``acquire`` reserves
+a token in a single ``BEGIN IMMEDIATE`` transaction and then sleeps until the
+reservation is due, which keeps callers roughly first-come first-served.
+
+If the database cannot be used the bucket degrades to a per-process limiter.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+from .cache import get_store
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """Raised when waiting for a token would exceed the caller's deadline."""
+
+    def __init__(self, name, wait):
+        super().__init__(f"rate limit for {name} exceeded (would wait {wait:.1f}s)")
+        self.name = name
+        self.wait = wait
+
+
+class TokenBucket:
+    """Token bucket shared by every worker using the same cache database.
+
+    Args:
+        name (str): Bucket name, one per provider.
+        rate (float): Tokens added per second.
+        capacity (float): Maximum burst size.
+        max_wait (float): Longest a caller may wait for a token before
+            ``RateLimited`` is raised.
+    """
+
+    def __init__(self, name, rate, capacity=1.0, max_wait=30.0, store=None):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.max_wait = max_wait
+        self._store = store
+        self._schema_ready = False
+        # per-process fallback state
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self.acquired = 0
+        self.waited = 0.0
+        self.rejected = 0
+
+    def _reserve_shared(self, now):
+        conn = (self._store or get_store()).connection()
+        if not self._schema_ready:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits ("
+                " name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._schema_ready = True
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_limits WHERE name = ?", (self.name,)
+            ).fetchone()
+            tokens, updated = row if row else (self.capacity, now)
+            tokens, wait = self._take(tokens, updated, now)
+            if wait <= self.max_wait:
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    (self.name, tokens, now),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def _reserve_local(self, now):
+        with self._lock:
+            tokens, wait = self._take(self._tokens, self._updated, now)
+            if wait <= self.max_wait:
+                self._tokens, self._updated = tokens, now
+        return wait
+
+    def _take(self, tokens, updated, now):
+        """Refill, then reserve one token; tokens below zero are a queue."""
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate) - 1
+        wait = max(0.0, -tokens / self.rate)
+        return tokens, wait
+
+    def acquire(self):
+        """Block until a token is available.
+
+        Raises:
+            RateLimited: if the wait would be longer than ``max_wait``.
+        """
+        now = time.time()
+        try:
+            wait = self._reserve_shared(now)
+        except sqlite3.Error:
+            logger.warning("Shared rate limiter %s unavailable; using per-process limit", self.name)
+            wait = self._reserve_local(now)
+        if wait > self.max_wait:
+            self.rejected += 1
+            raise RateLimited(self.name, wait)
+        if wait > 0:
+            self.waited += wait
+            time.sleep(wait)
+        self.acquired += 1
+
+    def stats(self):
+        return {"acquired": self.acquired, "waited_s": round(self.waited, 3),
+                "rejected": self.rejected}
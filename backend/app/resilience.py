@@ -0,0 +1,277 @@
+"""Per-provider health: latency histograms, circuit breakers and hedging
+
+Every upstream attempt made through ``ProviderClient`` is recorded here,
+per provider and operation (``ors``/``geocode``, ``ors``/``directions``,
+``nominatim``/``search``), in a rolling latency histogram covering the last
+``HEALTH_WINDOW_S`` seconds. From it:
+
+- each provider has a circuit breaker. While the window's error rate is
+  above ``BREAKER_ERROR_RATE`` the circuit opens and calls fail fast with
+  ``CircuitOpenError`` for ``BREAKER_COOLDOWN_S``; then a single probe call
+  is let through (half-open), and its outcome closes or re-opens the circuit;
+- ``hedged()`` runs a primary lookup and, if it hasn't answered within the
+  primary's recent p95 latency, starts the fallback in parallel and takes
+  the first good answer. A slow ORS then costs about its p95, not its full
+  timeout, on every place.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .metrics import bind_context, inc
+
+logger = logging.getLogger(__name__)
+
+HEALTH_WINDOW_S = float(os.getenv("HEALTH_WINDOW_S", "60"))
+# the window is kept as this many rotating slots
+HEALTH_SLOTS = 6
+# Upper bounds (seconds) of the latency histogram buckets, roughly log-spaced
+LATENCY_BUCKETS = (0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0,
+                   1.5, 2.0, 3.0, 4.0, 6.0, 8.0, 10.0, 15.0, 20.0, 30.0)
+
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "1").lower() not in ("0", "false", "no")
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+# calls in the window before the error rate is trusted
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_COOLDOWN_S = float(os.getenv("BREAKER_COOLDOWN_S", "30"))
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1").lower() not in ("0", "false", "no")
+HEDGE_PERCENTILE = 95
+# samples needed before the percentile is used instead of HEDGE_DEFAULT_DELAY_S
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY_S = float(os.getenv("HEDGE_DEFAULT_DELAY_S", "1.5"))
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", "0.2"))
+HEDGE_POOL_SIZE = 16
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a provider whose circuit is open."""
+
+
+class RollingHistogram:
+    """Latency histogram and error count over the last ``window`` seconds."""
+
+    def __init__(self, window=HEALTH_WINDOW_S, slots=HEALTH_SLOTS):
+        self.slot_s = window / slots
+        # per slot: [slot number, bucket counts..., errors]
+        self._slots = [[-1] + [0] * (len(LATENCY_BUCKETS) + 2) for _ in range(slots)]
+
+    def _slot(self, now):
+        number = int(now // self.slot_s)
+        slot = self._slots[number % len(self._slots)]
+        if slot[0] != number:
+            slot[:] = [number] + [0] * (len(slot) - 1)
+        return slot
+
+    def add(self, seconds, ok, now=None):
+        slot = self._slot(time.time() if now is None else now)
+        # the last bucket catches anything slower than the largest bound
+        slot[1 + bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        if not ok:
+            slot[-1] += 1
+
+    def reset(self):
+        for slot in self._slots:
+            slot[0] = -1
+
+    def totals(self, now=None):
+        """(bucket counts, calls, errors) over the window."""
+        oldest = int((time.time() if now is None else now) // self.slot_s) - len(self._slots) + 1
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        errors = 0
+        for slot in self._slots:
+            if slot[0] >= oldest:
+                for i, c in enumerate(slot[1:-1]):
+                    counts[i] += c
+                errors += slot[-1]
+        return counts, sum(counts), errors
+
+    def percentile(self, q, now=None):
+        """Upper bound of the bucket holding the q-th percentile, or None."""
+        counts, calls, _ = self.totals(now)
+        if not calls:
+            return None
+        rank = calls * q / 100.0
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class ProviderHealth:
+    """Latency histograms (per operation) and the circuit breaker of a provider."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._window = RollingHistogram()
+        self._operations = {}
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probe_at = None
+        self.rejected = 0
+
+    def histogram(self, operation):
+        with self._lock:
+            hist = self._operations.get(operation)
+            if hist is None:
+                hist = self._operations[operation] = RollingHistogram()
+            return hist
+
+    def _transition(self, state):
+        self.state = state
+        inc("circuit_transitions_total", provider=self.name, state=state)
+        log = logger.warning if state == OPEN else logger.info
+        log("%s circuit %s", self.name, state.replace("_", "-"))
+
+    def allow(self):
+        """Whether a call may go out now; open circuits admit one probe per cooldown."""
+        if not BREAKER_ENABLED:
+            return True
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.time()
+            if self.state == OPEN and now - self._opened_at >= BREAKER_COOLDOWN_S:
+                self._transition(HALF_OPEN)
+            # a probe that never reported back (e.g. its caller died) is replaced
+            if self.state == HALF_OPEN and (self._probe_at is None
+                                            or now - self._probe_at >= BREAKER_COOLDOWN_S):
+                self._probe_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, operation, seconds, ok):
+        """Record one finished attempt and update the breaker."""
+        hist = self.histogram(operation)
+        with self._lock:
+            hist.add(seconds, ok)
+            self._window.add(seconds, ok)
+            if not BREAKER_ENABLED:
+                return
+            if self.state == HALF_OPEN:
+                self._probe_at = None
+                if ok:
+                    self._window.reset()
+                    self._transition(CLOSED)
+                else:
+                    self._opened_at = time.time()
+                    self._transition(OPEN)
+                return
+            if self.state == CLOSED and not ok:
+                _, calls, errors = self._window.totals()
+                if calls >= BREAKER_MIN_CALLS and errors / calls >= BREAKER_ERROR_RATE:
+                    self._opened_at = time.time()
+                    self._transition(OPEN)
+
+    def hedge_delay(self, operation, ceiling=None):
+        """Seconds to wait for ``operation`` before hedging: its recent p95."""
+        hist = self.histogram(operation)
+        with self._lock:
+            _, calls, _ = hist.totals()
+            delay = hist.percentile(HEDGE_PERCENTILE) if calls >= HEDGE_MIN_SAMPLES else None
+        delay = HEDGE_DEFAULT_DELAY_S if delay is None else max(HEDGE_MIN_DELAY_S, delay)
+        return min(delay, ceiling) if ceiling is not None else delay
+
+    def stats(self):
+        with self._lock:
+            _, calls, errors = self._window.totals()
+            operations = {}
+            for operation, hist in self._operations.items():
+                _, op_calls, op_errors = hist.totals()
+                operations[operation] = {"calls": op_calls, "errors": op_errors,
+                                         "p50": hist.percentile(50), "p95": hist.percentile(95)}
+            return {"state": self.state, "calls": calls, "errors": errors,
+                    "rejected": self.rejected, "operations": operations}
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def health(name):
+    """Return the ``ProviderHealth`` of provider ``name``."""
+    entry = _health.get(name)
+    if entry is None:
+        with _health_lock:
+            entry = _health.setdefault(name, ProviderHealth(name))
+    return entry
+
+
+def health_stats():
+    return {name: h.stats() for name, h in _health.items()}
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    # threads don't survive a fork; each worker builds its own pool
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="hedge")
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def hedged(primary, fallback, delay, name="lookup"):
+    """First good (non-None) answer of ``primary``, hedged with ``fallback``.
+
+    ``primary`` gets ``delay`` seconds on its own. If it fails or answers
+    None in that time, ``fallback`` runs right away, as a plain fallback
+    would; if it is merely slow, ``fallback`` is started alongside it and
+    whichever gives a good answer first wins. The loser is not cancelled
+    (requests can't be), its answer is just ignored.
+
+    Args:
+        primary, fallback (Callable[[], object | None]): Lookups; exceptions
+            count as no answer
+        delay (float): Hedging delay in seconds
+        name (str): Label for the ``hedged_requests_total`` counter
+
+    Returns:
+        object | None: The winning answer
+    """
+    if not HEDGE_ENABLED:
+        return _quiet(primary) or _quiet(fallback)
+    pool = _executor()
+    first = pool.submit(bind_context(_quiet), primary)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        result = first.result()
+        if result is not None:
+            return result
+        inc("hedged_requests_total", lookup=name, outcome="fallback")
+        return _quiet(fallback)
+
+    inc("hedged_requests_total", lookup=name, outcome="hedged")
+    second = pool.submit(bind_context(_quiet), fallback)
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            result = fut.result()
+            if result is not None:
+                inc("hedged_wins_total", lookup=name, winner="primary" if fut is first else "fallback")
+                return result
+    return None
+
+
+def _quiet(fn):
+    try:
+        return fn()
+    except Exception as e:
+        logger.debug("Hedged lookup failed: %s", e)
+        return None
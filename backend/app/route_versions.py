@@ -0,0 +1,192 @@
+"""Incremental routing of edited itineraries
+
+Every routed itinerary is stored as a version: its stop sequence and the
+legs of each adjacent pair, keyed by a hash of the stops. When the user
+reorders, adds or removes a stop, the client sends the previous version ID
+with the edit (or the new stop list); the stop sequences are diffed by
+adjacent pair, and only pairs the previous version didn't have are routed.
+Separate runs of new pairs are joined by bridge legs (end of one run to the
+start of the next) into a single chain, so any one edit costs one
+multi-waypoint routing call per profile instead of routing all N-1
+segments again. The bridge legs are discarded.
+
+Versions live in the shared cache, so any worker can continue an edit
+session. Version IDs are content hashes: the same stops always give the
+same ID.
+"""
+import hashlib
+import json
+import os
+
+from .cache import TieredCache
+from .map_service import pack_leg, quantize, route_segments, unpack_leg
+from .metrics import inc
+
+# Stored itinerary versions: version ID -> {'stops': [...], 'segments': [...]}
+segment_store = TieredCache(
+    "itinerary_segments",
+    maxsize=int(os.getenv("ITINERARY_SEGMENTS_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("ITINERARY_SEGMENTS_TTL", str(24 * 3600))),
+    max_entries=int(os.getenv("ITINERARY_SEGMENTS_MAX_ROWS", "20000")),
+)
+# Decimal places kept for stop coordinates in a version (about 0.1 m)
+STOP_PRECISION = 6
+EDIT_OPS = ("insert", "remove", "move", "replace")
+
+
+class UnknownVersion(KeyError):
+    """The base version has expired or never existed."""
+
+
+def _stop(coords):
+    if not coords or coords.get('lat') is None or coords.get('lng') is None:
+        return None
+    return {'lat': round(float(coords['lat']), STOP_PRECISION),
+            'lng': round(float(coords['lng']), STOP_PRECISION)}
+
+
+def stops_of(itinerary):
+    """Stop coordinates of an itinerary as sent to /api/route_polylines.
+
+    Items without coordinates are kept as None so indexes stay aligned.
+    """
+    return [_stop((item or {}).get('coordinates') or (item or {}).get('coords')) for item in itinerary]
+
+
+def version_id(stops):
+    """Content hash of a stop sequence."""
+    body = json.dumps([[s['lat'], s['lng']] if s else None for s in stops], separators=(",", ":"))
+    return hashlib.blake2b(body.encode(), digest_size=12).hexdigest()
+
+
+def _index(edit, field, size):
+    try:
+        index = int(edit[field])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"edit needs an integer '{field}'")
+    if not 0 <= index < size:
+        raise ValueError(f"edit '{field}' {index} is out of range")
+    return index
+
+
+def apply_edit(stops, edit):
+    """Apply one edit, or a list of edits in order, to a stop sequence.
+
+    Edits:
+      {"op": "insert", "index": i, "coordinates": {lat, lng}}
+      {"op": "remove", "index": i}
+      {"op": "move", "from": i, "to": j}
+      {"op": "replace", "index": i, "coordinates": {lat, lng}}
+
+    Returns:
+        list: The new stops; ``stops`` is not modified
+
+    Raises:
+        ValueError: On a malformed edit
+    """
+    stops = list(stops)
+    for op in edit if isinstance(edit, list) else [edit]:
+        kind = op.get('op') if isinstance(op, dict) else None
+        if kind not in EDIT_OPS:
+            raise ValueError(f"edit op must be one of {', '.join(EDIT_OPS)}")
+        if kind == "insert":
+            stops.insert(_index(op, 'index', len(stops) + 1), _stop(op.get('coordinates')))
+        elif kind == "remove":
+            del stops[_index(op, 'index', len(stops))]
+        elif kind == "move":
+            stop = stops.pop(_index(op, 'from', len(stops)))
+            stops.insert(_index(op, 'to', len(stops) + 1), stop)
+        else:
+            stops[_index(op, 'index', len(stops))] = _stop(op.get('coordinates'))
+    return stops
+
+
+def base_stops(base_version):
+    """Stops of a stored version.
+
+    Raises:
+        UnknownVersion: If the version is not (or no longer) stored
+    """
+    entry = segment_store.get(base_version) if base_version else None
+    if entry is None:
+        raise UnknownVersion(base_version)
+    return entry['stops']
+
+
+def _storable(legs):
+    """Legs worth keeping for the next version, packed, or None."""
+    packed = {}
+    for profile, leg in legs.items():
+        # failures and offline estimates are routed again next time
+        if isinstance(leg, Exception) or (leg and leg.get('estimated')):
+            return None
+        packed[profile] = pack_leg(leg) if leg else None
+    return packed
+
+
+def _bridged(stops, missing):
+    """Pairs for the ``missing`` pair indexes, joined into one chain.
+
+    Returns:
+        tuple[list, list[int]]: the (start, end) pairs to route, bridges
+        included, and the position in it of each missing pair
+    """
+    pairs, positions = [], []
+    for i in missing:
+        if pairs and pairs[-1][1] != stops[i]:
+            pairs.append((pairs[-1][1], stops[i]))
+        positions.append(len(pairs))
+        pairs.append((stops[i], stops[i + 1]))
+    return pairs, positions
+
+
+def route_itinerary(stops, base_version=None, api_key=None, estimate=False):
+    """Route the adjacent pairs of ``stops``, reusing a previous version's legs.
+
+    Args:
+        stops (list[dict | None]): Stop coordinates, None for a stop without any
+        base_version (str | None): Version whose segments may be reused; an
+            unknown version just means nothing is reused
+        api_key (str): ORS API key
+        estimate (bool): See ``route_segments``
+
+    Returns:
+        tuple[str, list[dict | None], dict]: the new version ID; per adjacent
+        pair (i, i+1), the legs by profile as returned by ``route_segments``
+        or None where a stop has no coordinates; and {'routed', 'reused'}
+        segment counts
+    """
+    known = {}
+    previous = segment_store.get(base_version) if base_version else None
+    if previous:
+        old = previous['stops']
+        for a, b, packed in zip(old, old[1:], previous['segments']):
+            if a and b and packed is not None:
+                known[(quantize(a), quantize(b))] = packed
+
+    legs_per_pair = [None] * max(0, len(stops) - 1)
+    missing = []
+    for i, (a, b) in enumerate(zip(stops, stops[1:])):
+        if not (a and b):
+            continue
+        packed = known.get((quantize(a), quantize(b)))
+        if packed is not None:
+            legs_per_pair[i] = {profile: unpack_leg(e) if e else None for profile, e in packed.items()}
+        else:
+            missing.append(i)
+    if missing:
+        pairs, positions = _bridged(stops, missing)
+        routed = route_segments(pairs, api_key, estimate=estimate)
+        for i, pos in zip(missing, positions):
+            legs_per_pair[i] = routed[pos]
+
+    version = version_id(stops)
+    if missing or version != base_version:
+        segment_store.set(version, {
+            "stops": stops,
+            "segments": [_storable(legs) if legs is not None else None for legs in legs_per_pair],
+        })
+    reused = sum(1 for legs in legs_per_pair if legs is not None) - len(missing)
+    inc("itinerary_segments_total", reused, source="reused")
+    inc("itinerary_segments_total", len(missing), source="routed")
+    return version, legs_per_pair, {"routed": len(missing), "reused": reused}
@@ -1,7 +1,17 @@
-from flask import Blueprint, request, jsonify
-from .map_service import get_location_coordinates, find_path_and_time
+import logging
+import math
+
+from flask import Blueprint, Response, request, jsonify
+from .map_service import (ROUTE_ESTIMATE_FALLBACK, get_location_coordinates, route_segments, ors_api_key,
+                          segment_payload)
+from .cache import cache_stats
+from .metrics import METRICS_ENABLED, render_prometheus, span
+from .polyline import MAX_ZOOM, MIN_ZOOM
+from .route_versions import UnknownVersion, apply_edit, base_stops, route_itinerary, stops_of
 import traceback
 
+logger = logging.getLogger(__name__)
+
 bp = Blueprint('api', __name__)
 
 
@@ -15,12 +25,26 @@ def geocode():
         coords = get_location_coordinates(places, location, country)
     except Exception as e:
         tb = traceback.format_exc()
-        print(tb)
+        logger.exception("Geocoding failed")
         # In dev it's helpful to return the traceback so the frontend can show it.
         return jsonify({'error': str(e), 'traceback': tb}), 500
     return jsonify(coords)
 
 
+@bp.route('/cache_stats', methods=['GET'])
+def cache_stats_route():
+    """Return hit/miss/eviction counters for this worker's caches."""
+    return jsonify(cache_stats())
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Timings, counters and cache stats of this worker, in Prometheus text format."""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'metrics are disabled (METRICS_ENABLED=0)'}), 404
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 @bp.route('/route_polylines', methods=['POST'])
 def route_polylines():
     """Return route polylines between adjacent itinerary items.
@@ -35,15 +59,42 @@ def route_polylines():
          "walk": { "duration": seconds, "distance": meters, "polyline": [[lat,lng],...] },
          "car": { ... }
       }, ...]
+
+    Without an ORS key, or when ORS fails, legs are estimated offline: a
+    straight-line polyline with ``"estimated": true`` on the leg and segment.
+
+    Options (body field or query parameter):
+      format=encoded  polylines are encoded polyline strings (precision 5)
+      zoom=<0-22>     drop points that are invisible at this map zoom
+
+    Incremental mode, for edited itineraries, is used when the body has
+    ``incremental: true``, a ``base_version`` or an ``edit``:
+      { "base_version": "<id>", "itinerary": [...] }   the new stop list
+      { "base_version": "<id>", "edit": {"op": "move", "from": 2, "to": 4} }
+    Only adjacent pairs that ``base_version`` didn't have are routed (see
+    ``app/route_versions.py`` for the edit ops). Response:
+      { "version": "<id>", "segments": [...], "routed": n, "reused": m }
+    An edit against an expired or unknown ``base_version`` is answered with
+    409; the client then sends the full itinerary instead.
     """
     data = request.get_json() or {}
+    encoded = (data.get('format') or request.args.get('format')) == 'encoded'
+    zoom = data.get('zoom', request.args.get('zoom'))
+    try:
+        zoom = float(zoom) if zoom is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'zoom must be a number'}), 400
+    if zoom is not None and not (math.isfinite(zoom) and MIN_ZOOM <= zoom <= MAX_ZOOM):
+        return jsonify({'error': f'zoom must be between {MIN_ZOOM} and {MAX_ZOOM}'}), 400
+    if data.get('incremental') or 'base_version' in data or 'edit' in data:
+        return _route_incremental(data, encoded, zoom)
     pairs = []
     try:
         if 'pairs' in data and isinstance(data.get('pairs'), list):
             for p in data.get('pairs'):
-                s = p.get('start') or {}
-                e = p.get('end') or {}
-                pairs.append((s, e))
+                # malformed pairs only fail their own segment (see route_segments)
+                p = p if isinstance(p, dict) else {}
+                pairs.append((p.get('start') or {}, p.get('end') or {}))
         elif 'itinerary' in data and isinstance(data.get('itinerary'), list):
             itin = data.get('itinerary')
             # build adjacent pairs
@@ -62,29 +113,60 @@ def route_polylines():
         else:
             return jsonify({'error': 'Invalid payload, need "itinerary" or "pairs"'}), 400
 
+        # all walk/car legs are fetched concurrently, adjacent pairs batched
+        legs_per_pair = route_segments(pairs, ors_api_key(), estimate=ROUTE_ESTIMATE_FALLBACK)
         results = []
-        for idx, (s, e) in enumerate(pairs):
-            try:
-                # start_time not used for now; pass None or 0
-                time_walk, time_car, dist_walk, dist_car, poly_walk, poly_car = find_path_and_time(s, e, None)
-                seg = {"start_index": idx, "end_index": idx+1}
-                if poly_walk:
-                    # poly_walk is expected as list of [lat,lng]
-                    seg['walk'] = {"duration": time_walk, "distance": dist_walk, "polyline": poly_walk}
-                else:
-                    seg['walk'] = None
-                if poly_car:
-                    seg['car'] = {"duration": time_car, "distance": dist_car, "polyline": poly_car}
-                else:
-                    seg['car'] = None
-            except Exception as e:
-                tb = traceback.format_exc()
-                print(tb)
-                seg = {"start_index": idx, "end_index": idx+1, "error": str(e)}
-            results.append(seg)
+        for idx, legs in enumerate(legs_per_pair):
+            errors = [leg for leg in legs.values() if isinstance(leg, Exception)]
+            if errors:
+                logger.error("Routing segment %d failed", idx, exc_info=errors[0])
+            results.append(segment_payload(idx, idx+1, legs, encoded, zoom))
+    except Exception as e:
+        tb = traceback.format_exc()
+        logger.exception("Routing failed")
+        return jsonify({'error': str(e), 'traceback': tb}), 500
+
+    with span("serialize"):
+        return _degraded_no_cache(jsonify(results), results)
+
+
+def _degraded_no_cache(response, segments):
+    """Estimated or failed segments must be revalidated, not cached for a day."""
+    if any(seg.get('estimated') or seg.get('error') for seg in segments):
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _route_incremental(data, encoded, zoom):
+    base_version = data.get('base_version')
+    try:
+        if 'edit' in data:
+            stops = apply_edit(base_stops(base_version), data['edit'])
+        elif isinstance(data.get('itinerary'), list):
+            stops = stops_of(data['itinerary'])
+        else:
+            return jsonify({'error': 'Invalid payload, need "itinerary" or "edit"'}), 400
+    except UnknownVersion:
+        return jsonify({'error': 'Unknown base_version, send the full itinerary',
+                        'base_version': base_version}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        version, legs_per_pair, counts = route_itinerary(
+            stops, base_version, ors_api_key(), estimate=ROUTE_ESTIMATE_FALLBACK)
+        segments = []
+        for idx, legs in enumerate(legs_per_pair):
+            if legs is None:
+                continue
+            errors = [leg for leg in legs.values() if isinstance(leg, Exception)]
+            if errors:
+                logger.error("Routing segment %d failed", idx, exc_info=errors[0])
+            segments.append(segment_payload(idx, idx+1, legs, encoded, zoom))
     except Exception as e:
         tb = traceback.format_exc()
-        print(tb)
+        logger.exception("Routing failed")
         return jsonify({'error': str(e), 'traceback': tb}), 500
 
-    return jsonify(results)
+    with span("serialize"):
+        return _degraded_no_cache(jsonify({'version': version, 'segments': segments, **counts}), segments)
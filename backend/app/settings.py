@@ -0,0 +1,155 @@
+"""Settings and provider clients, initialized once per worker.
+
+``.env`` is read a single time when settings are first requested, instead of
+on every request or routed segment. Clients that hold sockets or gRPC
+channels (the Gemini model, the HTTP provider sessions) are created lazily
+once per process, so they are never shared across a gunicorn fork.
+"""
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+@dataclass(frozen=True)
+class Settings:
+    gemini_api_key: str | None
+    gemini_model: str
+    ors_api_key: str | None
+    frontend_url: str | None
+
+
+_settings = None
+_lock = threading.Lock()
+
+
+def get_settings():
+    """Load ``.env`` (backend/.env first, then the working directory) once."""
+    global _settings
+    if _settings is None:
+        with _lock:
+            if _settings is None:
+                load_dotenv(dotenv_path=BASE_DIR / ".env")
+                load_dotenv()
+                _settings = Settings(
+                    gemini_api_key=os.getenv("GEMINI_API_KEY"),
+                    # model can be overridden in env; default is kept
+                    gemini_model=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
+                    ors_api_key=os.getenv("ORS_API_KEY"),
+                    frontend_url=os.getenv("FRONTEND_URL"),
+                )
+    return _settings
+
+
+_gemini = {"pid": None, "model": None}
+
+
+def get_gemini_model():
+    """Return this process's configured ``GenerativeModel``.
+
+    Raises:
+        RuntimeError: if google.generativeai is not installed.
+    """
+    pid = os.getpid()
+    if _gemini["model"] is None or _gemini["pid"] != pid:
+        # before taking _lock: get_settings() takes it too, and it isn't reentrant
+        settings = get_settings()
+        with _lock:
+            if _gemini["model"] is None or _gemini["pid"] != pid:
+                try:
+                    import google.generativeai as genai
+                except ImportError as e:
+                    raise RuntimeError("google.generativeai not installed") from e
+                if settings.gemini_api_key:
+                    genai.configure(api_key=settings.gemini_api_key)
+                _gemini["model"] = genai.GenerativeModel(model_name=settings.gemini_model)
+                _gemini["pid"] = pid
+    return _gemini["model"]
+
+
+def gemini_client():
+    """This process's model, or None if no API key is set or it can't be built."""
+    if not get_settings().gemini_api_key:
+        return None
+    try:
+        return get_gemini_model()
+    except Exception as e:
+        logger.warning("Gemini client unavailable: %s", e)
+        return None
+
+
+# Caches whose recent entries are loaded into memory before forking
+PRELOAD_CACHES = ("geocode", "city_focus", "route")
+_preloaded = False
+
+
+def preload():
+    """Load shared, read-mostly state; safe to run before gunicorn forks.
+
+    Imports the heavy SDKs and fills the in-memory cache tiers, spatial
+    index, estimator calibration and optimizer tables. Run in the master
+    (``preload_app``), this happens once and the pages are shared by every
+    worker. Nothing that holds a socket or channel is created here.
+    """
+    global _preloaded
+    if _preloaded:
+        return
+    from .cache import registry
+    from .estimator import profile_factors
+    from .spatial import ensure_places_loaded
+    from .time_optimizer import _move_templates_for
+
+    try:
+        import google.generativeai  # noqa: F401  (module import only, no client)
+    except ImportError:
+        pass
+    for name in PRELOAD_CACHES:
+        if name in registry:
+            registry[name].preload()
+    try:
+        ensure_places_loaded()
+    except Exception:
+        logger.exception("Preload: spatial index load failed")
+    try:
+        # fits travel-time factors from cached routes
+        profile_factors("foot-walking")
+    except Exception:
+        logger.exception("Preload: estimator calibration failed")
+    # optimizer move tables for typical itinerary sizes
+    for n in range(2, 11):
+        _move_templates_for(n)
+    _preloaded = True
+
+
+def warm_up(app=None):
+    """Build per-worker clients ahead of the first request.
+
+    Safe to call more than once; call it after a gunicorn fork (see
+    ``gunicorn.conf.py``) or from ``create_app`` so the first request
+    doesn't pay for client setup. Runs ``preload`` first if it hasn't been.
+
+    Args:
+        app (Flask | None): App whose ``GEMINI_CLIENT`` is set to this
+            process's model
+    """
+    from .cache import get_store
+    from .providers import get_client
+
+    preload()
+    get_settings()
+    for name in ("ors", "nominatim"):
+        get_client(name).session
+    try:
+        get_store().connection()
+    except Exception:
+        logger.exception("Warm-up: cache store unavailable")
+    client = gemini_client()
+    if app is not None:
+        app.config["GEMINI_CLIENT"] = client
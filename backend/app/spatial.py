@@ -0,0 +1,230 @@
+"""Spatial index over resolved places
+
+Keeps every geocoded place of this worker in geohash buckets (plus a
+by-name index), built from the shared geocode cache and updated as new
+places resolve. It answers:
+
+- radius queries ("what do we already know within 30 m of here"), used to
+  snap near-duplicate geocodes onto one canonical point so they share route
+  cache entries;
+- name-near-focus lookups, so a place already resolved for the same city
+  under a different cache key (other country spelling, legacy key) is
+  answered without an upstream call;
+- vectorized distance filtering of candidate features (``closest_within``).
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .cache import get_store
+from .estimator import haversine_m
+
+logger = logging.getLogger(__name__)
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+# precision 6 cells are about 1.2 km x 0.6 km
+GEOHASH_PRECISION = 6
+# radius queries touching more cells than this scan all points instead
+MAX_QUERY_CELLS = 64
+# places kept per worker; past it the least recently added are dropped
+SPATIAL_MAX_PLACES = int(os.getenv("SPATIAL_MAX_PLACES", "50000"))
+# reload from the shared store this often to pick up other workers' places
+SPATIAL_RELOAD_S = float(os.getenv("SPATIAL_RELOAD_S", "600"))
+
+
+def geohash(lat, lng, precision=GEOHASH_PRECISION):
+    """Standard base32 geohash of a point."""
+    lat_lo, lat_hi, lng_lo, lng_hi = -90.0, 90.0, -180.0, 180.0
+    chars = []
+    bits = ch = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                ch = ch * 2 + 1
+                lng_lo = mid
+            else:
+                ch *= 2
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = ch * 2 + 1
+                lat_lo = mid
+            else:
+                ch *= 2
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[ch])
+            bits = ch = 0
+    return "".join(chars)
+
+
+def _cell_size(precision=GEOHASH_PRECISION):
+    """(height, width) of a geohash cell in degrees."""
+    total = 5 * precision
+    return 180.0 / 2 ** (total // 2), 360.0 / 2 ** (total - total // 2)
+
+
+def closest_within(lats, lngs, focus_lat, focus_lng, max_m=None):
+    """Index of the candidate closest to the focus, or None.
+
+    Args:
+        lats, lngs (Sequence[float]): Candidate coordinates
+        focus_lat, focus_lng (float): Reference point
+        max_m (float | None): Candidates farther than this are ignored
+
+    Returns:
+        tuple[int, float] | None: (index, distance in meters)
+    """
+    if len(lats) == 0:
+        return None
+    dists = haversine_m(focus_lat, focus_lng, lats, lngs)
+    idx = int(np.argmin(dists))
+    if max_m is not None and dists[idx] > max_m:
+        return None
+    return idx, float(dists[idx])
+
+
+class SpatialIndex:
+    """Geohash-bucketed points with an optional name per point.
+
+    Holds at most ``max_places`` points; adding one more evicts the point
+    added (or re-added) longest ago.
+    """
+
+    def __init__(self, precision=GEOHASH_PRECISION, max_places=SPATIAL_MAX_PLACES):
+        self.precision = precision
+        self.max_places = max(1, max_places)
+        self._lock = threading.Lock()
+        self._points = OrderedDict()    # key -> (lat, lng, name), oldest first
+        self._buckets = {}   # geohash -> set(key)
+        self._names = {}     # name -> set(key)
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._points)
+
+    def add(self, key, lat, lng, name=None):
+        lat, lng = float(lat), float(lng)
+        with self._lock:
+            self._discard(key)
+            while len(self._points) >= self.max_places:
+                self._discard(next(iter(self._points)))
+                self.evicted += 1
+            self._points[key] = (lat, lng, name)
+            self._buckets.setdefault(geohash(lat, lng, self.precision), set()).add(key)
+            if name:
+                self._names.setdefault(name, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._points.clear()
+            self._buckets.clear()
+            self._names.clear()
+
+    def _discard(self, key):
+        old = self._points.pop(key, None)
+        if old is None:
+            return
+        lat, lng, name = old
+        _discard_from(self._buckets, geohash(lat, lng, self.precision), key)
+        if name:
+            _discard_from(self._names, name, key)
+
+    def _candidates(self, lat, lng, radius_m):
+        height, width = _cell_size(self.precision)
+        dlat = radius_m / 111320.0
+        dlng = radius_m / (111320.0 * max(math.cos(math.radians(lat)), 1e-6))
+        rows = int(2 * dlat / height) + 2
+        cols = int(2 * dlng / width) + 2
+        if rows * cols > MAX_QUERY_CELLS:
+            return list(self._points)
+        keys = []
+        for r in range(rows):
+            cell_lat = min(90.0, lat - dlat + r * height)
+            for c in range(cols):
+                cell = geohash(cell_lat, lng - dlng + c * width, self.precision)
+                keys.extend(self._buckets.get(cell, ()))
+        return keys
+
+    def _within(self, keys, lat, lng, radius_m):
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return []
+        coords = np.array([self._points[k][:2] for k in keys], dtype=float)
+        dists = haversine_m(lat, lng, coords[:, 0], coords[:, 1])
+        order = np.argsort(dists)
+        return [(keys[i], float(dists[i])) for i in order if dists[i] <= radius_m]
+
+    def query_radius(self, lat, lng, radius_m):
+        """[(key, distance_m), ...] within ``radius_m``, nearest first."""
+        with self._lock:
+            return self._within(self._candidates(lat, lng, radius_m), lat, lng, radius_m)
+
+    def nearest_named(self, name, lat, lng, radius_m):
+        """Closest point called ``name`` within ``radius_m``: (key, lat, lng) or None."""
+        with self._lock:
+            found = self._within(self._names.get(name, ()), lat, lng, radius_m)
+            if not found:
+                return None
+            key = found[0][0]
+            return key, self._points[key][0], self._points[key][1]
+
+    def point(self, key):
+        """(lat, lng) of ``key`` or None."""
+        entry = self._points.get(key)
+        return entry[:2] if entry else None
+
+
+def _discard_from(index, group, key):
+    # empty groups are dropped, or evictions would leave them behind forever
+    keys = index.get(group)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del index[group]
+
+
+place_index = SpatialIndex()
+_loaded_at = 0.0
+_load_lock = threading.Lock()
+
+
+def place_name_of(cache_key):
+    """The normalized place name part of a geocode cache key."""
+    return cache_key.split("|", 1)[0]
+
+
+def ensure_places_loaded(store=None):
+    """(Re)build ``place_index`` from the shared geocode cache when stale."""
+    global _loaded_at
+    if time.time() - _loaded_at < SPATIAL_RELOAD_S:
+        return place_index
+    with _load_lock:
+        if time.time() - _loaded_at < SPATIAL_RELOAD_S:
+            return place_index
+        try:
+            rows = (store or get_store()).scan("geocode", limit=SPATIAL_MAX_PLACES)
+        except sqlite3.Error:
+            logger.exception("Could not load cached places into the spatial index")
+            rows = []
+        # oldest first, so the most recent places are the last to be evicted
+        for key, value in reversed(rows):
+            if isinstance(value, dict) and value.get('lat') is not None and value.get('lng') is not None:
+                place_index.add(key, value['lat'], value['lng'], place_name_of(key))
+        _loaded_at = time.time()
+    return place_index
@@ -1,22 +1,279 @@
-"""Time optimizer placeholder
+"""Time optimizer
 
-Contains functions that would reorder or optimize an itinerary based on
-distance, opening hours, and user constraints.
+Reorders an itinerary to minimize total travel time while respecting each
+item's time window.
+
+The solver works on a pairwise travel-time matrix (routing cache when a leg
+has been routed before, otherwise the offline estimate from
+``app.estimator``). It builds a start
+with nearest-neighbour construction, keeps the better of that and the
+original order, and improves it with 2-opt and Or-opt moves. All candidate
+moves of a pass are scored at once with NumPy.
+
+Time windows are soft: the model's ``time`` slot is treated as "start around
+here", with ``TIME_WINDOW_SLACK_MIN`` minutes of slack before lateness is
+penalized. This lets nearby-in-time stops swap while keeping e.g. lunch at
+lunchtime.
 """
+import os
+import time
+
+import numpy as np
+
+from . import estimator
+from .map_service import route_cache, route_key
+from .metrics import timed
+
+TIME_WINDOW_SLACK_MIN = float(os.getenv("TIME_WINDOW_SLACK_MIN", "60"))
+# seconds of cost per second of lateness beyond the slack
+LATENESS_PENALTY = 10.0
+DEFAULT_VISIT_MIN = 60
+
+
+def _parse_hhmm(value):
+    try:
+        hours, minutes = str(value).strip().split(":")[:2]
+        return int(hours) * 60 + int(minutes)
+    except (ValueError, AttributeError):
+        return None
+
+
+# Last minute of the day; later times are clamped to it, not wrapped
+LAST_MINUTE = 24 * 60 - 1
+
+
+def _format_hhmm(minutes):
+    minutes = min(LAST_MINUTE, max(0, int(round(minutes))))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_window(item):
+    """Return (start_min, end_min) for an item's time slot, or None.
+
+    Accepts the generator's ``time: ["10:30", "11:30"]`` as well as the
+    fallback itinerary's ``start_time``/``end_time``.
+    """
+    slot = item.get('time')
+    if isinstance(slot, (list, tuple)) and len(slot) >= 2:
+        start, end = _parse_hhmm(slot[0]), _parse_hhmm(slot[1])
+    else:
+        start, end = _parse_hhmm(item.get('start_time')), _parse_hhmm(item.get('end_time'))
+    if start is None:
+        return None
+    if end is None or end < start:
+        end = start + DEFAULT_VISIT_MIN
+    return start, end
+
+
+def travel_time_matrix(points, profile="foot-walking", use_route_cache=True):
+    """Pairwise travel times in seconds between ``points`` ({'lat', 'lng'}).
+
+    Legs found in the routing cache use their real duration; the rest use the
+    calibrated haversine estimate. The cache is read in one batch, and
+    polylines are not decoded.
+    """
+    matrix = estimator.travel_time_matrix(points, profile)
+    if use_route_cache:
+        n = len(points)
+        keys = {(i, j): route_key(profile, points[i], points[j])
+                for i in range(n) for j in range(n) if i != j}
+        entries = route_cache.get_many(keys.values())
+        for (i, j), key in keys.items():
+            entry = entries.get(key)
+            if entry and entry.get('duration') is not None:
+                matrix[i, j] = entry['duration']
+    return matrix
+
+
+class _Problem:
+    """Scores many visiting orders at once over a fixed matrix and windows."""
+
+    def __init__(self, matrix, opens, durations):
+        self.matrix = matrix
+        self.opens = opens          # window start, seconds since midnight
+        self.durations = durations  # visit length, seconds
+        self.slack = TIME_WINDOW_SLACK_MIN * 60
+        self.day_start = float(np.min(opens))
+
+    def costs(self, orders):
+        """Return (total cost, travel seconds) for each row of ``orders``."""
+        orders = np.atleast_2d(orders)
+        legs = self.matrix[orders[:, :-1], orders[:, 1:]]
+        travel = legs.sum(axis=1)
+        clock = np.full(orders.shape[0], self.day_start)
+        lateness = np.zeros(orders.shape[0])
+        for pos in range(orders.shape[1]):
+            stop = orders[:, pos]
+            if pos:
+                clock = clock + legs[:, pos - 1]
+            opens = self.opens[stop]
+            # arriving early means waiting until the slot (minus slack) opens
+            clock = np.maximum(clock, opens - self.slack)
+            lateness += np.maximum(0.0, clock - (opens + self.slack))
+            clock = clock + self.durations[stop]
+        return travel + LATENESS_PENALTY * lateness, travel
+
+    def schedule(self, order):
+        """Visit start times (seconds since midnight) for one order."""
+        clock = self.day_start
+        starts = []
+        for pos, stop in enumerate(order):
+            if pos:
+                clock += self.matrix[order[pos - 1], stop]
+            clock = max(clock, self.opens[stop] - self.slack)
+            starts.append(clock)
+            clock += self.durations[stop]
+        return starts
+
+    def nearest_neighbour(self):
+        n = len(self.opens)
+        current = int(np.argmin(self.opens))
+        order = [current]
+        unvisited = set(range(n)) - {current}
+        clock = self.opens[current] + self.durations[current]
+        while unvisited:
+            cand = np.fromiter(unvisited, dtype=int)
+            arrive = np.maximum(clock + self.matrix[current, cand], self.opens[cand] - self.slack)
+            late = np.maximum(0.0, arrive - (self.opens[cand] + self.slack))
+            step = self.matrix[current, cand] + LATENESS_PENALTY * late
+            current = int(cand[np.argmin(step)])
+            clock = max(clock + self.matrix[order[-1], current],
+                        self.opens[current] - self.slack) + self.durations[current]
+            order.append(current)
+            unvisited.discard(current)
+        return np.array(order)
+
+
+_move_templates = {}
+
+
+def _move_templates_for(n, max_segment=3):
+    """Index permutations for every 2-opt and Or-opt move on ``n`` stops.
+
+    Row ``m`` applied as ``order[templates[m]]`` yields the order after move
+    ``m``, so a whole neighbourhood is generated with one fancy-index.
+    """
+    templates = _move_templates.get(n)
+    if templates is not None:
+        return templates
+    base = np.arange(n)
+    rows = []
+    # 2-opt: reverse base[i..k]
+    for i in range(n - 1):
+        for k in range(i + 1, n):
+            row = base.copy()
+            row[i:k + 1] = base[i:k + 1][::-1]
+            rows.append(row)
+    # Or-opt: move a segment of up to max_segment stops elsewhere
+    for length in range(1, min(max_segment, n - 1) + 1):
+        for i in range(n - length + 1):
+            segment = base[i:i + length]
+            rest = np.concatenate([base[:i], base[i + length:]])
+            for j in range(len(rest) + 1):
+                if j != i:
+                    rows.append(np.concatenate([rest[:j], segment, rest[j:]]))
+    templates = _move_templates[n] = np.unique(np.stack(rows), axis=0)
+    return templates
+
+
+def _improve(problem, order, max_passes=100):
+    """Best-improvement local search over the 2-opt + Or-opt neighbourhood."""
+    templates = _move_templates_for(len(order))
+    best_cost = problem.costs(order)[0][0]
+    for _ in range(max_passes):
+        candidates = order[templates]
+        costs = problem.costs(candidates)[0]
+        idx = int(np.argmin(costs))
+        if costs[idx] >= best_cost - 1e-6:
+            break
+        order, best_cost = candidates[idx], costs[idx]
+    return order
+
+
+@timed("optimize_itinerary")
+def solve_itinerary(itinerary, profile="foot-walking", use_route_cache=True):
+    """Reorder itinerary stops to minimize travel time within their time windows.
+
+    Items without coordinates keep their position; the others are reordered
+    among the remaining slots. If the order changes, each moved item's
+    ``time`` slot is rewritten from the new schedule, keeping its duration.
+    Slots that would run past midnight are clamped to 23:59, the item gets
+    ``overruns_day: true`` and so does the result.
+
+    Args:
+        itinerary (list[dict]): Items with 'coordinates' and optional 'time'
+        profile (str): Routing profile the travel times are estimated for
+
+    Returns:
+        dict: {'itinerary', 'order', 'profile', 'travel_time_before',
+        'travel_time_after', 'overruns_day', 'elapsed_ms'}; travel times
+        are in seconds
+    """
+    started = time.perf_counter()
+    items = list(itinerary or [])
+    slots = [i for i, item in enumerate(items)
+             if isinstance(item, dict) and (item.get('coordinates') or {}).get('lat') is not None
+             and (item.get('coordinates') or {}).get('lng') is not None]
+    result = {"itinerary": items, "order": list(range(len(items))), "profile": profile,
+              "travel_time_before": 0.0, "travel_time_after": 0.0, "overruns_day": False}
+    if len(slots) < 2:
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    stops = [items[i] for i in slots]
+    matrix = travel_time_matrix([s['coordinates'] for s in stops], profile, use_route_cache)
+    windows = [parse_window(s) for s in stops]
+    # stops without a slot are free to go anywhere: give them the latest open
+    latest = max((w[0] for w in windows if w), default=9 * 60)
+    opens = np.array([(w[0] if w else latest) * 60.0 for w in windows])
+    durations = np.array([((w[1] - w[0]) if w else DEFAULT_VISIT_MIN) * 60.0 for w in windows])
+    problem = _Problem(matrix, opens, durations)
+
+    original = np.arange(len(stops))
+    nearest = problem.nearest_neighbour()
+    start_costs = problem.costs(np.stack([original, nearest]))[0]
+    order = original if start_costs[0] <= start_costs[1] else nearest
+    order = _improve(problem, order)
+
+    before = float(problem.costs(original)[1][0])
+    after = float(problem.costs(order)[1][0])
+    result["travel_time_before"] = round(before, 1)
+    result["travel_time_after"] = round(after, 1)
+
+    if not np.array_equal(order, original):
+        reordered = [dict(stops[k]) for k in order]
+        for item, begin, k in zip(reordered, problem.schedule(order), order):
+            if windows[k] is not None:
+                begin_min = begin / 60.0
+                end_min = begin_min + durations[k] / 60.0
+                slot = [_format_hhmm(begin_min), _format_hhmm(end_min)]
+                if end_min > LAST_MINUTE:
+                    item['overruns_day'] = True
+                    result["overruns_day"] = True
+                if 'time' in item:
+                    item['time'] = slot
+                else:
+                    item['start_time'], item['end_time'] = slot
+        out = list(items)
+        for slot, item in zip(slots, reordered):
+            out[slot] = item
+        result["itinerary"] = out
+        full_order = list(range(len(items)))
+        for slot, k in zip(slots, order):
+            full_order[slot] = slots[int(k)]
+        result["order"] = full_order
+
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
 
 def optimize_itinerary(itinerary):
-    """Placeholder optimizer that currently returns the itinerary unchanged.
+    """Return the itinerary reordered by ``solve_itinerary``.
 
     Args:
         itinerary (list[dict]): List of itinerary items
 
     Returns:
         list[dict]: Optimized/ordered itinerary
-
-    TODO:
-        - Implement simple nearest-neighbor ordering
-        - Respect opening/closing hours, durations, user time windows
-        - Integrate travel-time estimates (walking/driving)
     """
-    # No-op for MVP
-    return itinerary
+    return solve_itinerary(itinerary)["itinerary"]
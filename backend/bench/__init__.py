@@ -0,0 +1 @@
+"""Offline benchmark harness for the backend API (see ``python -m bench --help``)."""
@@ -0,0 +1,166 @@
+"""Benchmark the API against local fake providers.
+
+Drives the real Flask app in-process (test client, one per worker thread)
+at increasing concurrency. Gemini, ORS and Nominatim are replaced by the
+fakes in ``bench.fakes``; everything else (caches, single-flight, retries,
+rate limiters, optimizer) is the production code path.
+
+Usage (from ``backend/``):
+    python -m bench --concurrency 1,4,16 --requests 64 --latency-ms 50
+    python -m bench --endpoints geocode --error-rate 0.05 --json
+
+Each run uses a fresh cache database unless ``--cache-db`` is given, and
+every request uses distinct inputs unless ``--repeat-inputs`` is set, so by
+default nothing is served from a previous request's cache.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ENDPOINTS = ("generate_itinerary", "geocode", "route_polylines")
+# Admission control refusals (busy pool, model quota); counted apart from errors
+REJECTED_STATUSES = (429, 503)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        help="comma-separated subset of " + ", ".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated levels")
+    parser.add_argument("--requests", type=int, default=48, help="requests per level")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="mean upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of failing upstream calls")
+    parser.add_argument("--gemini-latency-ms", type=float, default=None,
+                        help="time to first Gemini chunk (default: --latency-ms x 4)")
+    parser.add_argument("--places", type=int, default=6, help="places per generated itinerary")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat-inputs", action="store_true",
+                        help="reuse the same inputs for every request (measures cache hits)")
+    parser.add_argument("--cache-db", help="cache database to use instead of a fresh temporary one")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args(argv)
+
+
+def _configure_env(args, tmpdir, max_concurrency):
+    # must happen before the app modules read their configuration
+    os.environ["CACHE_DB_PATH"] = args.cache_db or os.path.join(tmpdir, "bench.sqlite3")
+    os.environ.setdefault("ORS_API_KEY", "bench")
+    # measure the code, not the production rate limits
+    os.environ.setdefault("ORS_RATE_LIMIT", "100000")
+    os.environ.setdefault("ORS_RATE_BURST", "100000")
+    os.environ.setdefault("NOMINATIM_RATE_LIMIT", "100000")
+    os.environ.setdefault("ITINERARY_CACHE_STALE", "0")
+    # nor a worker's admission limits: every bench thread gets a slot
+    for name in ("ITINERARY_MAX_CONCURRENCY", "LLM_MAX_CONCURRENCY", "LLM_MAX_QUEUE"):
+        os.environ.setdefault(name, str(max_concurrency))
+
+
+def _install_fakes(args):
+    from app.providers import get_client
+    from app.settings import _gemini
+
+    from .fakes import Behaviour, FakeGeminiModel, FakeProviderAdapter
+
+    adapter = FakeProviderAdapter(Behaviour(args.latency_ms, args.jitter_ms, args.error_rate, args.seed))
+    for name in ("ors", "nominatim"):
+        get_client(name).session.mount("https://", adapter)
+    gemini_latency = args.gemini_latency_ms if args.gemini_latency_ms is not None else args.latency_ms * 4
+    model = FakeGeminiModel(Behaviour(gemini_latency, args.jitter_ms, args.error_rate, args.seed + 1),
+                            places=args.places)
+    _gemini.update(model=model, pid=os.getpid())
+    return adapter, model
+
+
+def _payload(endpoint, n):
+    """Request body for the n-th request of an endpoint."""
+    from .fakes import fake_point
+
+    if endpoint == "generate_itinerary":
+        return {"destination": f"Bench City {n}", "month": "May", "preferences": ["museum"]}
+    if endpoint == "geocode":
+        return {"places": [f"Bench Place {n}-{i}" for i in range(6)], "location": f"Bench City {n}"}
+    itinerary = [{"coordinates": dict(zip(("lat", "lng"), fake_point(f"stop {n}-{i}")))} for i in range(6)]
+    return {"itinerary": itinerary, "format": "encoded"}
+
+
+def _percentile(values, q):
+    import numpy as np
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def _run_level(app, endpoint, concurrency, total, offset, repeat):
+    local = threading.local()
+
+    def _one(n):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        body = _payload(endpoint, 0 if repeat else offset + n)
+        started = time.perf_counter()
+        response = client.post(f"/api/{endpoint}", json=body)
+        response.get_data()
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        outcomes = list(ex.map(_one, range(total)))
+    wall = time.perf_counter() - started
+    # latency of refused requests says nothing about the endpoint
+    latencies = [t * 1000 for t, status in outcomes if status not in REJECTED_STATUSES]
+    return {
+        "requests": total,
+        "errors": sum(1 for _, status in outcomes if status >= 400 and status not in REJECTED_STATUSES),
+        "rejected": sum(1 for _, status in outcomes if status in REJECTED_STATUSES),
+        "p50_ms": round(_percentile(latencies, 50), 1),
+        "p95_ms": round(_percentile(latencies, 95), 1),
+        "p99_ms": round(_percentile(latencies, 99), 1),
+        "throughput_rps": round(total / wall, 2) if wall else 0.0,
+    }
+
+
+def main(argv=None):
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _configure_env(args, tmpdir, max(levels, default=1))
+        from app import create_app
+
+        app = create_app()
+        adapter, model = _install_fakes(args)
+        results = []
+        offset = 0
+        for endpoint in endpoints:
+            for concurrency in levels:
+                before = dict(adapter.calls), model.calls
+                row = _run_level(app, endpoint, concurrency, args.requests, offset, args.repeat_inputs)
+                offset += args.requests
+                upstream = {k: v - before[0].get(k, 0) for k, v in adapter.calls.items()}
+                upstream["gemini"] = model.calls - before[1]
+                row.update(endpoint=endpoint, concurrency=concurrency,
+                           upstream={k: v for k, v in upstream.items() if v})
+                results.append(row)
+                if not args.json:
+                    calls = " ".join(f"{k}={v}" for k, v in sorted(row["upstream"].items())) or "-"
+                    print(f"{endpoint:<20} c={concurrency:<3} n={row['requests']:<4} err={row['errors']:<3} "
+                          f"rej={row['rejected']:<3} "
+                          f"p50={row['p50_ms']:>8.1f}ms p95={row['p95_ms']:>8.1f}ms "
+                          f"p99={row['p99_ms']:>8.1f}ms {row['throughput_rps']:>7.1f} req/s  upstream: {calls}",
+                          flush=True)
+        if args.json:
+            print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Local stand-ins for Gemini, ORS and Nominatim
+
+The fakes answer with deterministic, well-formed payloads (derived from a
+hash of the request), after a configurable latency, and fail a configurable
+fraction of calls. The HTTP fakes are ``requests`` transport adapters mounted
+on the provider sessions, so the real clients, retries, rate limiters and
+caches all stay in the measured path.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from requests.adapters import BaseAdapter
+from requests.models import Response
+
+from app import polyline
+
+# Fixed city centre the fake geocoder scatters places around
+CENTRE = (48.8566, 2.3522)
+# Points per routed leg, so polylines have a realistic size
+POINTS_PER_LEG = 60
+
+
+def _unit(text, salt=""):
+    """Deterministic float in [0, 1) for ``text``."""
+    digest = hashlib.sha1(f"{salt}|{text}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def fake_point(text):
+    """A stable point within ~5 km of ``CENTRE`` for a place name."""
+    return (CENTRE[0] + (_unit(text, "lat") - 0.5) * 0.09,
+            CENTRE[1] + (_unit(text, "lng") - 0.5) * 0.13)
+
+
+class Behaviour:
+    """Latency and failure model shared by the fakes.
+
+    Args:
+        latency_ms (float): Mean added latency per call.
+        jitter_ms (float): Uniform +/- jitter around the mean.
+        error_rate (float): Fraction of calls that fail (HTTP 503 / exception).
+        seed (int): Seed for the jitter and failure draws.
+    """
+
+    def __init__(self, latency_ms=50.0, jitter_ms=10.0, error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """(delay in seconds, should_fail) for one call."""
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            fail = self._random.random() < self.error_rate
+        return max(0.0, self.latency_ms + jitter) / 1000.0, fail
+
+
+class FakeProviderAdapter(BaseAdapter):
+    """Serves ORS geocode/directions and Nominatim search from memory."""
+
+    def __init__(self, behaviour):
+        super().__init__()
+        self.behaviour = behaviour
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        if url.netloc.startswith("nominatim"):
+            name = "nominatim"
+        elif "/directions/" in url.path:
+            name = "ors_directions"
+        else:
+            name = "ors_geocode"
+        self._count(name)
+        delay, fail = self.behaviour.draw()
+        time.sleep(delay)
+        if fail:
+            return self._response(request, 503, {"error": "fake outage"})
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if name == "nominatim":
+            lat, lng = fake_point(query.get("q", ""))
+            return self._response(request, 200, [{"lat": str(lat), "lon": str(lng)}])
+        if name == "ors_geocode":
+            lat, lng = fake_point(query.get("text", "").split(",")[0])
+            return self._response(request, 200, {"features": [
+                {"geometry": {"coordinates": [lng, lat]}},
+                {"geometry": {"coordinates": [lng + 0.5, lat + 0.5]}},
+            ]})
+        return self._response(request, 200, self._directions(json.loads(request.body)))
+
+    @staticmethod
+    def _directions(body):
+        coords = [(lat, lng) for lng, lat in body["coordinates"]]
+        points, segments, way_points = [], [], [0]
+        for (slat, slng), (elat, elng) in zip(coords, coords[1:]):
+            leg = [[slat + (elat - slat) * t / POINTS_PER_LEG, slng + (elng - slng) * t / POINTS_PER_LEG]
+                   for t in range(POINTS_PER_LEG + 1)]
+            points.extend(leg if not points else leg[1:])
+            way_points.append(len(points) - 1)
+            distance = 1.3 * 111320.0 * ((elat - slat) ** 2 + (elng - slng) ** 2) ** 0.5
+            segments.append({"distance": distance, "duration": distance / 1.3})
+        summary = {"distance": sum(s["distance"] for s in segments),
+                   "duration": sum(s["duration"] for s in segments)}
+        return {"routes": [{"geometry": polyline.encode(points), "summary": summary,
+                            "segments": segments, "way_points": way_points}]}
+
+    @staticmethod
+    def _response(request, status, payload):
+        response = Response()
+        response.status_code = status
+        response.headers["Content-Type"] = "application/json"
+        response.raw = io.BytesIO(json.dumps(payload).encode("utf-8"))
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+    def close(self):
+        pass
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Stands in for ``GenerativeModel``: streams a JSON itinerary.
+
+    Args:
+        behaviour (Behaviour): Time to first chunk and failure rate.
+        places (int): Places per itinerary.
+        chunk_chars (int): Characters per streamed chunk.
+        chunk_ms (float): Delay between streamed chunks.
+    """
+
+    def __init__(self, behaviour, places=6, chunk_chars=80, chunk_ms=5.0):
+        self.behaviour = behaviour
+        self.places = places
+        self.chunk_chars = chunk_chars
+        self.chunk_ms = chunk_ms
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _text(self, prompt):
+        # the destination is the only part of the prompt that varies per request
+        seed = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:6]
+        places = []
+        for i in range(self.places):
+            start = 9 * 60 + i * 90
+            places.append({
+                "name": f"Place {seed}-{i}",
+                "time": [f"{start // 60:02d}:{start % 60:02d}", f"{(start + 60) // 60:02d}:{(start + 60) % 60:02d}"],
+                "category": "museum", "price": "$", "description": "A stop on the benchmark tour.",
+            })
+        return json.dumps({"places": places})
+
+    def _begin(self):
+        with self._lock:
+            self.calls += 1
+        return self.behaviour.draw()
+
+    def generate_content(self, prompt, **kwargs):
+        delay, fail = self._begin()
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("fake Gemini outage")
+        return _Chunk(self._text(prompt))
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        delay, fail = self._begin()
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError("fake Gemini outage")
+        text = self._text(prompt)
+        if not stream:
+            return _Chunk(text)
+        return self._stream(text)
+
+    async def _stream(self, text):
+        for i in range(0, len(text), self.chunk_chars):
+            if i:
+                await asyncio.sleep(self.chunk_ms / 1000.0)
+            yield _Chunk(text[i:i + self.chunk_chars])
@@ -0,0 +1,30 @@
+"""Gunicorn configuration (used by render.yaml).
+
+The app is loaded once in the master (``preload_app``) with
+``create_app(warm='preload')``: SDK imports and cache tiers are built there
+and shared copy-on-write by the workers. Each worker then builds its own
+sockets and clients in ``post_fork``.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+# gthread workers let one process hold several in-flight (mostly I/O-bound)
+# itinerary requests instead of blocking a whole worker per request
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = True
+wsgi_app = "app:create_app(warm='preload')"
+
+
+def when_ready(server):
+    # keep the preloaded objects out of the collector so that collections in
+    # the workers don't touch (and un-share) their pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app.settings import warm_up
+    # the preloaded app; this worker's Gemini client goes into its config
+    warm_up(server.app.wsgi())
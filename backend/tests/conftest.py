@@ -0,0 +1,9 @@
+"""Shared setup: keep the cache store out of the working tree."""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# must be set before app.cache opens its store
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="itinerary-tests-"), "cache.sqlite3"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
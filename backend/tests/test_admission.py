@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app import admission
+from app.admission import ConcurrencyPool, QuotaExceeded, Saturated, is_quota_error
+
+
+class Quota(Exception):
+    code = 429
+
+
+def test_full_pool_without_queue_rejects_at_once():
+    pool = ConcurrencyPool("p", limit=1)
+    pool.acquire()
+    with pytest.raises(Saturated) as info:
+        pool.acquire()
+    assert info.value.status == 503
+    assert info.value.retry_after_header == "1"
+    assert pool.stats()["rejected"] == 1
+    pool.release()
+    pool.acquire()
+
+
+def test_full_queue_rejects_while_queued_caller_waits():
+    pool = ConcurrencyPool("p", limit=1, max_queue=1, timeout=5.0)
+    pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: (pool.acquire(), got.append(True)))
+    waiter.start()
+    while pool.stats()["waiting"] == 0:
+        time.sleep(0.001)
+    with pytest.raises(Saturated):
+        pool.acquire()
+    pool.release()
+    waiter.join(1.0)
+    assert got == [True]
+    assert pool.stats() == {"limit": 1, "active": 1, "waiting": 0, "max_queue": 1,
+                            "rejected": 1, "timeouts": 0, "blocked_s": 0.0}
+
+
+def test_queued_caller_times_out():
+    pool = ConcurrencyPool("p", limit=1, max_queue=2, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(Saturated):
+        pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+    assert pool.stats()["waiting"] == 0
+
+
+def test_retry_after_grows_with_queue_and_hold_time():
+    pool = ConcurrencyPool("p", limit=2, max_queue=0)
+    pool._hold_s = 3.0
+    pool.waiting = 3
+    assert pool._retry_after() == pytest.approx(6.0)
+
+
+def test_async_acquire_waits_for_release():
+    pool = ConcurrencyPool("p", limit=1, max_queue=1, timeout=1.0)
+
+    async def scenario():
+        await pool.aacquire()
+        second = asyncio.ensure_future(pool.aacquire())
+        await asyncio.sleep(0.02)
+        assert not second.done()
+        pool.release()
+        await asyncio.wait_for(second, 1.0)
+
+    asyncio.run(scenario())
+    assert pool.stats()["active"] == 1
+
+
+def test_blocked_pool_answers_429():
+    pool = ConcurrencyPool("p", limit=4)
+    pool.block(30)
+    with pytest.raises(QuotaExceeded) as info:
+        pool.acquire()
+    assert info.value.status == 429
+    assert 29 <= info.value.retry_after <= 30
+
+
+def test_llm_slot_turns_quota_errors_into_429(monkeypatch):
+    pool = ConcurrencyPool("llm", limit=1)
+    monkeypatch.setattr(admission, "llm_pool", pool)
+    with pytest.raises(QuotaExceeded):
+        with admission.llm_slot():
+            raise Quota("429 Resource has been exhausted")
+    # the slot was released and further calls wait out the cooldown
+    assert pool.stats()["active"] == 0
+    with pytest.raises(QuotaExceeded):
+        pool.acquire()
+
+
+def test_is_quota_error():
+    assert is_quota_error(Quota())
+    assert is_quota_error(type("ResourceExhausted", (Exception,), {})())
+    assert not is_quota_error(ValueError("bad"))
+
+
+@pytest.fixture
+def app(monkeypatch):
+    pool = ConcurrencyPool("itinerary", limit=1)
+    monkeypatch.setattr(admission, "ENDPOINT_POOLS", {"slow": pool})
+    app = Flask(__name__)
+    admission.init_app(app)
+    app.add_url_rule("/slow", "slow", lambda: {"ok": True})
+    app.add_url_rule("/fast", "fast", lambda: {"ok": True})
+    return app, pool
+
+
+def test_endpoint_over_limit_gets_503_with_retry_after(app):
+    app, pool = app
+    client = app.test_client()
+    assert client.get("/slow").status_code == 200
+    assert pool.stats()["active"] == 0
+    pool.acquire()
+    response = client.get("/slow")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.get_json() == {"error": "itinerary is busy, retry later", "retry_after": 1}
+    # unpooled endpoints are never limited
+    assert client.get("/fast").status_code == 200
@@ -0,0 +1,132 @@
+import asyncio
+import itertools
+import json
+import uuid
+from collections import Counter
+
+import pytest
+
+from app import create_app, map_service, pipeline
+from app.admission import Overloaded
+from app.pipeline import run_itinerary_batch
+
+PLACES = ["Louvre Museum", "Pont Neuf", "Jardin du Luxembourg"]
+DOC = json.dumps({"Places": {name: {"time": [f"{9 + 2 * i:02d}:00", f"{10 + 2 * i:02d}:00"]}
+                             for i, name in enumerate(PLACES)}})
+_offset = itertools.count()
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    """Stand-in model and geocoder; returns how often each destination was generated."""
+    calls = Counter()
+    # fresh coordinates per test, so the route cache never answers
+    base = -30.0 + next(_offset) * 0.1
+    coords = {name: {"lat": base + i * 0.01, "lng": 140.0 + i * 0.01} for i, name in enumerate(PLACES)}
+
+    async def model_stream(destination, month, budget, category):
+        calls[destination] += 1
+        if destination.startswith("Busy"):
+            raise Overloaded("no LLM slot free", retry_after=2.0)
+        for i in range(0, len(DOC), 16):
+            await asyncio.sleep(0)
+            yield DOC[i:i + 16]
+
+    def geocode(names, location, country):
+        return {name: coords.get(name) for name in names}
+
+    monkeypatch.setattr(pipeline, "astream_itinerary_text", model_stream)
+    monkeypatch.setattr(pipeline, "get_location_coordinates", geocode)
+    return calls
+
+
+def unique(city):
+    return f"{city}-{uuid.uuid4().hex[:8]}"
+
+
+def params(destination, month="May"):
+    return {"destination": destination, "month": month, "budget": "$$", "category": "culture",
+            "country": None}
+
+
+def test_failing_and_invalid_entries_do_not_fail_the_others(model_calls):
+    paris, busy = unique("Paris"), unique("Busy")
+    batch = [params(paris), ValueError("destination is required"), params(busy)]
+    results = asyncio.run(run_itinerary_batch(batch))
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert [r["ok"] for r in results] == [True, False, False]
+    assert len(results[0]["itinerary"]) == len(PLACES)
+    assert results[1]["error"] == "destination is required"
+    assert results[2]["status"] == 503 and results[2]["retry_after"] == 2
+    # the invalid entry never reached the model
+    assert set(model_calls) == {paris, busy}
+
+
+def test_duplicate_requests_are_generated_once(model_calls):
+    paris, lyon = unique("Paris"), unique("Lyon")
+    # same request up to case and whitespace, plus a different one
+    batch = [params(paris), params(f"  {paris.upper()} "), params(lyon), params(paris)]
+    results = asyncio.run(run_itinerary_batch(batch))
+    assert all(r["ok"] for r in results)
+    assert model_calls == {paris: 1, lyon: 1}
+    assert results[0]["itinerary"] == results[1]["itinerary"] == results[3]["itinerary"]
+    # each entry echoes its own request
+    assert results[1]["destination"] == f"  {paris.upper()} "
+
+
+def test_routes_are_fetched_in_one_shared_pass(model_calls, monkeypatch):
+    directions = []
+
+    def fake_directions(profile, waypoints, api_key):
+        directions.append((profile, len(waypoints)))
+        return [{"duration": 60.0, "distance": 100.0, "polyline": [[w["lat"], w["lng"]] for w in pair]}
+                for pair in zip(waypoints, waypoints[1:])]
+
+    route_calls = []
+    real_route_segments = pipeline.route_segments
+
+    def route_segments(pairs, *args, **kwargs):
+        route_calls.append(len(pairs))
+        return real_route_segments(pairs, *args, **kwargs)
+
+    monkeypatch.setattr(map_service, "_ors_directions", fake_directions)
+    monkeypatch.setattr(pipeline, "route_segments", route_segments)
+    monkeypatch.setattr(pipeline, "ors_api_key", lambda: "key")
+    # two different days visiting the same places
+    batch = [params(unique("Paris"), "May"), params(unique("Paris"), "June")]
+    results = asyncio.run(run_itinerary_batch(batch, include_routes=True))
+
+    assert route_calls == [4]
+    # the two days share their segments: one chained request per profile
+    assert sorted(directions) == [("driving-car", 3), ("foot-walking", 3)]
+    for result in results:
+        assert [(r["start_index"], r["end_index"]) for r in result["routes"]] == [(0, 1), (1, 2)]
+        assert all(r["walk"]["duration"] == 60.0 for r in result["routes"])
+
+
+def test_batch_endpoint(model_calls):
+    client = create_app(warm=False).test_client()
+    paris = unique("Paris")
+    response = client.post("/api/generate_itinerary/batch", json={"requests": [
+        {"destination": paris, "month": "May", "preferences": ["culture"]},
+        {"month": "May"},
+        {"destination": paris, "month": "May", "category": "culture"},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert "destination" in results[1]["error"]
+    assert "routes" not in results[0]
+    assert model_calls == {paris: 1}
+
+
+@pytest.mark.parametrize("body", [{}, {"requests": []}, {"requests": "Paris"}])
+def test_batch_endpoint_rejects_bad_bodies(body):
+    client = create_app(warm=False).test_client()
+    assert client.post("/api/generate_itinerary/batch", json=body).status_code == 400
+
+
+def test_batch_endpoint_caps_the_batch_size():
+    client = create_app(warm=False).test_client()
+    body = {"requests": [{"destination": "Paris"}] * (pipeline.BATCH_MAX_ITEMS + 1)}
+    assert client.post("/api/generate_itinerary/batch", json=body).status_code == 400
@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app import cache
+from app.cache import MISSING, SingleFlight, SqliteStore, TieredCache, TTLCache, normalize_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    state = {"now": 1000.0}
+    monkeypatch.setattr(cache.time, "time", lambda: state["now"])
+    return state
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteStore(str(tmp_path / "cache.sqlite3"))
+
+
+def test_normalize_key():
+    assert normalize_key("  Café   de\tFLORE ") == "café de flore"
+    assert normalize_key(None) == ""
+
+
+def test_ttl_cache_lru_and_expiry(clock):
+    lru = TTLCache(maxsize=2, ttl=10)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1      # a is now the most recent
+    lru.set("c", 3)
+    assert lru.get("b") is MISSING and lru.get("a") == 1
+    clock["now"] += 11
+    assert lru.get("a", "gone") == "gone"
+    assert lru.stats()["evictions"] == 1 and lru.stats()["expirations"] == 1
+
+
+def test_store_round_trip_expiry_and_namespaces(store, clock):
+    store.set("geo", "k", {"lat": 1.5, "lng": None}, ttl=60)
+    store.set("route", "k", [1, 2])
+    assert store.get("geo", "k") == ({"lat": 1.5, "lng": None}, 1060.0)
+    assert store.get("route", "k") == ([1, 2], None)
+    clock["now"] += 61
+    assert store.get("geo", "k") is MISSING
+    assert store.count("route") == 1
+
+
+def test_store_get_many_in_chunks(store, monkeypatch):
+    monkeypatch.setattr(cache, "GET_MANY_CHUNK", 3)
+    store.set_many("ns", [(f"k{i}", i) for i in range(10)])
+    keys = [f"k{i}" for i in range(0, 12, 2)] + ["k0"]
+    found = store.get_many("ns", keys)
+    assert {k: v for k, (v, _) in found.items()} == {"k0": 0, "k2": 2, "k4": 4, "k6": 6, "k8": 8}
+    assert store.get_many("ns", []) == {}
+
+
+def test_store_trim_keeps_most_recent(store, clock):
+    for i in range(5):
+        clock["now"] += 1
+        store.set("ns", f"k{i}", i)
+    store.trim("ns", 2)
+    assert [k for k, _ in store.scan("ns")] == ["k4", "k3"]
+
+
+def test_tiered_cache_shares_through_store(store):
+    writer = TieredCache("test_shared", store=store, ttl=60)
+    reader = TieredCache("test_shared", store=store, ttl=60)   # another worker
+    writer.set("k", {"v": 1})
+    assert reader.get("k") == {"v": 1}
+    assert reader.get("k") == {"v": 1}
+    assert reader.stats()["store_hits"] == 1 and reader.stats()["memory"]["hits"] == 1
+    assert reader.get("missing", "default") == "default"
+
+
+def test_tiered_get_many_reads_misses_once(store, monkeypatch):
+    tiered = TieredCache("test_many", store=store, ttl=60)
+    for i in range(4):
+        tiered.set(f"k{i}", i)
+    tiered.memory.clear()
+    tiered.get("k0")
+    queries = []
+    original = store.get_many
+    monkeypatch.setattr(store, "get_many", lambda ns, keys: queries.append(list(keys)) or original(ns, keys))
+    assert tiered.get_many(["k0", "k1", "k2", "nope", "k1"]) == {"k0": 0, "k1": 1, "k2": 2}
+    assert queries == [["k1", "k2", "nope"]]
+    # now all in memory
+    assert tiered.get_many(["k1", "k2"]) == {"k1": 1, "k2": 2}
+    assert len(queries) == 1
+
+
+def test_tiered_cache_survives_store_errors():
+    class Broken:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise sqlite3.OperationalError("disk I/O error")
+            return fail
+
+    tiered = TieredCache("test_broken", store=Broken(), ttl=60)
+    tiered.set("k", 1)
+    assert tiered.get("k") == 1
+    assert tiered.get("other") is None
+    assert tiered.get_many(["k", "other"]) == {"k": 1}
+    assert tiered.stats()["store_errors"] == 3
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    leader.start()
+    started.wait(2)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", slow))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    deadline = time.monotonic() + 2
+    while flight.coalesced < 3 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader] + followers:
+        t.join(2)
+    assert results == ["result"] * 4 and calls == [1]
@@ -0,0 +1,57 @@
+import pytest
+
+from app import estimator
+from app.cache import SqliteStore
+from app.estimator import calibrate, estimate_leg, haversine_m, haversine_matrix
+
+
+def test_haversine_reference_distance():
+    # Paris (Notre-Dame) to London (Charing Cross): about 343.5 km
+    assert haversine_m(48.8530, 2.3498, 51.5080, -0.1247) == pytest.approx(343_500, rel=0.005)
+    assert haversine_m(10.0, 20.0, 10.0, 20.0) == 0.0
+
+
+def test_haversine_matrix_is_symmetric():
+    matrix = haversine_matrix([0.0, 0.0, 1.0], [0.0, 1.0, 0.0])
+    assert matrix.shape == (3, 3)
+    assert (matrix == matrix.T).all() and (matrix.diagonal() == 0).all()
+    # one degree of longitude on the equator
+    assert matrix[0, 1] == pytest.approx(111_195, rel=1e-3)
+
+
+def test_estimate_leg_uses_profile_factors(monkeypatch):
+    monkeypatch.setattr(estimator, "profile_factors", lambda profile: (2.0, 1.5))
+    leg = estimate_leg("foot-walking", {"lat": 0.0, "lng": 0.0}, {"lat": 0.0, "lng": 0.01})
+    straight = haversine_m(0.0, 0.0, 0.0, 0.01)
+    assert leg["distance"] == pytest.approx(straight * 1.5, abs=0.1)
+    assert leg["duration"] == pytest.approx(straight * 1.5 / 2.0, abs=0.1)
+    assert leg["estimated"] is True and leg["polyline"] == [[0.0, 0.0], [0.0, 0.01]]
+
+
+def test_calibrate_fits_speed_and_detour_from_cached_routes(tmp_path, monkeypatch):
+    monkeypatch.setattr(estimator, "CALIBRATION_MIN_SAMPLES", 5)
+    store = SqliteStore(str(tmp_path / "cache.sqlite3"))
+    for i in range(8):
+        start, end = [45.0 + i * 0.01, 7.0], [45.0 + i * 0.01, 7.02]
+        straight = float(haversine_m(*start, *end))
+        # walked 1.4x the straight line at 1.5 m/s
+        store.set("route", f"foot-walking|{i}", {"start": start, "end": end, "distance": straight * 1.4,
+                                                 "duration": straight * 1.4 / 1.5})
+    # too short to say anything about detours
+    store.set("route", "foot-walking|short", {"start": [45.0, 7.0], "end": [45.0, 7.0001],
+                                              "distance": 500.0, "duration": 10.0})
+    fitted = calibrate(store)
+    assert fitted["foot-walking"] == {"speed": 1.5, "detour": 1.4, "samples": 8}
+    # not enough driving samples: defaults
+    speed, detour = estimator.DEFAULT_PROFILE_SPEEDS["driving-car"]
+    assert fitted["driving-car"] == {"speed": speed, "detour": detour, "samples": 0}
+
+
+def test_calibration_is_clamped(tmp_path, monkeypatch):
+    monkeypatch.setattr(estimator, "CALIBRATION_MIN_SAMPLES", 1)
+    store = SqliteStore(str(tmp_path / "cache.sqlite3"))
+    store.set("route", "foot-walking|x", {"start": [0.0, 0.0], "end": [0.0, 0.01],
+                                          "distance": 100000.0, "duration": 10.0})
+    fitted = calibrate(store)["foot-walking"]
+    assert (fitted["speed"], fitted["detour"]) == (estimator.SPEED_BOUNDS["foot-walking"][1],
+                                                   estimator.DETOUR_BOUNDS[1])
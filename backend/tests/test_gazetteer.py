@@ -0,0 +1,55 @@
+import pytest
+
+from app import gazetteer
+from app.gazetteer import import_file, lookup, normalize_city, normalize_name, score
+
+CSV = """name,lat,lon,city,country,kind
+Musée du Louvre,48.8606,2.3376,"Paris, France",France,museum
+Tour Eiffel,48.8584,2.2945,Paris,France,attraction
+Jardin du Luxembourg,48.8462,2.3372,Paris,France,park
+Louvre Lens,50.4318,2.8045,Lens,France,museum
+Café Central,48.2104,16.3656,Wien,Austria,cafe
+"""
+
+
+@pytest.fixture
+def db(tmp_path):
+    source = tmp_path / "pois.csv"
+    source.write_text(CSV, encoding="utf-8")
+    path = str(tmp_path / "gazetteer.sqlite3")
+    assert import_file(str(source), path) == 5
+    return path
+
+
+def test_normalize():
+    assert normalize_name("  Musée  du LOUVRE! ") == "musee du louvre"
+    assert normalize_city("Paris, Île-de-France, France") == "paris"
+    assert normalize_city(None) == ""
+
+
+def test_score_ignores_place_type_words():
+    assert score("louvre museum", "musee du louvre") >= 0.9
+    assert score("eifel tower", "tour eiffel") >= 0.85
+    assert score("louvre museum", "jardin du luxembourg") < 0.5
+
+
+@pytest.mark.parametrize("place, city, expected", [
+    ("Louvre Museum", "Paris", (48.8606, 2.3376)),
+    ("Louvre Museum", "Paris, France", (48.8606, 2.3376)),
+    ("Louvre Museum, Paris", "Paris, France", (48.8606, 2.3376)),
+    ("The Eiffel Tower", "paris", (48.8584, 2.2945)),
+    ("Louvre-Lens Museum", "Lens, France", (50.4318, 2.8045)),
+])
+def test_lookup(db, place, city, expected):
+    assert lookup(place, city, path=db) == {"lat": expected[0], "lng": expected[1]}
+
+
+def test_lookup_skips_other_cities_and_weak_matches(db):
+    assert lookup("Café Central", "Paris, France", path=db) is None
+    assert lookup("Notre-Dame", "Paris", path=db) is None
+
+
+def test_lookup_without_gazetteer(tmp_path, monkeypatch):
+    monkeypatch.setattr(gazetteer, "GAZETTEER_PATH", None)
+    assert lookup("Louvre", "Paris") is None
+    assert lookup("Louvre", "Paris", path=str(tmp_path / "missing.sqlite3")) is None
@@ -0,0 +1,125 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask, jsonify
+
+from app import http_cache
+from app.http_cache import _choose_encoding, _etag_matches, etag_for
+
+BIG = {"points": [[48.8566 + i * 1e-4, 2.3522] for i in range(200)]}
+
+
+def test_etag_is_weak_and_content_based():
+    assert etag_for(b"abc") == etag_for(b"abc") != etag_for(b"abd")
+    assert etag_for(b"abc").startswith('W/"') and etag_for(b"abc").endswith('"')
+
+
+def test_etag_matching():
+    etag = etag_for(b"body")
+    strong = etag[2:]
+    assert _etag_matches(etag, etag)
+    assert _etag_matches(strong, etag)
+    assert _etag_matches(f'W/"other", {strong}', etag)
+    assert not _etag_matches('W/"other"', etag)
+    assert not _etag_matches(None, etag)
+    assert _etag_matches("*", etag)
+    assert not _etag_matches("*", etag, allow_any=False)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0, identity", None),
+    ("GZIP;q=0.5", "gzip"),
+    ("", None),
+    (None, None),
+])
+def test_choose_encoding_gzip(monkeypatch, header, expected):
+    monkeypatch.setattr(http_cache, "brotli", None)
+    assert _choose_encoding(header) == expected
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(http_cache, "CACHE_CONTROL", {"cached": "private, max-age=86400"})
+    app = Flask(__name__)
+    http_cache.init_app(app)
+
+    @app.route("/cached", methods=["GET", "POST"])
+    def cached():
+        return jsonify(BIG)
+
+    @app.route("/degraded")
+    def degraded():
+        response = jsonify({"estimated": True})
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    @app.route("/failing")
+    def failing():
+        return jsonify({"error": "upstream down"}), 502
+
+    @app.route("/stream")
+    def stream():
+        return app.response_class((line for line in ["a\n", "b\n"]), mimetype="application/x-ndjson")
+
+    return app.test_client()
+
+
+def test_200_gets_etag_and_endpoint_policy(client):
+    response = client.get("/cached")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, max-age=86400"
+    assert response.headers["ETag"] == etag_for(response.get_data())
+
+
+def test_matching_if_none_match_gives_empty_304(client):
+    etag = client.get("/cached").headers["ETag"]
+    response = client.post("/cached", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.headers["ETag"] == etag
+    assert client.get("/cached", headers={"If-None-Match": 'W/"stale"'}).status_code == 200
+
+
+def test_wildcard_only_revalidates_safe_methods(client):
+    assert client.get("/cached", headers={"If-None-Match": "*"}).status_code == 304
+    assert client.post("/cached", headers={"If-None-Match": "*"}).status_code == 200
+
+
+def test_errors_are_never_stored(client):
+    response = client.get("/failing")
+    assert response.status_code == 502
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "ETag" not in response.headers
+
+
+def test_view_policy_wins(client):
+    assert client.get("/degraded").headers["Cache-Control"] == "private, no-cache"
+
+
+def test_large_json_is_gzipped(client, monkeypatch):
+    monkeypatch.setattr(http_cache, "brotli", None)
+    response = client.get("/cached", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.get_data())) == BIG
+    assert "Accept-Encoding" in response.headers["Vary"]
+    # the ETag names the uncompressed body, so it matches either way
+    assert response.headers["ETag"] == client.get("/cached").headers["ETag"]
+
+
+def test_streams_pass_through(client):
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.get_data() == b"a\nb\n"
+    assert "ETag" not in response.headers and "Content-Encoding" not in response.headers
+
+
+def test_estimated_routes_are_revalidated():
+    from app.routes import _degraded_no_cache
+
+    app = Flask(__name__)
+    with app.app_context():
+        routed = _degraded_no_cache(jsonify({}), [{"walking": {}}, {"walking": {}}])
+        estimated = _degraded_no_cache(jsonify({}), [{"walking": {}}, {"estimated": True}])
+    assert "Cache-Control" not in routed.headers
+    assert estimated.headers["Cache-Control"] == "private, no-cache"
@@ -0,0 +1,85 @@
+import json
+
+from app.itinerary_generator import _close_json, _places_from_doc, parse_itinerary_text
+from app.json_stream import PlaceStreamParser
+
+DOC = {"Places": {
+    "Louvre Museum": {"time": ["09:00", "11:00"], "price": "$$"},
+    "Café de Flore": {"time": ["11:30", "12:30"], "price": "$"},
+    "Jardin du Luxembourg": {"time": ["13:00", "14:30"], "price": "$"},
+}}
+TEXT = json.dumps(DOC, ensure_ascii=False)
+NAMES = ["Louvre Museum", "Café de Flore", "Jardin du Luxembourg"]
+
+
+def names(places):
+    return [p["name"] for p in places]
+
+
+def test_places_from_doc_object_and_list_shapes():
+    assert _places_from_doc(DOC) == [
+        {"name": "Louvre Museum", "time": ["09:00", "11:00"], "price": "$$"},
+        {"name": "Café de Flore", "time": ["11:30", "12:30"], "price": "$"},
+        {"name": "Jardin du Luxembourg", "time": ["13:00", "14:30"], "price": "$"},
+    ]
+    listed = {"places": [{"name": "A"}, {"time": ["10:00", "11:00"]}, "junk", {"name": "B"}]}
+    assert _places_from_doc(listed) == [{"name": "A"}, {"name": "B"}]
+    assert _places_from_doc({"Places": {}}) is None
+    assert _places_from_doc("text") is None
+
+
+def test_close_json_repairs_fenced_truncated_output():
+    assert json.loads(_close_json('```json\n{"Places": {"A": {"time": ["09:00", "10:00"]},')) == \
+        {"Places": {"A": {"time": ["09:00", "10:00"]}}}
+    # unterminated string and trailing comma inside a list
+    assert json.loads(_close_json('{"Places": {"A": {"tags": ["x", "y",], "note": "open la')) == \
+        {"Places": {"A": {"tags": ["x", "y"], "note": "open la"}}}
+    # prose after the document is dropped
+    assert json.loads(_close_json('Here you go: {"a": 1} hope it helps {"b": 2}')) == {"a": 1}
+
+
+def test_parse_plain_json():
+    assert names(parse_itinerary_text(TEXT)) == NAMES
+
+
+def test_parse_fenced_json_with_prose():
+    text = f"Sure! Here is the plan:\n```json\n{TEXT}\n```\nEnjoy your trip."
+    assert parse_itinerary_text(text) == _places_from_doc(DOC)
+
+
+def test_parse_truncated_json_keeps_complete_places():
+    cut = TEXT.index("Jardin") + 20
+    assert names(parse_itinerary_text(TEXT[:cut])) == NAMES[:2]
+
+
+def test_parse_truncated_inside_first_place_is_repaired():
+    text = '{"Places": {"Louvre Museum": {"time": ["09:00", "11:00"], "price": "$'
+    assert parse_itinerary_text(text) == [{"name": "Louvre Museum", "time": ["09:00", "11:00"], "price": "$"}]
+
+
+def test_parse_garbage_returns_none():
+    assert parse_itinerary_text("The model is unavailable.") is None
+
+
+def test_stream_parser_emits_places_as_they_close():
+    parser = PlaceStreamParser()
+    emitted = []
+    for i in range(0, len(TEXT), 7):
+        emitted.append(names(parser.feed(TEXT[i:i + 7])))
+    assert [n for chunk in emitted for n in chunk] == NAMES
+    # every place is emitted by the chunk holding its closing brace, not at the end
+    first = next(i for i, chunk in enumerate(emitted) if chunk)
+    assert (first + 1) * 7 >= TEXT.index("}") + 1 > first * 7
+    assert parser.done and parser.emitted == 3
+
+
+def test_stream_parser_skips_fences_and_text_after_document():
+    parser = PlaceStreamParser()
+    assert parser.feed("```json\n") == []
+    places = parser.feed(TEXT) + parser.feed('\n```\n{"Places": {"Extra": {}}}')
+    assert names(places) == NAMES
+
+
+def test_stream_parser_list_shape_and_braces_in_strings():
+    text = '{"places": [{"name": "Bar {x}", "note": "say \\"}\\""}, {"note": "no name"}, {"name": "B"}]}'
+    assert PlaceStreamParser().feed(text) == [{"name": "Bar {x}", "note": 'say "}"'}, {"name": "B"}]
@@ -0,0 +1,107 @@
+import os
+import re
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+from app import create_app, metrics
+from app.cache import TieredCache
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)$')
+
+
+@pytest.fixture
+def client():
+    return create_app(warm=False).test_client()
+
+
+def parse_prometheus(text):
+    """{family: (type, [(sample name, labels, value)])}, checking the layout."""
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert name not in families, f"second TYPE line for {name}"
+            families[name] = (kind, [])
+            current = name
+            continue
+        match = SAMPLE.match(line)
+        assert match, f"not a sample line: {line!r}"
+        name, labels, value = match.groups()
+        float(value)
+        # a sample belongs to the family whose TYPE line came last
+        assert current and re.fullmatch(rf"{current}(_bucket|_count|_sum)?", name), \
+            f"{name} outside its family (under {current})"
+        families[current][1].append((name, labels or "", value))
+    return families
+
+
+def test_server_timing_lists_request_spans(client):
+    response = client.post("/api/route_polylines", json={"pairs": []})
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    entries = dict(part.split(";", 1) for part in timing.split(", "))
+    assert entries["serialize"].startswith("dur=")
+    assert re.fullmatch(r"dur=\d+\.\d", entries["total"])
+
+
+def test_metrics_are_valid_prometheus_text(client):
+    # two caches, so collected stats come for more than one label set
+    for name in ("metrics_test_a", "metrics_test_b"):
+        cache = TieredCache(name, maxsize=4, ttl=60)
+        cache.get("missing")
+    client.post("/api/route_polylines", json={"pairs": []})
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    families = parse_prometheus(response.get_data(as_text=True))
+    kind, samples = families["cache_misses_total"]
+    assert kind == "counter"
+    assert {'{cache="metrics_test_a"}', '{cache="metrics_test_b"}'} <= {labels for _, labels, _ in samples}
+    assert families["cache_hits_total"][0] == "counter"
+    kind, samples = families["http_request_seconds"]
+    assert kind == "histogram"
+    assert any(name == "http_request_seconds_count" and 'endpoint="api.route_polylines"' in labels
+               for name, labels, _ in samples)
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics.observe("test_latency_seconds", 0.003, case="cumulative")
+    metrics.observe("test_latency_seconds", 0.2, case="cumulative")
+    metrics.observe("test_latency_seconds", 99.0, case="cumulative")
+    _, samples = parse_prometheus(metrics.render_prometheus())["test_latency_seconds"]
+    buckets = {labels: int(value) for name, labels, value in samples if name.endswith("_bucket")}
+    assert buckets['{case="cumulative",le="0.005"}'] == 1
+    assert buckets['{case="cumulative",le="0.25"}'] == 2
+    assert buckets['{case="cumulative",le="30.0"}'] == 2
+    assert buckets['{case="cumulative",le="+Inf"}'] == 3
+
+
+def test_metrics_disabled_turns_everything_off():
+    # METRICS_ENABLED is read at import time, so this needs a fresh interpreter
+    script = textwrap.dedent("""
+        from app import create_app, metrics
+
+        def fn():
+            pass
+
+        assert metrics.timed("x")(fn) is fn
+        assert metrics.span("x") is metrics.span("y")
+        metrics.inc("disabled_total")
+        metrics.record("disabled", 1.0)
+        client = create_app(warm=False).test_client()
+        response = client.post("/api/route_polylines", json={"pairs": []})
+        assert response.status_code == 200
+        assert "Server-Timing" not in response.headers
+        assert client.get("/api/metrics").status_code == 404
+        assert metrics.render_prometheus().count("disabled") == 0
+    """)
+    backend = Path(__file__).resolve().parent.parent
+    env = {**os.environ, "METRICS_ENABLED": "0"}
+    result = subprocess.run([sys.executable, "-c", script], cwd=backend, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,97 @@
+import json
+import uuid
+
+import pytest
+
+from app import pipeline
+from app.pipeline import format_ndjson, format_sse, iter_events, stream_itinerary_events
+
+DOC = json.dumps({"Places": {
+    "Louvre Museum": {"time": ["09:00", "11:00"]},
+    "Broken Place": {"time": ["11:30", "12:30"]},
+    "Jardin du Luxembourg": {"time": ["13:00", "14:30"]},
+}})
+COORDS = {"Louvre Museum": {"lat": 48.8606, "lng": 2.3376},
+          "Jardin du Luxembourg": {"lat": 48.8462, "lng": 2.3372}}
+
+
+@pytest.fixture(autouse=True)
+def fakes(monkeypatch):
+    async def model_stream(destination, month, budget, category):
+        for i in range(0, len(DOC), 16):
+            yield DOC[i:i + 16]
+
+    def geocode(names, location, country):
+        if names == ["Broken Place"]:
+            raise RuntimeError("provider exploded")
+        return {name: COORDS.get(name) for name in names}
+
+    monkeypatch.setattr(pipeline, "astream_itinerary_text", model_stream)
+    monkeypatch.setattr(pipeline, "get_location_coordinates", geocode)
+
+
+def run(destination=None, **kwargs):
+    destination = destination or f"Paris-{uuid.uuid4().hex[:8]}"
+    return list(iter_events(lambda: stream_itinerary_events(destination, "May", "$$", "culture", **kwargs)))
+
+
+def test_failed_geocode_still_completes_the_stream():
+    events = run()
+    kinds = [e["event"] for e in events]
+    assert kinds.count("place") == 3 and kinds.count("coordinates") == 3
+    assert kinds[-1] == "done"
+    coordinates = {e["name"]: e["coordinates"] for e in events if e["event"] == "coordinates"}
+    assert coordinates == {"Louvre Museum": COORDS["Louvre Museum"], "Broken Place": None,
+                           "Jardin du Luxembourg": COORDS["Jardin du Luxembourg"]}
+    done = events[-1]
+    assert {item["name"] for item in done["itinerary"]} == set(coordinates)
+    assert set(done["optimization"]) >= {"travel_time_before", "travel_time_after", "overruns_day"}
+
+
+def test_places_are_sent_before_the_model_finishes():
+    events = run()
+    first_place = next(i for i, e in enumerate(events) if e["event"] == "place")
+    assert events[first_place]["item"]["name"] == "Louvre Museum"
+    assert first_place == 0
+
+
+def test_second_request_is_a_cache_hit():
+    destination = f"Lyon-{uuid.uuid4().hex[:8]}"
+    first = run(destination)
+    second = run(destination)
+    assert [e["event"] for e in second] == ["done"]
+    assert second[0]["cached"] is True
+    assert second[0]["itinerary"] == first[-1]["itinerary"]
+
+
+def test_generator_errors_become_error_events(monkeypatch):
+    async def exploding(*args, **kwargs):
+        raise RuntimeError("loop broke")
+        yield
+
+    monkeypatch.setattr(pipeline, "stream_itinerary_events", exploding)
+    assert list(iter_events(lambda: pipeline.stream_itinerary_events())) == [
+        {"event": "error", "error": "loop broke"}]
+
+
+def test_wire_formats():
+    event = {"event": "place", "index": 0}
+    assert format_ndjson(event) == '{"event": "place", "index": 0}\n'
+    assert format_sse(event) == 'event: place\ndata: {"event": "place", "index": 0}\n\n'
+
+
+def test_stream_dying_mid_itinerary_is_served_but_not_cached(monkeypatch):
+    calls = []
+
+    async def dying_stream(destination, month, budget, category):
+        calls.append(destination)
+        yield DOC[:DOC.index("Broken Place")]
+        raise ConnectionError("stream reset by peer")
+
+    monkeypatch.setattr(pipeline, "astream_itinerary_text", dying_stream)
+    destination = f"Nice-{uuid.uuid4().hex[:8]}"
+    first = run(destination)
+    assert [item["name"] for item in first[-1]["itinerary"]] == ["Louvre Museum"]
+    second = run(destination)
+    assert second[-1].get("cached") is None
+    assert len(calls) == 2
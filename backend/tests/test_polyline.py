@@ -0,0 +1,53 @@
+import math
+import random
+
+import pytest
+
+from app import polyline
+
+# Example from Google's encoded polyline algorithm format documentation
+REFERENCE_POINTS = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+REFERENCE_ENCODED = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def flat(points):
+    return [c for p in points for c in p]
+
+
+def test_encode_matches_reference():
+    assert polyline.encode(REFERENCE_POINTS) == REFERENCE_ENCODED
+
+
+def test_decode_matches_reference():
+    assert flat(polyline.decode(REFERENCE_ENCODED)) == pytest.approx(flat(REFERENCE_POINTS))
+
+
+def test_round_trip_at_precision():
+    rng = random.Random(7)
+    points = [[round(rng.uniform(-89, 89), 5), round(rng.uniform(-179, 179), 5)] for _ in range(200)]
+    assert flat(polyline.decode(polyline.encode(points))) == pytest.approx(flat(points), abs=1e-9)
+    six = [[48.858370, 2.294481], [48.853410, 2.348800]]
+    assert flat(polyline.decode(polyline.encode(six, precision=6), precision=6)) == pytest.approx(flat(six), abs=1e-9)
+
+
+def test_empty():
+    assert polyline.encode([]) == ""
+    assert polyline.decode("") == []
+
+
+def test_simplify_drops_collinear_points_keeps_corners():
+    line = [[48.85, 2.30 + i * 0.001] for i in range(10)] + [[48.85 + i * 0.001, 2.309] for i in range(1, 10)]
+    assert flat(polyline.simplify(line, 1.0)) == pytest.approx(flat([line[0], line[9], line[-1]]))
+    assert polyline.simplify(line, 0) == line
+
+
+def test_tolerance_for_zoom_halves_per_level_and_clamps():
+    assert polyline.tolerance_for_zoom(11) == pytest.approx(polyline.tolerance_for_zoom(10) / 2)
+    assert polyline.tolerance_for_zoom(60, lat=45) == polyline.tolerance_for_zoom(polyline.MAX_ZOOM, lat=45)
+    assert polyline.tolerance_for_zoom(-5) == polyline.tolerance_for_zoom(polyline.MIN_ZOOM)
+
+
+@pytest.mark.parametrize("zoom", [math.nan, math.inf, -math.inf])
+def test_tolerance_for_zoom_rejects_non_finite(zoom):
+    with pytest.raises(ValueError):
+        polyline.tolerance_for_zoom(zoom)
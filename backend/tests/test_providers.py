@@ -0,0 +1,152 @@
+import itertools
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.models import Response
+
+from app import map_service, providers
+from app.cache import SqliteStore
+from app.providers import ProviderClient
+from app.ratelimit import RateLimited, TokenBucket
+
+
+class ScriptedAdapter(BaseAdapter):
+    """Transport that answers with a fixed sequence of (status, headers)."""
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = list(script)
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(request.url)
+        status, headers = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        response = Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response.url = request.url
+        response.request = request
+        response._content = b"{}"
+        return response
+
+    def close(self):
+        pass
+
+
+_names = itertools.count()
+
+
+def client_with(script, **kwargs):
+    # a fresh name per client, so no test inherits another's circuit breaker
+    client = ProviderClient(f"scripted{next(_names)}", **kwargs)
+    adapter = ScriptedAdapter(script)
+    client.session.mount("https://", adapter)
+    return client, adapter
+
+
+@pytest.fixture
+def slept(monkeypatch):
+    """Backoff sleeps, recorded instead of slept; jitter picks the full delay."""
+    delays = []
+    monkeypatch.setattr(providers.time, "sleep", delays.append)
+    monkeypatch.setattr(providers.random, "uniform", lambda low, high: high)
+    return delays
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_transient_statuses_are_retried(slept, status):
+    client, adapter = client_with([(status, {}), (status, {}), (200, {})], max_retries=2,
+                                  backoff=0.5, max_backoff=10.0)
+    assert client.get("https://example.test/x").status_code == 200
+    assert len(adapter.sent) == 3
+    # exponential backoff: base, then doubled
+    assert slept == [0.5, 1.0]
+    assert client.stats()["retries"] == 2
+    assert client.stats()["failures"] == 0
+
+
+def test_retry_after_is_honoured_up_to_max_backoff(slept):
+    client, adapter = client_with([(429, {"Retry-After": "1.5"}), (503, {"Retry-After": "60"}),
+                                   (503, {"Retry-After": "soon"}), (200, {})],
+                                  max_retries=3, backoff=0.25, max_backoff=4.0)
+    assert client.get("https://example.test/x").status_code == 200
+    # the server's delay, capped at max_backoff; unparseable values use the backoff
+    assert slept == [1.5, 4.0, 1.0]
+
+
+@pytest.mark.parametrize("status", [400, 401, 403, 404, 422])
+def test_client_errors_are_not_retried(slept, status):
+    client, adapter = client_with([(status, {}), (200, {})], max_retries=3)
+    assert client.get("https://example.test/x").status_code == status
+    assert len(adapter.sent) == 1
+    assert slept == []
+    assert client.stats()["retries"] == 0
+
+
+def test_attempts_are_capped(slept):
+    client, adapter = client_with([(503, {})], max_retries=2, backoff=0.1)
+    # the last response is returned rather than raised, and counts as a failure
+    assert client.get("https://example.test/x").status_code == 503
+    assert len(adapter.sent) == 3
+    assert len(slept) == 2
+    assert client.stats()["failures"] == 1
+
+
+def test_connection_errors_are_retried_then_raised(slept):
+    client, adapter = client_with([(200, {})], max_retries=1)
+
+    def refuse(request, **kwargs):
+        adapter.sent.append(request.url)
+        raise requests.ConnectionError("refused")
+
+    adapter.send = refuse
+    with pytest.raises(requests.ConnectionError):
+        client.get("https://example.test/x")
+    assert len(adapter.sent) == 2
+    assert client.stats()["failures"] == 1
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteStore(str(tmp_path / "limits.sqlite3"))
+
+
+def test_operations_have_their_own_bucket(store):
+    geocode = TokenBucket("geocode", rate=1.0, capacity=1.0, max_wait=0.0, store=store)
+    directions = TokenBucket("directions", rate=1.0, capacity=1.0, max_wait=0.0, store=store)
+    client, adapter = client_with([(200, {})], limiter={"default": geocode, "geocode": geocode,
+                                                        "directions": directions})
+    client.post("https://example.test/route", operation="directions")
+    # the directions token is gone, geocoding is still free to go
+    with pytest.raises(RateLimited):
+        client.post("https://example.test/route", operation="directions")
+    client.get("https://example.test/search", operation="geocode")
+    # unnamed operations share the default bucket
+    with pytest.raises(RateLimited):
+        client.get("https://example.test/search")
+    assert len(adapter.sent) == 2
+    assert client.stats()["rate_limit"]["directions"]["rejected"] == 1
+
+
+def test_ors_buckets_fail_fast(monkeypatch):
+    for name in ("ORS_RATE_LIMIT", "ORS_RATE_BURST", "ORS_MAX_WAIT"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("ORS_DIRECTIONS_RATE_LIMIT", "0.5")
+    limiter = providers._build("ors").limiter
+    assert limiter["geocode"] is limiter["default"]
+    assert limiter["directions"].name != limiter["geocode"].name
+    assert (limiter["geocode"].rate, limiter["directions"].rate) == (1.5, 0.5)
+    # a queue long enough to matter would only hold the caller's thread
+    assert all(bucket.max_wait <= 5 for bucket in limiter.values())
+    assert providers._build("nominatim").limiter.max_wait <= 5
+
+
+def test_rate_limited_directions_fall_back_to_estimates(monkeypatch):
+    def refused(profile, waypoints, api_key):
+        raise RateLimited("ors_directions", 12.0)
+
+    monkeypatch.setattr(map_service, "_ors_directions", refused)
+    a, b = {"lat": 30.0, "lng": 40.0}, {"lat": 30.01, "lng": 40.01}
+    legs = map_service.route_segments([(a, b)], "key", estimate=True)[0]
+    assert all(not isinstance(leg, Exception) and leg["estimated"] for leg in legs.values())
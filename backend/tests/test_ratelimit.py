@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+from app import ratelimit
+from app.cache import SqliteStore
+from app.ratelimit import RateLimited, TokenBucket
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteStore(str(tmp_path / "limits.sqlite3"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Frozen ``time.time``; ``sleep`` advances it instead of blocking."""
+    state = {"now": 1000.0, "slept": []}
+
+    def sleep(seconds):
+        state["slept"].append(round(seconds, 6))
+        state["now"] += seconds
+
+    monkeypatch.setattr(ratelimit.time, "time", lambda: state["now"])
+    monkeypatch.setattr(ratelimit.time, "sleep", sleep)
+    return state
+
+
+def test_take_refills_up_to_capacity():
+    bucket = TokenBucket("t", rate=2.0, capacity=3.0)
+    assert bucket._take(3.0, 0.0, 0.0) == (2.0, 0.0)
+    # 10 s idle refills to capacity, not to 20 tokens
+    assert bucket._take(0.0, 0.0, 10.0) == (2.0, 0.0)
+    # an empty bucket queues the caller for one token's worth of time
+    assert bucket._take(0.0, 0.0, 0.0) == (-1.0, 0.5)
+
+
+def test_burst_then_paced(store, clock):
+    bucket = TokenBucket("burst", rate=1.0, capacity=2.0, store=store)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock["slept"] == [1.0, 1.0]
+    assert bucket.stats() == {"acquired": 4, "waited_s": 2.0, "rejected": 0}
+
+
+def test_wait_beyond_max_wait_is_rejected_without_reserving(store, clock):
+    bucket = TokenBucket("strict", rate=1.0, capacity=1.0, max_wait=0.5, store=store)
+    bucket.acquire()
+    with pytest.raises(RateLimited) as info:
+        bucket.acquire()
+    assert info.value.wait == pytest.approx(1.0)
+    assert bucket.rejected == 1
+    # the refused call took no token: one second later a token is free again
+    clock["now"] += 1.0
+    bucket.acquire()
+    assert clock["slept"] == []
+
+
+def test_buckets_share_state_through_the_store(store, clock):
+    # two workers: separate objects, one database
+    first = TokenBucket("shared", rate=1.0, capacity=1.0, max_wait=0.0, store=store)
+    second = TokenBucket("shared", rate=1.0, capacity=1.0, max_wait=0.0, store=store)
+    other = TokenBucket("other", rate=1.0, capacity=1.0, max_wait=0.0, store=store)
+    first.acquire()
+    with pytest.raises(RateLimited):
+        second.acquire()
+    other.acquire()
+
+
+def test_falls_back_to_local_limit_without_store(clock, monkeypatch):
+    bucket = TokenBucket("local", rate=1.0, capacity=1.0, max_wait=0.0)
+
+    def broken(now):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(bucket, "_reserve_shared", broken)
+    bucket.acquire()
+    with pytest.raises(RateLimited):
+        bucket.acquire()
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from app import resilience
+from app.resilience import CLOSED, HALF_OPEN, OPEN, ProviderHealth, RollingHistogram, hedged
+
+
+def test_histogram_percentiles_and_window():
+    hist = RollingHistogram(window=60, slots=6)
+    for _ in range(90):
+        hist.add(0.04, ok=True, now=100.0)
+    for _ in range(10):
+        hist.add(2.5, ok=False, now=100.0)
+    counts, calls, errors = hist.totals(now=100.0)
+    assert (calls, errors) == (100, 10)
+    assert hist.percentile(50, now=100.0) == 0.05
+    assert hist.percentile(95, now=100.0) == 3.0
+    # a minute later every slot has rotated out
+    assert hist.totals(now=170.0)[1:] == (0, 0)
+    assert hist.percentile(50, now=170.0) is None
+
+
+def test_slower_than_largest_bucket():
+    hist = RollingHistogram()
+    hist.add(120.0, ok=True, now=5.0)
+    assert hist.percentile(99, now=5.0) == float("inf")
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKER_ENABLED", True)
+    monkeypatch.setattr(resilience, "BREAKER_MIN_CALLS", 4)
+    monkeypatch.setattr(resilience, "BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(resilience, "BREAKER_COOLDOWN_S", 30)
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(resilience.time, "time", lambda: clock["now"])
+    return ProviderHealth("test"), clock
+
+
+def test_breaker_opens_probes_and_closes(breaker):
+    health, clock = breaker
+    health.record("op", 0.1, ok=True)
+    health.record("op", 0.1, ok=True)
+    health.record("op", 0.1, ok=False)
+    assert health.state == CLOSED
+    health.record("op", 0.1, ok=False)     # 2 of 4 failed
+    assert health.state == OPEN
+    assert not health.allow() and health.rejected == 1
+
+    clock["now"] += 30
+    assert health.allow() and health.state == HALF_OPEN
+    assert not health.allow()              # one probe at a time
+    health.record("op", 0.1, ok=True)
+    assert health.state == CLOSED and health.allow()
+
+
+def test_failed_probe_reopens(breaker):
+    health, clock = breaker
+    for _ in range(4):
+        health.record("op", 0.1, ok=False)
+    clock["now"] += 30
+    assert health.allow()
+    health.record("op", 0.1, ok=False)
+    assert health.state == OPEN and not health.allow()
+
+
+def test_hedge_delay_uses_recent_p95(breaker, monkeypatch):
+    health, _ = breaker
+    monkeypatch.setattr(resilience, "HEDGE_MIN_SAMPLES", 10)
+    assert health.hedge_delay("geocode") == resilience.HEDGE_DEFAULT_DELAY_S
+    for _ in range(20):
+        health.record("geocode", 0.3, ok=True)
+    assert health.hedge_delay("geocode") == 0.3
+    assert health.hedge_delay("geocode", ceiling=0.25) == 0.25
+
+
+def test_hedged_fast_primary_wins():
+    fallback_calls = []
+    assert hedged(lambda: "primary", lambda: fallback_calls.append(1), delay=1.0) == "primary"
+    assert fallback_calls == []
+
+
+def test_hedged_failed_primary_falls_back_at_once():
+    def broken():
+        raise RuntimeError("down")
+
+    started = time.perf_counter()
+    assert hedged(broken, lambda: "fallback", delay=5.0) == "fallback"
+    assert hedged(lambda: None, lambda: "fallback", delay=5.0) == "fallback"
+    assert time.perf_counter() - started < 1.0
+
+
+def test_hedged_slow_primary_is_raced():
+    release = threading.Event()
+
+    def slow():
+        release.wait(2)
+        return "primary"
+
+    started = time.perf_counter()
+    assert hedged(slow, lambda: "fallback", delay=0.05) == "fallback"
+    assert time.perf_counter() - started < 1.0
+    release.set()
+
+
+def test_hedged_all_fail():
+    assert hedged(lambda: None, lambda: None, delay=0.01) is None
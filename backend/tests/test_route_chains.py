@@ -0,0 +1,135 @@
+import itertools
+
+import pytest
+
+from app import map_service
+from app.map_service import _chains, route_segments
+
+_offset = itertools.count()
+
+
+def stops(n):
+    """Fresh coordinates on every call, so the route cache never answers."""
+    base = next(_offset) * 0.05
+    return [{"lat": 10.0 + base + i * 0.01, "lng": 20.0 + i * 0.01} for i in range(n)]
+
+
+def test_chains_groups_adjacent_pairs():
+    a, b, c, d, e = stops(5)
+    pairs = [(a, b), (b, c), (d, e), (e, a), (a, b)]
+    assert _chains(pairs, [0, 1, 2, 3, 4]) == [[0, 1], [2, 3, 4]]
+    assert _chains(pairs, [0, 2]) == [[0], [2]]
+    assert _chains(pairs, []) == []
+
+
+def test_chains_respect_waypoint_limit():
+    points = stops(map_service.ORS_MAX_WAYPOINTS + 5)
+    pairs = list(zip(points, points[1:]))
+    chains = _chains(pairs, list(range(len(pairs))))
+    assert [len(c) for c in chains] == [map_service.ORS_MAX_WAYPOINTS - 1, len(pairs) - map_service.ORS_MAX_WAYPOINTS + 1]
+    assert sum(chains, []) == list(range(len(pairs)))
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeClient:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def post(self, url, **kwargs):
+        return FakeResponse(self.payload)
+
+
+def test_directions_split_multi_waypoint_route_into_legs(monkeypatch):
+    points = [[10.0, 20.0], [10.0, 20.001], [10.001, 20.001], [10.002, 20.001], [10.002, 20.002]]
+    payload = {"routes": [{
+        "geometry": map_service.polyline.encode(points),
+        "segments": [{"duration": 30.0, "distance": 110.0}, {"duration": 50.0, "distance": 220.0}],
+        "way_points": [0, 2, 4],
+    }]}
+    monkeypatch.setattr(map_service, "get_client", lambda name: FakeClient(payload))
+    waypoints = [{"lat": p[0], "lng": p[1]} for p in (points[0], points[2], points[4])]
+    legs = map_service._ors_directions("foot-walking", waypoints, "key")
+    assert [(leg["duration"], leg["distance"]) for leg in legs] == [(30.0, 110.0), (50.0, 220.0)]
+    # the shared waypoint ends the first leg and starts the second
+    assert [len(leg["polyline"]) for leg in legs] == [3, 3]
+    assert legs[0]["polyline"][-1] == pytest.approx(legs[1]["polyline"][0])
+
+
+def test_directions_without_route_gives_no_legs(monkeypatch):
+    monkeypatch.setattr(map_service, "get_client", lambda name: FakeClient({"routes": []}))
+    assert map_service._ors_directions("foot-walking", stops(3), "key") == [None, None]
+
+
+def fake_directions(calls, fail_batches=False):
+    def directions(profile, waypoints, api_key):
+        calls.append((profile, len(waypoints)))
+        if fail_batches and len(waypoints) > 2:
+            raise RuntimeError("batch refused")
+        return [{"duration": float(i + 1), "distance": 1.0, "polyline": [[w["lat"], w["lng"]] for w in pair]}
+                for i, pair in enumerate(zip(waypoints, waypoints[1:]))]
+    return directions
+
+
+def test_route_segments_one_request_per_profile_and_chain(monkeypatch):
+    calls = []
+    monkeypatch.setattr(map_service, "_ors_directions", fake_directions(calls))
+    points = stops(5)
+    pairs = list(zip(points, points[1:]))
+    legs = route_segments(pairs, "key")
+    assert sorted(calls) == [("driving-car", 5), ("foot-walking", 5)]
+    assert [leg["foot-walking"]["duration"] for leg in legs] == [1.0, 2.0, 3.0, 4.0]
+    assert legs[2]["driving-car"]["polyline"] == [[points[2]["lat"], points[2]["lng"]],
+                                                  [points[3]["lat"], points[3]["lng"]]]
+
+    # now cached: nothing is routed again
+    calls.clear()
+    assert route_segments(pairs, "key") == legs
+    assert calls == []
+
+
+def test_route_segments_failed_batch_falls_back_to_single_pairs(monkeypatch):
+    calls = []
+    monkeypatch.setattr(map_service, "_ors_directions", fake_directions(calls, fail_batches=True))
+    points = stops(4)
+    legs = route_segments(list(zip(points, points[1:])), "key", profiles=("foot-walking",))
+    assert calls == [("foot-walking", 4)] + [("foot-walking", 2)] * 3
+    assert all(leg["foot-walking"]["duration"] == 1.0 for leg in legs)
+
+
+@pytest.mark.parametrize("bad", [{}, {"lat": None, "lng": 2.0}, {"lat": "north", "lng": 2.0},
+                                 {"lat": float("nan"), "lng": 2.0}, {"lat": 95.0, "lng": 2.0}, None])
+def test_malformed_pair_only_fails_its_own_segment(monkeypatch, bad):
+    calls = []
+    monkeypatch.setattr(map_service, "_ors_directions", fake_directions(calls))
+    a, b, c = stops(3)
+    legs = route_segments([(a, b), (b, bad), (b, c)], "key", estimate=True)
+    assert all(isinstance(leg, ValueError) for leg in legs[1].values())
+    assert [legs[0]["foot-walking"]["duration"], legs[2]["foot-walking"]["duration"]] == [1.0, 2.0]
+    # the valid pairs still form one chain per profile
+    assert sorted(calls) == [("driving-car", 3), ("foot-walking", 3)]
+
+
+def test_route_polylines_with_a_bad_pair(monkeypatch):
+    from app import create_app
+
+    monkeypatch.setattr(map_service, "_ors_directions", fake_directions([]))
+    monkeypatch.setattr("app.routes.ors_api_key", lambda: "key")
+    a, b = stops(2)
+    client = create_app(warm=False).test_client()
+    response = client.post("/api/route_polylines", json={"pairs": [
+        {"start": a, "end": b}, {"start": a, "end": {"lat": "x"}}, "junk"]})
+    assert response.status_code == 200
+    segments = response.get_json()
+    assert segments[0]["walk"]["duration"] == 1.0
+    assert "lat" in segments[1]["error"] and "error" in segments[2]
+    assert response.headers["Cache-Control"] == "private, no-cache"
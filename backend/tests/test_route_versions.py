@@ -0,0 +1,117 @@
+import itertools
+
+import pytest
+
+from app import map_service
+from app.route_versions import UnknownVersion, apply_edit, base_stops, route_itinerary, stops_of, version_id
+
+_offset = itertools.count()
+
+
+def stops(n):
+    base = next(_offset) * 0.05
+    return [{"lat": round(30.0 + base + i * 0.01, 6), "lng": round(40.0 + i * 0.01, 6)} for i in range(n)]
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """ORS directions requests made, as (profile, waypoint count)."""
+    made = []
+
+    def directions(profile, waypoints, api_key):
+        made.append((profile, len(waypoints)))
+        return [{"duration": 60.0, "distance": 100.0, "polyline": [[a["lat"], a["lng"]], [b["lat"], b["lng"]]]}
+                for a, b in zip(waypoints, waypoints[1:])]
+
+    monkeypatch.setattr(map_service, "_ors_directions", directions)
+    return made
+
+
+def test_apply_edit_ops():
+    a, b, c, d = stops(4)
+    new = {"lat": 1.0, "lng": 2.0}
+    assert apply_edit([a, b, c, d], {"op": "move", "from": 0, "to": 2}) == [b, c, a, d]
+    assert apply_edit([a, b, c], {"op": "insert", "index": 3, "coordinates": new}) == [a, b, c, new]
+    assert apply_edit([a, b, c], {"op": "remove", "index": 1}) == [a, c]
+    assert apply_edit([a, b, c], {"op": "replace", "index": 0, "coordinates": new}) == [new, b, c]
+    assert apply_edit([a, b, c], [{"op": "remove", "index": 0}, {"op": "move", "from": 1, "to": 0}]) == [c, b]
+
+
+def test_apply_edit_leaves_input_alone():
+    original = stops(3)
+    copy = list(original)
+    apply_edit(original, {"op": "remove", "index": 0})
+    assert original == copy
+
+
+@pytest.mark.parametrize("edit", [
+    {"op": "swap", "index": 0},
+    {"op": "remove", "index": 3},
+    {"op": "move", "from": 0},
+    {"op": "insert", "index": "x", "coordinates": {"lat": 1, "lng": 2}},
+    ["not an edit"],
+])
+def test_apply_edit_rejects_malformed(edit):
+    with pytest.raises(ValueError):
+        apply_edit(stops(3), edit)
+
+
+def test_stops_of_and_version_ids():
+    itinerary = [{"coordinates": {"lat": 1.23456789, "lng": 2}}, {"name": "no coords"}, {"coords": {"lat": 3, "lng": 4}}]
+    assert stops_of(itinerary) == [{"lat": 1.234568, "lng": 2.0}, None, {"lat": 3.0, "lng": 4.0}]
+    a, b = stops(2)
+    assert version_id([a, b]) == version_id([dict(a), dict(b)])
+    assert version_id([a, b]) != version_id([b, a])
+
+
+@pytest.mark.parametrize("edit, routed", [
+    ({"op": "move", "from": 1, "to": 5}, 3),
+    ({"op": "move", "from": 6, "to": 0}, 2),
+    ({"op": "insert", "index": 3, "coordinates": {"lat": 31.5, "lng": 41.5}}, 2),
+    ({"op": "remove", "index": 2}, 1),
+    ({"op": "replace", "index": 7, "coordinates": {"lat": 31.5, "lng": 41.5}}, 1),
+])
+def test_edit_routes_only_new_pairs_in_one_request_per_profile(calls, edit, routed):
+    base = stops(8)
+    version, _, counts = route_itinerary(base, api_key="key")
+    assert counts == {"routed": 7, "reused": 0}
+    assert base_stops(version) == base
+
+    calls.clear()
+    new = apply_edit(base, edit)
+    new_version, legs, counts = route_itinerary(new, version, api_key="key")
+    assert counts == {"routed": routed, "reused": len(new) - 1 - routed}
+    assert sorted(profile for profile, _ in calls) == ["driving-car", "foot-walking"]
+    assert new_version == version_id(new) != version
+    # every leg, reused or routed, joins its own pair of stops
+    for (a, b), pair_legs in zip(zip(new, new[1:]), legs):
+        assert pair_legs["foot-walking"]["polyline"] == [[a["lat"], a["lng"]], [b["lat"], b["lng"]]]
+
+
+def test_unchanged_stops_route_nothing(calls):
+    base = stops(5)
+    version, _, _ = route_itinerary(base, api_key="key")
+    calls.clear()
+    again, _, counts = route_itinerary(list(base), version, api_key="key")
+    assert (again, counts, calls) == (version, {"routed": 0, "reused": 4}, [])
+
+
+def test_stops_without_coordinates_have_no_segments(calls):
+    a, b, c = stops(3)
+    _, legs, counts = route_itinerary([a, None, b, c], api_key="key")
+    assert legs[0] is None and legs[1] is None and legs[2] is not None
+    assert counts == {"routed": 1, "reused": 0}
+
+
+def test_unknown_base_version():
+    with pytest.raises(UnknownVersion):
+        base_stops("no-such-version")
+
+
+def test_cached_pair_between_new_ones_does_not_split_request(calls):
+    a, b, c, d = stops(4)
+    map_service.route_segments([(b, c)], "key")
+    calls.clear()
+    legs = map_service.route_segments([(a, b), (b, c), (c, d)], "key")
+    assert sorted(calls) == [("driving-car", 4), ("foot-walking", 4)]
+    assert all(pair_legs["driving-car"] for pair_legs in legs)
@@ -0,0 +1,58 @@
+import pytest
+
+from app.spatial import SpatialIndex, closest_within, geohash
+
+
+def test_geohash_reference():
+    # example from the geohash specification
+    assert geohash(42.6, -5.6, 5) == "ezs42"
+    assert geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+
+def test_query_radius_nearest_first():
+    index = SpatialIndex()
+    index.add("a", 48.8584, 2.2945, "eiffel")
+    index.add("b", 48.8586, 2.2947)
+    index.add("far", 48.8606, 2.3376, "louvre")
+    found = index.query_radius(48.8584, 2.2945, 50)
+    assert [key for key, _ in found] == ["a", "b"]
+    assert found[0][1] == pytest.approx(0.0, abs=1e-6)
+    assert 20 < found[1][1] < 35
+    assert [key for key, _ in index.query_radius(48.8584, 2.2945, 5000)] == ["a", "b", "far"]
+
+
+def test_nearest_named_and_moves():
+    index = SpatialIndex()
+    index.add("louvre|paris", 48.8606, 2.3376, "louvre")
+    assert index.nearest_named("louvre", 48.86, 2.34, 1000) == ("louvre|paris", 48.8606, 2.3376)
+    assert index.nearest_named("louvre", 50.43, 2.80, 1000) is None
+    # re-adding a key moves it out of its old cell
+    index.add("louvre|paris", 50.4318, 2.8045, "louvre")
+    assert index.query_radius(48.8606, 2.3376, 100) == []
+    assert len(index) == 1
+
+
+def test_max_places_evicts_oldest():
+    index = SpatialIndex(max_places=3)
+    for i, key in enumerate("abc"):
+        index.add(key, 10.0 + i * 0.001, 20.0, key)
+    index.add("a", 10.0, 20.0, "a")     # re-added: now the newest
+    index.add("d", 10.003, 20.0, "d")
+    assert len(index) == 3 and index.evicted == 1
+    assert index.point("b") is None
+    assert index.nearest_named("b", 10.001, 20.0, 100) is None
+    assert sorted(key for key, _ in index.query_radius(10.0, 20.0, 1000)) == ["a", "c", "d"]
+    for i in range(100):
+        index.add(f"x{i}", -30.0 - i * 0.1, 100.0 + i * 0.1)
+    assert len(index) == 3 and index.evicted == 101
+    # emptied buckets and names don't pile up
+    assert len(index._buckets) == 3 and index._names == {}
+
+
+def test_closest_within():
+    lats, lngs = [48.0, 48.8584, 49.0], [2.0, 2.2945, 3.0]
+    index, dist = closest_within(lats, lngs, 48.8585, 2.2945)
+    assert index == 1 and dist < 20
+    assert closest_within(lats, lngs, 40.0, 2.0, max_m=1000) is None
+    assert closest_within([], [], 0.0, 0.0) is None
+
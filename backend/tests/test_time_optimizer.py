@@ -0,0 +1,65 @@
+from app.map_service import pack_leg, route_cache, route_key
+from app.time_optimizer import _format_hhmm, parse_window, solve_itinerary, travel_time_matrix
+
+
+def stop(name, lng, time=None, lat=45.0):
+    item = {"name": name, "coordinates": {"lat": lat, "lng": lng}}
+    if time:
+        item["time"] = time
+    return item
+
+
+def test_parse_window():
+    assert parse_window({"time": ["10:30", "11:45"]}) == (630, 705)
+    assert parse_window({"start_time": "09:00", "end_time": "08:00"}) == (540, 600)
+    assert parse_window({"time": "whenever"}) is None
+
+
+def test_format_hhmm_clamps_to_the_day():
+    assert _format_hhmm(615.4) == "10:15"
+    assert _format_hhmm(24 * 60 + 30) == "23:59"
+    assert _format_hhmm(-5) == "00:00"
+
+
+def test_untimed_zigzag_is_straightened():
+    items = [stop("a", 0.00), stop("c", 0.02), stop("b", 0.01), {"name": "no coords"}, stop("d", 0.03)]
+    result = solve_itinerary(items, use_route_cache=False)
+    assert [item["name"] for item in result["itinerary"]] == ["a", "b", "c", "no coords", "d"]
+    assert result["order"] == [0, 2, 1, 3, 4]
+    assert result["travel_time_after"] < result["travel_time_before"]
+    assert result["overruns_day"] is False
+    assert "time" not in result["itinerary"][1]
+
+
+def test_time_windows_keep_order_when_swapping_would_be_late():
+    items = [stop("a", 0.00, ["09:00", "10:00"]), stop("c", 0.02, ["12:00", "13:00"]),
+             stop("b", 0.01, ["18:00", "19:00"])]
+    result = solve_itinerary(items, use_route_cache=False)
+    assert [item["name"] for item in result["itinerary"]] == ["a", "c", "b"]
+
+
+def test_slots_past_midnight_are_clamped_and_flagged():
+    items = [stop("a", 0.000, ["22:00", "23:00"]), stop("b", 0.020, ["23:00", "23:50"]),
+             stop("c", 0.004, ["23:50", "23:55"])]
+    result = solve_itinerary(items, use_route_cache=False)
+    assert [item["name"] for item in result["itinerary"]] == ["a", "c", "b"]
+    assert result["overruns_day"] is True
+    late = result["itinerary"][2]
+    assert late["overruns_day"] is True and late["time"][1] == "23:59"
+    assert all(hh_mm <= "23:59" for item in result["itinerary"] for hh_mm in item["time"])
+
+
+def test_nothing_to_reorder():
+    result = solve_itinerary([stop("a", 0.0)])
+    assert result["order"] == [0] and result["travel_time_after"] == 0.0
+
+
+def test_matrix_prefers_cached_route_durations():
+    points = [{"lat": -12.0, "lng": -77.0}, {"lat": -12.01, "lng": -77.0}, {"lat": -12.02, "lng": -77.0}]
+    route_cache.set(route_key("foot-walking", points[0], points[2]),
+                    pack_leg({"duration": 4242.0, "distance": 2300.0, "polyline": None}))
+    estimated = travel_time_matrix(points, use_route_cache=False)
+    matrix = travel_time_matrix(points)
+    assert matrix[0, 2] == 4242.0
+    assert matrix[2, 0] == estimated[2, 0]
+    assert (matrix.diagonal() == 0).all()
@@ -23,7 +23,23 @@ export function useItineraryFetcher(formData, setItinerary) {
           budget: formData.budget || formData.price || null,
         }
 
-        const result = await fetchItinerary(payload)
+        setItinerary([])
+        // render places as they stream in; coordinates fill in as they resolve
+        const onEvent = (event) => {
+          if (cancelled) return
+          if (event.event === 'place') {
+            setItinerary(prev => {
+              const next = [...(prev || [])]
+              next[event.index] = { ...event.item, _pending: true }
+              return next
+            })
+          } else if (event.event === 'coordinates') {
+            setItinerary(prev => (prev || []).map((item, i) => (
+              i === event.index ? { ...item, coordinates: event.coordinates, _pending: false } : item
+            )))
+          }
+        }
+        const result = await fetchItinerary(payload, { onEvent })
         if (cancelled) return
 
         setItinerary(result.itinerary || [])
@@ -1,8 +1,8 @@
-import React, { useMemo, useEffect, useState } from 'react'
+import React, { useMemo, useEffect, useRef, useState } from 'react'
 import { MapContainer, TileLayer, Marker, Popup, useMap, Polyline } from 'react-leaflet'
 import L from 'leaflet'
 import 'leaflet/dist/leaflet.css'
-import { fetchPolylines } from './api'
+import { fetchItineraryRoutes } from './api'
 
 // Fix default icon URLs for Vite bundler (ensures marker images load)
 delete L.Icon.Default.prototype._getIconUrl
@@ -12,6 +12,10 @@ L.Icon.Default.mergeOptions({
   shadowUrl: new URL('leaflet/dist/images/marker-shadow.png', import.meta.url).href,
 })
 
+// Routes are simplified for this zoom: street-level detail without the
+// thousands of points a long leg has at full resolution
+const ROUTE_DETAIL_ZOOM = 16
+
 function FitBounds({ bounds }) {
   const map = useMap()
   useEffect(() => {
@@ -39,6 +43,8 @@ export default function MapView({ itinerary = [], initialCenter = [35.68, 139.76
   const bounds = points.map(p => [p.lat, p.lng])
   const center = (initialCenter && initialCenter.length) ? initialCenter : (points.length ? [points[0].lat, points[0].lng] : initialCenter)
   const [polylines, setPolylines] = useState([])
+  // version of the last routed itinerary; after an edit only changed segments are routed
+  const routeVersion = useRef(null)
 
   // Fetch polylines for consecutive itinerary points
   useEffect(() => {
@@ -55,10 +61,11 @@ export default function MapView({ itinerary = [], initialCenter = [35.68, 139.76
 
     const fetchRoutes = async () => {
       try {
-        const res = await fetchPolylines({ itinerary: payloadItin })
+        const res = await fetchItineraryRoutes(payloadItin, { baseVersion: routeVersion.current, zoom: ROUTE_DETAIL_ZOOM })
         if (cancelled) return
+        routeVersion.current = res.version
         // pick walk polyline if available, else car
-        const lines = (res || []).map(seg => {
+        const lines = (res.segments || []).map(seg => {
           const poly = seg.walk && seg.walk.polyline ? seg.walk.polyline : (seg.car && seg.car.polyline ? seg.car.polyline : null)
           return poly // may be null
         }).filter(Boolean)
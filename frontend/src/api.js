@@ -1,7 +1,11 @@
-export async function fetchItinerary(payload){
+export async function fetchItinerary(payload, { onEvent } = {}){
   // payload: { destination, month, preferences }
+  // With onEvent, the backend streams NDJSON events (place / coordinates / done)
+  // and onEvent is called for each one as it arrives; the promise still
+  // resolves to the final { destination, month, itinerary, optimization }.
   // TODO: add proper error handling, timeouts, and auth if needed
-  const res = await fetch('/api/generate_itinerary', {
+  const streaming = typeof onEvent === 'function'
+  const res = await fetch(streaming ? '/api/generate_itinerary?stream=ndjson' : '/api/generate_itinerary', {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify(payload)
@@ -10,39 +14,128 @@ export async function fetchItinerary(payload){
     const text = await res.text()
     throw new Error(`API Error ${res.status}: ${text}`)
   }
-  return res.json()
+  if (!streaming || !res.body || !(res.headers.get('Content-Type') || '').includes('ndjson')) {
+    return res.json()
+  }
+
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let buffered = ''
+  let result = null
+  const handleLine = (line) => {
+    if (!line.trim()) return
+    const event = JSON.parse(line)
+    if (event.event === 'error') throw new Error(`API Error: ${event.error}`)
+    if (event.event === 'done') result = event
+    onEvent(event)
+  }
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffered += decoder.decode(value, { stream: true })
+    const lines = buffered.split('\n')
+    buffered = lines.pop()
+    lines.forEach(handleLine)
+  }
+  handleLine(buffered + decoder.decode())
+  return result || { itinerary: [] }
 }
 
-export async function fetchGeocode({ places = [], location = '', country = '' } = {}) {
-  const res = await fetch('/api/geocode', {
-    method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ places, location, country })
-  })
+// Responses of idempotent POST endpoints, keyed by URL + body. Entries are
+// reused while fresh (Cache-Control max-age) and revalidated with their ETag
+// afterwards, so re-renders don't refetch identical geocodes or polylines.
+const responseCache = new Map()
+const RESPONSE_CACHE_SIZE = 100
+
+function maxAgeMs(cacheControl){
+  const match = /max-age=(\d+)/.exec(cacheControl || '')
+  return match && !/no-cache|no-store/.test(cacheControl) ? Number(match[1]) * 1000 : 0
+}
+
+async function postCached(url, payload, errorLabel){
+  const body = JSON.stringify(payload)
+  const key = `${url} ${body}`
+  const cached = responseCache.get(key)
+  if (cached && cached.freshUntil > Date.now()) return cached.data
+  const headers = { 'Content-Type': 'application/json' }
+  if (cached && cached.etag) headers['If-None-Match'] = cached.etag
+  const res = await fetch(url, { method: 'POST', headers, body })
+  if (res.status === 304 && cached) {
+    cached.freshUntil = Date.now() + maxAgeMs(res.headers.get('Cache-Control'))
+    return cached.data
+  }
   if (!res.ok) {
     // include response body (if any) in the thrown error to aid debugging
-    let body
-    try {
-      body = await res.text()
-    } catch (e) {
-      body = '<unreadable response body>'
-    }
-    throw new Error(`Geocode API error ${res.status}: ${body}`)
+    let text
+    try { text = await res.text() } catch (e) { text = '<unreadable response body>' }
+    throw new Error(`${errorLabel} ${res.status}: ${text}`)
+  }
+  const data = await res.json()
+  const cacheControl = res.headers.get('Cache-Control') || ''
+  if (!/no-store/.test(cacheControl)) {
+    responseCache.delete(key)
+    responseCache.set(key, { data, etag: res.headers.get('ETag'), freshUntil: Date.now() + maxAgeMs(cacheControl) })
+    if (responseCache.size > RESPONSE_CACHE_SIZE) responseCache.delete(responseCache.keys().next().value)
   }
-  return res.json() // expected: { "Place A": {lat, lng}, ... }
+  return data
 }
 
-export async function fetchPolylines(payload){
+export async function fetchGeocode({ places = [], location = '', country = '' } = {}) {
+  // expected: { "Place A": {lat, lng}, ... }
+  return postCached('/api/geocode', { places, location, country }, 'Geocode API error')
+}
+
+export function decodePolyline(encoded, precision = 5){
+  // Google encoded polyline -> [[lat, lng], ...]
+  const factor = Math.pow(10, precision)
+  const points = []
+  let index = 0, lat = 0, lng = 0
+  while (index < encoded.length) {
+    const deltas = [0, 0].map(() => {
+      let shift = 0, result = 0, b
+      do {
+        b = encoded.charCodeAt(index++) - 63
+        result |= (b & 0x1f) << shift
+        shift += 5
+      } while (b >= 0x20)
+      return (result & 1) ? ~(result >> 1) : (result >> 1)
+    })
+    lat += deltas[0]
+    lng += deltas[1]
+    points.push([lat / factor, lng / factor])
+  }
+  return points
+}
+
+export async function fetchPolylines(payload, { zoom } = {}){
   // payload: { itinerary: [...]} or { pairs: [...] }
-  const res = await fetch('/api/route_polylines', {
-    method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify(payload)
+  // Polylines are requested encoded (much smaller) and, with zoom, simplified
+  // server-side; they are decoded here so callers still get [[lat, lng], ...].
+  const segments = await postCached('/api/route_polylines',
+    { ...payload, format: 'encoded', ...(zoom != null ? { zoom } : {}) }, 'Route API error')
+  return decodeSegments(segments)
+}
+
+export async function fetchItineraryRoutes(itinerary, { baseVersion, zoom } = {}){
+  // Incremental routing: only segments the previous version (baseVersion)
+  // didn't have are routed. Returns { version, segments }; pass the version
+  // as baseVersion on the next call after the user edits the itinerary.
+  const res = await postCached('/api/route_polylines', {
+    itinerary, incremental: true, format: 'encoded',
+    ...(baseVersion ? { base_version: baseVersion } : {}),
+    ...(zoom != null ? { zoom } : {}),
+  }, 'Route API error')
+  return { ...res, segments: decodeSegments(res.segments) }
+}
+
+function decodeSegments(segments){
+  return (segments || []).map(seg => {
+    const out = { ...seg }
+    for (const mode of ['walk', 'car']) {
+      if (seg[mode] && typeof seg[mode].polyline === 'string') {
+        out[mode] = { ...seg[mode], polyline: decodePolyline(seg[mode].polyline) }
+      }
+    }
+    return out
   })
-  if (!res.ok) {
-    let body
-    try { body = await res.text() } catch (e) { body = '<unreadable response>' }
-    throw new Error(`Route API error ${res.status}: ${body}`)
-  }
-  return res.json()
-}
\ No newline at end of file
+}
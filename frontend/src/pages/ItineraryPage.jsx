@@ -10,6 +10,8 @@ export default function ItineraryPage({ formData = {}, itinerary = [], onBack, s
   const normalize = (s) => String(s || '').toLowerCase().normalize('NFD').replace(/[-\uFFFF]/g, '').replace(/[^a-z0-9]+/g, '')
   useEffect(() => {
     if (!itinerary || itinerary.length === 0) return
+    // items still streaming from the backend get their coordinates from the stream
+    if (itinerary.some(item => item && item._pending)) return
     const needsCoords = itinerary.some(item => !item.coordinates)
     if (!needsCoords) return
 